@@ -0,0 +1,52 @@
+"""
+Benchmark the tracking execution modes of the virtual accelerator.
+
+    python dev/benchmark_execution.py --name diag0 nc_hxr --repeats 20 --num_threads 4
+"""
+import argparse
+import time
+
+import numpy as np
+
+from simulation_server.factory import get_virtual_accelerator
+from simulation_server.virtual_accelerator.utils import configure_threads
+from simulation_server.virtual_accelerator.virtual_accelerator import EXECUTION_MODES
+
+
+def benchmark(name, execution_mode, repeats):
+    """Startup time (including compilation) and the time of each tracking, in seconds"""
+    start = time.perf_counter()
+    va = get_virtual_accelerator(name, execution_mode=execution_mode)
+    startup = time.perf_counter() - start
+
+    times = np.zeros(repeats)
+    for i in range(repeats):
+        start = time.perf_counter()
+        va.track()
+        times[i] = time.perf_counter() - start
+    return startup, times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the tracking execution modes.")
+    parser.add_argument("--name", nargs="+", default=["diag0", "nc_hxr"], choices=["diag0", "nc_injector", "nc_hxr"])
+    parser.add_argument("--execution_mode", nargs="+", default=list(EXECUTION_MODES), choices=list(EXECUTION_MODES))
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--num_threads", type=int, default=None)
+    parser.add_argument("--num_interop_threads", type=int, default=None)
+    args = parser.parse_args()
+
+    configure_threads(args.num_threads, args.num_interop_threads)
+
+    results = []
+    for name in args.name:
+        baseline = None
+        for mode in args.execution_mode:
+            startup, times = benchmark(name, mode, args.repeats)
+            median = np.median(times)
+            baseline = baseline or median
+            results.append((name, mode, startup, median, np.percentile(times, 90), baseline / median))
+
+    print(f"{'lattice':<12} {'mode':<10} {'startup [s]':>12} {'median [ms]':>12} {'p90 [ms]':>10} {'speed-up':>9}")
+    for name, mode, startup, median, p90, speedup in results:
+        print(f"{name:<12} {mode:<10} {startup:>12.2f} {median * 1e3:>12.2f} {p90 * 1e3:>10.2f} {speedup:>9.2f}")
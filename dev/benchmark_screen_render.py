@@ -0,0 +1,81 @@
+"""
+Benchmark the screen renderers against Cheetah's histogram on a screen the size of OTRDG02.
+
+    python dev/benchmark_screen_render.py --num_particles 100000 --repeats 20 --num_threads 4
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+from cheetah.accelerator import Screen
+from cheetah.particles import ParticleBeam
+
+from simulation_server.virtual_accelerator.screen_renderer import RENDERERS, render_screen
+from simulation_server.virtual_accelerator.utils import configure_threads
+
+
+def make_screen(num_particles, resolution=(1944, 1472), pixel_size=23.29e-6):
+    screen = Screen(
+        resolution=resolution,
+        pixel_size=torch.tensor([pixel_size, pixel_size]),
+        method="histogram",
+        is_active=True,
+    )
+    beam = ParticleBeam.from_parameters(
+        num_particles=num_particles,
+        sigma_x=torch.tensor(1e-3),
+        sigma_y=torch.tensor(7e-4),
+        total_charge=torch.tensor(1e-10),
+        energy=torch.tensor(90e6),
+    )
+    screen.track(beam)
+    return screen
+
+
+def benchmark(screen, renderer, repeats):
+    """Time of each rendering in seconds, and the last image"""
+    screen.renderer = renderer
+    times = np.zeros(repeats)
+    for i in range(repeats):
+        screen.set_read_beam(screen.get_read_beam())
+        start = time.perf_counter()
+        image = render_screen(screen)
+        times[i] = time.perf_counter() - start
+    return times, image
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the screen renderers.")
+    parser.add_argument("--num_particles", type=int, default=100000)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--factor", type=int, default=4, help="Resolution reduction of the binned renderer")
+    parser.add_argument("--num_samples", type=int, default=10000, help="Subsample of the splat renderer")
+    parser.add_argument("--num_threads", type=int, default=None)
+    args = parser.parse_args()
+
+    configure_threads(args.num_threads)
+
+    screen = make_screen(args.num_particles)
+    renderers = {
+        "cheetah": None,
+        "bincount": RENDERERS["bincount"](),
+        "binned": RENDERERS["binned"](factor=args.factor),
+        "splat": RENDERERS["splat"](num_samples=args.num_samples),
+    }
+    results = []
+    reference = None
+    for name, renderer in renderers.items():
+        times, image = benchmark(screen, renderer, args.repeats)
+        image = image.clone()
+        if reference is None:
+            reference, baseline = image, np.median(times)
+        # deviation from Cheetah's histogram, both smoothed over 8x8 pixels against shot noise
+        smooth = torch.nn.functional.avg_pool2d(image[None], 8)
+        smooth_reference = torch.nn.functional.avg_pool2d(reference[None], 8)
+        error = ((smooth - smooth_reference).abs().sum() / smooth_reference.abs().sum()).item()
+        results.append((name, np.median(times), np.percentile(times, 90), baseline / np.median(times), error))
+
+    print(f"{'renderer':<10} {'median [ms]':>12} {'p90 [ms]':>10} {'speed-up':>9} {'L1 error (8x8)':>15}")
+    for name, median, p90, speedup, error in results:
+        print(f"{name:<10} {median * 1e3:>12.2f} {p90 * 1e3:>10.2f} {speedup:>9.2f} {error:>15.4f}")
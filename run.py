@@ -1,42 +1,73 @@
-import os
-import pathlib
 import argparse
 
-from simulation_server.utils.load_yaml import load_relevant_controls
-from simulation_server.utils.pvdb import create_pvdb
-from simulation_server.beamdriver import SimDriver, SimServer
-from simulation_server.factory import get_virtual_accelerator
-from simulation_server.utils.default_params import default_nc_hxr, default_sc_diag0
-import lcls_tools.common.devices.yaml as yaml_directory
+from simulation_server.beamdriver import PROTOCOLS, SimDriver, SimServer
+from simulation_server.sessions import SessionManager, add_session_pvs
+from simulation_server.factory import get_pvdb, get_virtual_accelerator
+from simulation_server.utils.write_queue import OVERFLOW_POLICIES
+from simulation_server.utils.write_filter import LIMIT_POLICIES
+from simulation_server.utils.codec import CODECS
+from simulation_server.utils.recorder import Recorder
+from simulation_server.utils.snapshot import load_snapshot
+from simulation_server.virtual_accelerator.artifact_cache import DEFAULT_CACHE_DIR
+from simulation_server.virtual_accelerator.linear_optics import READBACK_CLASSES
+from simulation_server.virtual_accelerator.utils import configure_threads
+from simulation_server.virtual_accelerator.virtual_accelerator import EXECUTION_MODES, PRECISIONS
 import pprint
 
-FILEPATH= pathlib.Path(yaml_directory.__file__).parent.resolve()
-#FP= pathlib.Path(__file__).parent.resolve()
-def run_simulation_server(name, monitor_overview, measurement_noise_level, threaded):
-    if name == "diag0":
-        devices = load_relevant_controls(
-            [os.path.join( FILEPATH, "DIAG0.yaml")]
-        )
-        default_params = default_sc_diag0
-
-    elif name in ("nc_injector", 'nc_hxr'):
-        rel_areas = ["GUN.yaml", "L0.yaml", "DL1.yaml"]
-        filepaths = [os.path.join( FILEPATH, area) for area in rel_areas]
-        devices = load_relevant_controls(filepaths)
-        default_params = default_nc_hxr
-
-    else:
-        raise ValueError(f"Unknown virtual accelerator name: {name}")
-    
+def run_simulation_server(name, monitor_overview, measurement_noise_level, threaded,
+                          queue_size=0, queue_overflow="drop_oldest", image_codec=None, codec_level=1,
+                          beam_rate=0.0, beam_jitter=0.01, bsa_length=2800, record=None,
+                          restore=None, max_sessions=0, surrogate=None, linear_readbacks=(),
+                          execution_mode="eager", num_threads=None, num_interop_threads=None,
+                          precision="float32", cache_dir=None, limit_policy="clamp", suppress_unchanged=True,
+                          debounce=0.0, max_latency=0.0, adaptive_debounce=False, preempt=True,
+                          protocols="both", max_preemptions=3):
+    PVDB = get_pvdb(name, bsa_length=bsa_length if beam_rate > 0 else 0)
+    if max_sessions:
+        add_session_pvs(PVDB)
 
-    PVDB = create_pvdb(devices,default_params)
-
-    va = get_virtual_accelerator(name, monitor_overview, measurement_noise_level)
-    server = SimServer(PVDB, threading=threaded)
-    driver = SimDriver(server=server, virtual_accelerator=va)
+    configure_threads(num_threads, num_interop_threads)
+    va = get_virtual_accelerator(
+        name, monitor_overview, measurement_noise_level, surrogate=surrogate, linear_readbacks=linear_readbacks,
+        execution_mode=execution_mode, precision=precision, cache_dir=cache_dir,
+    )
+    recorder = Recorder(record) if record else None
+    server = SimServer(
+        PVDB, threading=threaded, image_codec=image_codec, codec_level=codec_level, protocols=protocols
+    )
+    driver = SimDriver(
+        server=server,
+        virtual_accelerator=va,
+        queue_size=queue_size,
+        queue_overflow=queue_overflow,
+        beam_rate=beam_rate,
+        beam_jitter=beam_jitter,
+        recorder=recorder,
+        limit_policy=limit_policy,
+        suppress_unchanged=suppress_unchanged,
+        debounce=debounce,
+        max_latency=max_latency,
+        adaptive_debounce=adaptive_debounce,
+        preempt=preempt,
+        max_preemptions=max_preemptions,
+    )
+    if restore:
+        driver.restore(load_snapshot(restore))
+    if max_sessions:
+        SessionManager(
+            driver, PVDB, max_sessions,
+            queue_size=queue_size, queue_overflow=queue_overflow, beam_rate=beam_rate, beam_jitter=beam_jitter,
+            limit_policy=limit_policy, suppress_unchanged=suppress_unchanged,
+            debounce=debounce, max_latency=max_latency, adaptive_debounce=adaptive_debounce, preempt=preempt,
+            max_preemptions=max_preemptions,
+        )
 
     print("Starting simulated server")
-    server.run()
+    try:
+        server.run()
+    finally:
+        if recorder:
+            recorder.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run the simulation server.")
@@ -64,8 +95,177 @@ if __name__ == "__main__":
         action="store_true",
         help="Enable threaded evaluation of the model, triggered with the VIRT:BEAM:SIMULATE PV"
     )
+    parser.add_argument(
+        "--queue_size",
+        type=int,
+        default=0,
+        help="Maximum number of distinct PVs waiting for a simulation (threaded mode only). 0 means unbounded.",
+    )
+    parser.add_argument(
+        "--queue_overflow",
+        type=str,
+        choices=list(OVERFLOW_POLICIES),
+        default="drop_oldest",
+        help="What to do with a new write when the write queue is full.",
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=0.0,
+        help="Seconds without writes before simulating (threaded mode), may be fractional.",
+    )
+    parser.add_argument(
+        "--max_latency",
+        type=float,
+        default=0.0,
+        help="Maximum seconds a write waits for a simulation while writes keep coming, 0 for no limit.",
+    )
+    parser.add_argument(
+        "--adaptive_debounce",
+        action="store_true",
+        help="Widen the debounce window to the duration of recent simulations, narrowing it again when idle.",
+    )
+    parser.add_argument(
+        "--no_preempt",
+        action="store_true",
+        help="Finish and publish every simulation, even when newer writes arrive while it runs.",
+    )
+    parser.add_argument(
+        "--max_preemptions",
+        type=int,
+        default=3,
+        help="Number of times newer writes may preempt a batch before it is finished and published regardless.",
+    )
+    parser.add_argument(
+        "--limit_policy",
+        type=str,
+        choices=list(LIMIT_POLICIES),
+        default="clamp",
+        help="What to do with setpoint writes outside of their DRVL/DRVH limits.",
+    )
+    parser.add_argument(
+        "--simulate_unchanged",
+        action="store_true",
+        help="Simulate setpoint writes that do not change the setpoint beyond its display precision, instead of ignoring them.",
+    )
+    parser.add_argument(
+        "--protocols",
+        type=str,
+        choices=list(PROTOCOLS),
+        default="both",
+        help="Serve the PVs over CA and PVA, or over one of them only (saves the memory and CPU of the other).",
+    )
+    parser.add_argument(
+        "--image_codec",
+        type=str,
+        choices=["none"] + list(CODECS),
+        default="none",
+        help="Compress image PVs served over PVA with this codec. Clients must support NTNDArray codecs.",
+    )
+    parser.add_argument(
+        "--codec_level",
+        type=int,
+        default=1,
+        help="Compression level for --image_codec, where the codec supports one.",
+    )
+
+    parser.add_argument(
+        "--beam_rate",
+        type=float,
+        default=0.0,
+        help="Emit jittered per-shot BPM and screen position readbacks into BSA-like HSTBR buffers at this rate in Hz. 0 disables beam-rate mode.",
+    )
+    parser.add_argument(
+        "--beam_jitter",
+        type=float,
+        default=0.01,
+        help="Shot-to-shot jitter in beam-rate mode, as a fraction of 1 mm for positions and of the charge for TMIT.",
+    )
+    parser.add_argument(
+        "--bsa_length",
+        type=int,
+        default=2800,
+        help="Number of shots kept in each HSTBR buffer in beam-rate mode.",
+    )
+    parser.add_argument(
+        "--record",
+        type=str,
+        default=None,
+        help="Record every write and published readback of the session to this HDF5 file (needs h5py).",
+    )
+    parser.add_argument(
+        "--restore",
+        type=str,
+        default=None,
+        help="Start from the setpoints in this snapshot JSON file, see simulation_server/utils/snapshot.py.",
+    )
+    parser.add_argument(
+        "--max_sessions",
+        type=int,
+        default=0,
+        help="Allow up to this many per-user sessions, created through VIRT:SESSION:CREATE. 0 disables sessions.",
+    )
+    parser.add_argument(
+        "--surrogate",
+        type=str,
+        default=None,
+        help="Predict readbacks with this surrogate model where it was trained, see simulation_server/virtual_accelerator/surrogate.py.",
+    )
+    parser.add_argument(
+        "--linear_readbacks",
+        type=str,
+        nargs="*",
+        choices=list(READBACK_CLASSES),
+        default=[],
+        help="Readback classes computed from cached first-order transfer maps instead of particle tracking. The server still tracks when any readback downstream of a write needs it, such as a screen image, so this mostly helps the headless API.",
+    )
+    parser.add_argument(
+        "--execution_mode",
+        type=str,
+        choices=list(EXECUTION_MODES),
+        default="eager",
+        help="Track in plain PyTorch (eager), under torch.inference_mode (inference), or also compiled with torch.compile (compiled).",
+    )
+    parser.add_argument(
+        "--num_threads",
+        type=int,
+        default=None,
+        help="Number of PyTorch intra-op threads used for tracking. Defaults to PyTorch's choice.",
+    )
+    parser.add_argument(
+        "--num_interop_threads",
+        type=int,
+        default=None,
+        help="Number of PyTorch inter-op threads used for tracking. Defaults to PyTorch's choice.",
+    )
+    parser.add_argument(
+        "--precision",
+        type=str,
+        choices=list(PRECISIONS),
+        default="float32",
+        help="Floating point precision of the lattice, beam and readbacks.",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=DEFAULT_CACHE_DIR,
+        help="Directory of the binary cache of parsed lattices and initial beams "
+        "(defaults to $SIMULATION_SERVER_CACHE or ~/.cache/simulation_server).",
+    )
+    parser.add_argument(
+        "--no_cache",
+        action="store_true",
+        help="Parse the lattice and initial beam on every start instead of using the cache.",
+    )
 
     args = parser.parse_args()
     run_simulation_server(
-        args.name, args.monitor_overview, args.measurement_noise_level, args.threaded
+        args.name, args.monitor_overview, args.measurement_noise_level, args.threaded,
+        args.queue_size, args.queue_overflow, args.image_codec, args.codec_level,
+        args.beam_rate, args.beam_jitter, args.bsa_length, args.record,
+        args.restore, args.max_sessions, args.surrogate, tuple(args.linear_readbacks),
+        args.execution_mode, args.num_threads, args.num_interop_threads, args.precision,
+        None if args.no_cache else args.cache_dir, args.limit_policy, not args.simulate_unchanged,
+        args.debounce, args.max_latency, args.adaptive_debounce, not args.no_preempt,
+        args.protocols, args.max_preemptions,
     )
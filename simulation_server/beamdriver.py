@@ -3,14 +3,82 @@ from pcaspy import Driver, SimpleServer
 from cheetah.particles import ParticleBeam
 import numpy as np
 from p4p.server.thread import SharedPV
-from p4p.nt import NTScalar, NTNDArray, NTEnum
+from p4p.server import StaticProvider
+from pcaspy.driver import manager
+from p4p.nt import NTScalar, NTNDArray, NTEnum, NTTable
 import p4p
 from typing import Dict, Callable, Any, Tuple
-from simulation_server.virtual_accelerator import VirtualAccelerator
+from simulation_server.virtual_accelerator import SimulationPreempted, VirtualAccelerator
 import threading
-from .utils.timer import Timer
+from .utils.debounce import DebounceScheduler
+from .utils.write_queue import WriteQueue, PRIORITY_CRITICAL, PRIORITY_NORMAL
+from .utils.write_filter import WriteFilter, REJECT, UNCHANGED
+from .utils.pv_cache import PVCache, same_value
+from .utils.codec import check_codec, compress_array, decompress_array
+from .utils.pvdb import ROLE_SETPOINT, ROLE_STATIC, ROLE_DERIVED, ROLE_READBACK, ROLE_BUFFER
+from .utils.ring_buffer import RingBuffer
+from .utils.recorder import Recorder
+from .utils.snapshot import (
+    SETPOINTS_PV,
+    SETPOINTS_COLUMNS,
+    SNAPSHOT_PV,
+    SNAPSHOT_COLUMNS,
+    snapshot_request,
+    snapshot_rows,
+    snapshot_table,
+    table_snapshot,
+)
 import pprint
 
+
+class CompressedNTNDArray(NTNDArray):
+    """
+    NTNDArray whose pixel data is compressed before posting, filling in the
+    codec and compressedSize fields like areaDetector's codec plugin does.
+    """
+
+    def __init__(self, codec: str, level: int = 1, **kws):
+        """
+        Parameters
+        ----------
+        codec : str
+            Codec name, see `utils.codec.CODECS`
+        level : int
+            Compression level, where the codec supports one
+        """
+        super().__init__(**kws)
+        self.codec = codec
+        self.level = level
+
+    def wrap(self, value, **kws):
+        """Wrap and compress numpy.ndarray as Value"""
+        value = np.asarray(value)
+        V = super().wrap(value, **kws)
+        data, type_code = compress_array(value, self.codec, self.level)
+        V["value"] = ("ubyteValue", data)
+        V["codec.name"] = self.codec
+        V["codec.parameters"] = type_code
+        V["compressedSize"] = data.size
+        return V
+
+    @classmethod
+    def unwrap(klass, value):
+        """Unwrap Value as NTNDArray, decompressing the pixel data"""
+        if not value.codec.name:
+            return super().unwrap(value)
+        data = decompress_array(
+            value.value, value.codec.name, value.codec.parameters, value.uncompressedSize
+        )
+        return data.view(klass.ntndarray)._store(value)
+
+
+# Protocols the PVs are served over
+#   both - CA and PVA
+#   ca   - CA only, no PVA PVs are built (nor the PVA-only setpoint table and snapshot RPC)
+#   pva  - PVA only, no CA records are created
+PROTOCOLS = ("both", "ca", "pva")
+
+
 class SimServer(SimpleServer):
     """
     Subclass of pcaspy.SimpleServer that also serves PVs via PVA
@@ -52,7 +120,15 @@ class SimServer(SimpleServer):
             self._subfield = subfield
 
         def put(self, pv, op):
-            pv.post(op.value(), timestamp=time.time())
+            # The update callback may refuse the write (e.g. a full write queue), and posts
+            # the value it accepted, which may differ from the written one (e.g. clamped)
+            name = op.name()[len(self.server.prefix):]
+            if self.server._callback:
+                if self.server._callback(name, op.value()) is False:
+                    op.done(error=f"Write to {op.name()} rejected")
+                    return
+            else:
+                pv.post(op.value(), timestamp=time.time())
             op.done()
 
             # Update the parent PV's subfield too
@@ -61,39 +137,149 @@ class SimServer(SimpleServer):
                 val[self._subfield] = op.value()
                 self._parent.post(val, timestamp=time.time())
 
-            if self.server._callback:
-                self.server._callback(op.name(), op.value())
+    class RpcHandler:
+        """
+        Handler for RPCs. Invokes the RPC callback with the request and a function to reply
+        with, which may be called later from another thread.
+        """
+
+        def __init__(self, server):
+            self.server = server
 
-    def __init__(self, pvdb: dict, prefix: str = "", threading: bool = True):
+        def rpc(self, pv, op):
+            name = op.name()[len(self.server.prefix):]
+            if not self.server._rpc_callback:
+                op.done(error=f"{op.name()} is not served")
+                return
+            try:
+                self.server._rpc_callback(name, op.value(), op.done)
+            except Exception as e:
+                op.done(error=f"{op.name()} failed: {e}")
+
+    def __init__(
+        self,
+        pvdb: dict,
+        prefix: str = "",
+        threading: bool = True,
+        image_codec: str | None = None,
+        codec_level: int = 1,
+        port: str = "default",
+        parent: "SimServer | None" = None,
+        protocols: str = "both",
+    ):
         """
         Parameters
         ----------
         pvdb : dict
             Dict describing all records and their fields
         prefix : str
-            PV name prefix
+            PV name prefix, PV names passed to and from the driver never include it
         threading : bool
             When set to True, enables threading and SIMULATE PV behavior
+        image_codec : str | None
+            Default PVA compression for image PVs (see `utils.codec.CODECS`), None to send them uncompressed.
+            Records may override this with their own "codec" entry ("none" to disable).
+        codec_level : int
+            Compression level, where the codec supports one
+        port : str
+            pcaspy port connecting the CA PVs to their driver, each server sharing a process
+            needs its own
+        parent : SimServer | None
+            If provided, serve the PVs through the CA and PVA servers of this server instead of
+            starting new ones, and default to its image compression and protocols. Used for sessions.
+        protocols : str
+            Protocols to serve the PVs over, one of PROTOCOLS. Records of the other protocol
+            are not built at all.
         """
+        if parent is not None and image_codec is None:
+            image_codec, codec_level = parent._image_codec, parent._codec_level
+        if parent is not None:
+            protocols = parent._protocols
+        if protocols not in PROTOCOLS:
+            raise ValueError(f"Unknown protocols {protocols}, expected one of {PROTOCOLS}")
+        self._protocols = protocols
         self._pva: Dict[str, SharedPV] = {}
+        self._provider = parent._provider if parent else StaticProvider("simulation_server")
+        self._parent = parent
+        self._prefix = prefix
+        self._port = port
+        self._image_codec = check_codec(image_codec)
+        self._codec_level = codec_level
         self._callback = None
+        self._rpc_callback = None
         self._db = pvdb
         self._threaded = threading
         self.unassoc_pvs = ['STATCTRLSUB.T']
         # Add a PV to indicate both simulation status and to trigger simulation
         self.sim_pv_name = "VIRT:BEAM:SIMULATE"
         self._db[self.sim_pv_name] = {
-            "value": 0
+            "value": 0,
+            "role": ROLE_STATIC,
         }
+        # Debounce window and maximum latency of simulations after writes
         self.sim_timeout_name = "VIRT:BEAM:SIMULATE_TIMEOUT"
         self._db[self.sim_timeout_name] = {
-            "value": 0
+            "value": 0,
+            "prec": 3,
+            "unit": "s",
+            "role": ROLE_STATIC,
+        }
+        self.sim_max_latency_name = "VIRT:BEAM:SIMULATE_MAX_LATENCY"
+        self._db[self.sim_max_latency_name] = {
+            "value": 0,
+            "prec": 3,
+            "unit": "s",
+            "role": ROLE_STATIC,
+        }
+        # Write queue backpressure status, so clients can throttle themselves
+        self.queue_depth_name = "VIRT:BEAM:QUEUE_DEPTH"
+        self._db[self.queue_depth_name] = {
+            "type": "int",
+            "value": 0,
+            "role": ROLE_STATIC,
+        }
+        self.queue_age_name = "VIRT:BEAM:QUEUE_AGE"
+        self._db[self.queue_age_name] = {
+            "value": 0.0,
+            "prec": 3,
+            "unit": "s",
+            "role": ROLE_STATIC,
+        }
+        self.queue_dropped_name = "VIRT:BEAM:QUEUE_DROPPED"
+        self._db[self.queue_dropped_name] = {
+            "type": "int",
+            "value": 0,
+            "role": ROLE_STATIC,
+        }
+        # Number of simulations whose results have been published
+        self.generation_name = "VIRT:BEAM:GENERATION"
+        self._db[self.generation_name] = {
+            "type": "int",
+            "value": 0,
+            "role": ROLE_STATIC,
         }
 
-        # Create CA PVs
-        self.createPV(prefix, self._db)
+        self.setpoints_name = SETPOINTS_PV
+        self.snapshot_name = SNAPSHOT_PV
 
-        # Create PVA PVs
+        # Create CA PVs
+        if self.serves_ca:
+            if port != "default":
+                for v in self._db.values():
+                    v["port"] = port
+            self.createPV(prefix, self._db)
+
+        if self.serves_pva:
+            self._build_pva_pvs()
+        self.sim_pv = self._pva.get(f"{prefix}{self.sim_pv_name}")
+
+        # Sessions share the CA server of their parent
+        if parent is None and self.serves_ca:
+            super().__init__()
+
+    def _build_pva_pvs(self):
+        """Create the PVA PVs of every record, and the PVA-only table PVs"""
+        prefix = self._prefix
         for k, v in self._db.items():
             # Get last field
             s = k.rsplit(':', 1)[-1]
@@ -103,11 +289,30 @@ class SimServer(SimpleServer):
                 continue
             else:
                self._pva.update(self._build_pv(f"{prefix}{k}", v, True))
-        
-        
-        self.sim_pv = self._pva[self.sim_pv_name]
 
-        super().__init__()
+        # Setpoint snapshot as a table (PVA only), putting a table restores it
+        self._pva[f"{prefix}{self.setpoints_name}"] = SharedPV(
+            nt=NTTable(SETPOINTS_COLUMNS),
+            initial=snapshot_table({
+                k: v.get("value", 0) for k, v in self._db.items() if v.get("role") == ROLE_SETPOINT
+            }),
+            handler=SimServer.UpdateHandler(self),
+        )
+
+        # Bulk reads of any PVs as a table (PVA RPC only)
+        self._pva[f"{prefix}{self.snapshot_name}"] = SharedPV(handler=SimServer.RpcHandler(self))
+
+        for k, pv in self._pva.items():
+            self._provider.add(k, pv)
+
+    def remove(self):
+        """Stop serving the PVs of this server, used to destroy sessions"""
+        for k in self._db:
+            manager.pvf.pop(f"{self._prefix}{k}", None)
+        manager.pvs.pop(self._port, None)
+        manager.driver.pop(self._port, None)
+        for k in self._pva:
+            self._provider.remove(k)
 
     def set_update_callback(self, callable: Callable[[str, Any], Any]):
         """
@@ -120,15 +325,43 @@ class SimServer(SimpleServer):
         """
         self._callback = callable
 
+    def set_rpc_callback(self, callable: Callable[[str, Any, Callable], Any]):
+        """
+        Sets the RPC callback. This will be invoked with the PV name, the request and a
+        function to call with the reply value (or `error=` message) when an RPC is made
+
+        Parameters
+        ----------
+        callable : Callable
+            Method to use, or none to clear
+        """
+        self._rpc_callback = callable
+
     def run(self):
-        self._server = p4p.server.Server(providers=[self._pva])
+        if self.serves_pva:
+            self._server = p4p.server.Server(providers=[self._provider])
         while True:
-            self.process(0.001)
+            if self.serves_ca:
+                self.process(0.001)
+            else:
+                time.sleep(1.0)
+
+    @property
+    def serves_ca(self) -> bool:
+        return self._protocols in ("both", "ca")
+
+    @property
+    def serves_pva(self) -> bool:
+        return self._protocols in ("both", "pva")
 
     @property
     def threaded(self) -> bool:
         return self._threaded
 
+    @property
+    def prefix(self) -> str:
+        return self._prefix
+
     @property
     def pva_pvs(self) -> Dict[str, SharedPV]:
         """Returns list of PVs served by PVA"""
@@ -137,7 +370,7 @@ class SimServer(SimpleServer):
     @property
     def pvdb(self) -> dict:
         """Returns the PV database"""
-        return self.pvdb
+        return self._db
 
     def _type_desc(self, t) -> str:
         """
@@ -185,11 +418,12 @@ class SimServer(SimpleServer):
         Parameters
         ----------
         name : str
-            Full name of PV including field
+            Name of PV including field, without the server prefix
         value : Any
             Value to set
         """
-        self._pva[name].post(value, timestamp=time.time())
+        if self.serves_pva:
+            self._pva[f"{self._prefix}{name}"].post(value, timestamp=time.time())
 
     def _build_nt(self, desc: dict, assoc: bool) -> Tuple[Any, Any, bool]:
         """
@@ -198,7 +432,9 @@ class SimServer(SimpleServer):
         Policy
         ------
         - `assoc` controls whether NT metadata (control/display/valueAlarm) is included.
-        - Image PVs are inferred from (count + n_col) fields.
+        - Image PVs are inferred from (count + n_col) fields, and are compressed
+          with the record's "codec" or the server's default image codec.
+        - Other float PVs with a count are waveforms, zero filled like their CA counterpart.
         """
 
         pv_type = desc.get("type", "float")
@@ -209,6 +445,16 @@ class SimServer(SimpleServer):
 
         match pv_type:
 
+            case _ if "count" in desc and "n_col" in desc:
+                # Image / array case, integer images carry their camera dtype
+                codec = check_codec(desc.get("codec", self._image_codec))
+                nt = CompressedNTNDArray(codec, self._codec_level) if codec else NTNDArray()
+                default = np.zeros(
+                    (desc["n_col"], desc["n_row"]),
+                    dtype=desc.get("dtype", float),
+                )
+                is_image = True
+
             case "enum":
                 nt = NTEnum(**meta)
                 default = {
@@ -216,18 +462,18 @@ class SimServer(SimpleServer):
                     "choices": desc["enums"],
                 }
 
+            case "float" if desc.get("count", 1) > 1:
+                nt = NTScalar("ad", **meta)
+                default = np.zeros(desc["count"])
+
+            case "string":
+                nt = NTScalar("s")
+                default = desc.get("value", "")
+
             case "int":
                 nt = NTScalar("i", **meta)
                 default = desc.get("value", 0)
 
-            case "float" if "count" in desc and "n_col" in desc:
-                # Image / array case
-                nt = NTNDArray()
-                default = np.zeros(
-                    (desc["n_col"], desc["n_row"]),
-                    dtype=float,
-                )
-                is_image = True
 
             case "float":
                 nt = NTScalar("d", **meta)
@@ -278,7 +524,10 @@ class SimServer(SimpleServer):
         nt, default, is_image = self._build_nt(desc, assoc)
 
         # Special control fields and status fields
-        controls = ["enums", "type", "value", "count", "n_col", "n_row"]
+        controls = [
+            "enums", "type", "value", "count", "n_col", "n_row", "codec", "dtype", "bit_depth", "role", "source",
+            "jitter", "port",
+        ]
 
         # Add value field
         val_pv = SharedPV(
@@ -329,88 +578,301 @@ class SimServer(SimpleServer):
 
 
 class SimDriver(Driver):
+    # Beam-rate mode publishes the history buffers at most this often, in seconds
+    bsa_publish_period = 0.1
+
     def __init__(
-        self, server: SimServer, virtual_accelerator: VirtualAccelerator
+        self,
+        server: SimServer,
+        virtual_accelerator: VirtualAccelerator,
+        queue_size: int = 0,
+        queue_overflow: str = "drop_oldest",
+        beam_rate: float = 0.0,
+        beam_jitter: float = 0.0,
+        recorder: Recorder | None = None,
+        limit_policy: str = "clamp",
+        suppress_unchanged: bool = True,
+        debounce: float = 0.0,
+        max_latency: float = 0.0,
+        adaptive_debounce: bool = False,
+        preempt: bool = True,
+        max_preemptions: int = 3,
     ):
-        super().__init__()
+        """
+        Parameters
+        ----------
+        server : SimServer
+            Server hosting the PVs
+        virtual_accelerator : VirtualAccelerator
+            Model to drive
+        queue_size : int
+            Maximum number of distinct PVs waiting for a simulation, 0 for unbounded
+        queue_overflow : str
+            What to do with writes when the queue is full, see `utils.write_queue.OVERFLOW_POLICIES`
+        beam_rate : float
+            Shot rate in Hz of the beam-rate mode filling the BSA-like history buffers, 0 to disable
+        beam_jitter : float
+            Shot-to-shot jitter added to the last simulated readbacks, relative to the jitter
+            scale of each BSA signal (its pvdb "jitter", see `utils.pvdb.BSA_JITTER`)
+        recorder : Recorder | None
+            If provided, records every write and every readback published after a simulation
+        limit_policy : str
+            What to do with setpoint writes outside of their DRVL/DRVH limits, see
+            `utils.write_filter.LIMIT_POLICIES`
+        suppress_unchanged : bool
+            Whether setpoint writes within the deadband of the current value are ignored
+            instead of simulated, see `utils.write_filter.WriteFilter`
+        debounce : float
+            Seconds without writes before a simulation runs in threaded mode, also set with
+            VIRT:BEAM:SIMULATE_TIMEOUT
+        max_latency : float
+            Maximum seconds a write waits for a simulation while writes keep coming, 0 for no
+            limit, also set with VIRT:BEAM:SIMULATE_MAX_LATENCY
+        adaptive_debounce : bool
+            Whether the debounce window widens to the duration of recent simulations, see
+            `utils.debounce.DebounceScheduler`
+        preempt : bool
+            Whether a simulation in threaded mode is abandoned and started over when newer
+            writes arrive while it runs, so obsolete results are never published. A batch is
+            no longer preempted once it has waited for `max_latency` (if set).
+        max_preemptions : int
+            Number of times a batch may be preempted before it is finished regardless, so a
+            steady stream of writes can not keep the readbacks from ever being published
+        """
+        # The parameter library of pcaspy only exists for CA records
+        self._ca = server.serves_ca
+        if self._ca:
+            super().__init__()
+        else:
+            self.pvDB = {}
         self.virtual_accelerator = virtual_accelerator
 
         self.server = server
+        self.recorder = recorder
 
         self.server.set_update_callback(self.write)
-
-        # PV data cache and associated primitives
-        self.pv_cache = {}
-        self.pv_guard = threading.Lock()
+        self.server.set_rpc_callback(self.rpc)
+
+        # PV data cache and associated primitives. Neither reads nor single PV updates wait
+        # for a simulation's results to be published, only the bulk publishes (readbacks,
+        # BSA buffers) are serialized, so they go out in the order they entered the cache
+        self.pv_cache = PVCache()
+        self.post_guard = threading.Lock()
+        # Last value posted to the monitors of every PV, unchanged values are not posted again
+        self._published = {}
         self.write_guard = threading.Lock()
         self.thread_cond = threading.Condition(self.write_guard)
         self.thread = threading.Thread(target=self._model_update_thread)
-        self.new_data = {}
+        self.write_queue = WriteQueue(
+            queue_size, queue_overflow, priority=self._write_priority, on_evict=self._rollback_write
+        )
+        # Last value handed to the model of every queued PV, what a dropped write rolls back to
+        self._applied = {}
+        # Set while no write is waiting for or going through a simulation
+        self.idle = threading.Event()
+        self.idle.set()
+        # Snapshot requests waiting for the driver to become idle, as (patterns, reply)
+        self._snapshot_waiters = []
+        self.running = True
+        # Callbacks of PVs handled outside the model, such as session control, by PV name
+        self.control_handlers: Dict[str, Callable[[Any], bool]] = {}
         self.omitted = []
 
-        # Configure for instant simulation by default
-        self.timer = Timer(0, self._trigger_sim, periodic=True, manual=True)
+        # Integer images are unsigned, CA carries them as signed DBF_SHORT/DBF_LONG
+        self._ca_dtypes = {
+            k: np.int16 if v["type"] == "short" else np.int32
+            for k, v in self.server.pvdb.items()
+            if "dtype" in v
+        }
 
-        # get list of pvs that should be updated every time we write to a PV
+        # Simulate right after the last write by default
+        self.scheduler = DebounceScheduler(
+            self._trigger_sim, debounce, max_latency, adaptive=adaptive_debounce
+        )
+        self.preempt = preempt
+        self.max_preemptions = max_preemptions
+
+        # Sort PVs by the role create_pvdb gave them: readbacks are updated every time we
+        # write to a PV, derived PVs only when one of their setpoints is written
+        self.setpoint_pvs = self.get_pvs_by_role(ROLE_SETPOINT)
+        self.write_filter = WriteFilter(
+            self.server.pvdb, self.pv_cache.get, limit_policy, suppress_unchanged
+        )
+        self._filtered_pvs = set(self.setpoint_pvs)
         self.measurement_pvs = self.get_measurement_pvs()
+        self.derived_pvs = self.get_derived_pvs()
+
+        # BSA-like history buffers and the readbacks they record
+        self.beam_rate = beam_rate
+        self.beam_jitter = beam_jitter
+        self.bsa_pvs = self.get_pvs_by_role(ROLE_BUFFER)
+        self.bsa_sources = [self.server.pvdb[k]["source"][0] for k in self.bsa_pvs]
+        # (absolute, relative) jitter of every buffer's readback at a beam jitter of 1
+        self.bsa_jitter = np.array(
+            [self.server.pvdb[k].get("jitter", (1.0, 0.0)) for k in self.bsa_pvs], dtype=float
+        ).reshape(-1, 2)
+        self.bsa_buffer = RingBuffer(
+            len(self.bsa_pvs),
+            max([self.server.pvdb[k]["count"] for k in self.bsa_pvs], default=1),
+        )
+        self.beam_thread = threading.Thread(target=self._beam_rate_thread)
+
+        # Lattice position of every readback, so a write only refreshes the ones downstream of it
+        self.readback_positions = {
+            k: self.virtual_accelerator.get_pv_position(k) for k in self.measurement_pvs
+        }
 
         # init PV cache with all variables (including informational ones)
-        key_list = list(self.server.pva_pvs.keys())
-        for k in key_list:
-            self.pv_cache[k] = self.server.pva_pvs[k].current()
+        prefix = self.server.prefix
+        if self.server.serves_pva:
+            self.pv_cache.update({
+                k[len(prefix):]: pv.current() for k, pv in self.server.pva_pvs.items() if pv.isOpen()
+            })
+        else:
+            self.pv_cache.update({k: data.value for k, data in self.pvDB.items()})
+        self.set_cached_values(
+            {
+                self.server.sim_timeout_name: float(debounce),
+                self.server.sim_max_latency_name: float(max_latency),
+            },
+            True,
+        )
 
-        # Initialize the cache
+        # Initialize the cache, setpoints start out at the model's values
+        self._read_model_setpoints()
         self.update_cache(self.measurement_pvs, False)
 
-        # Map BACT initial value to BCTRL
-        for k in self.measurement_pvs:
-            if not k.endswith(':BACT') or k in self.omitted:
-                continue
-            self.set_cached_value(k.replace(':BACT', ':BCTRL'), self.cached_value(k), True)
-
         # Run an initial update (this will also propagate CA/PVA changes)
-        new_data = {x: self.pv_cache[x] for x in self.measurement_pvs}
+        new_data = {x: self.pv_cache[x] for x in self.setpoint_pvs}
         self._set_and_simulate(new_data)
 
         self.thread.start()
         if self.server.threaded:
-            self.timer.start()
+            self.scheduler.start()
+        if self.beam_rate > 0 and self.bsa_pvs:
+            self.beam_thread.start()
+
+    def stop(self):
+        """
+        Stop the model, scheduler and beam-rate threads, used to destroy sessions. Waits for
+        a simulation in progress, so nothing is published once this returns.
+        """
+        self.running = False
+        with self.write_guard:
+            self.thread_cond.notify_all()
+            waiters, self._snapshot_waiters = self._snapshot_waiters, []
+        self.scheduler.stop()
+        for thread in (self.thread, self.beam_thread):
+            if thread.is_alive() and thread is not threading.current_thread():
+                thread.join()
+        for _, reply in waiters:
+            reply(error="Simulation stopped")
+
+    def wait_idle(self, timeout: float | None = None) -> bool:
+        """
+        Wait until every accepted write has been simulated and published.
+        Returns False if the timeout expired first.
+        """
+        return self.idle.wait(timeout)
 
     def _trigger_sim(self):
         with self.write_guard:
             self.thread_cond.notify_all()
 
-    def _set_and_simulate(self, new_data: dict):
-        """Updates PVs on the model, then updates the PV cache with results"""
+    def _write_priority(self, name: str) -> int:
+        """Shutter and reset writes are applied before anything else queued with them"""
+        if name in ("VIRT:BEAM:RESET_SIM", self.virtual_accelerator.beam_shutter_pv):
+            return PRIORITY_CRITICAL
+        return PRIORITY_NORMAL
+
+    def _ca_value(self, name: str, value: Any) -> Any:
+        """Convert a value to the type its CA record carries"""
+        dtype = self._ca_dtypes.get(name)
+        if dtype is None or not isinstance(value, np.ndarray):
+            return value
+        # 12 bit frames fit in int16, so no copy is needed
+        if value.dtype.itemsize == np.dtype(dtype).itemsize:
+            return value.view(dtype)
+        return value.astype(dtype)
+
+    def _superseded(self, batch_start: float) -> bool:
+        """
+        Whether writes queued since a simulation started make its results obsolete. Once the
+        batch has waited for the maximum latency, its results are published regardless, as
+        they are after `max_preemptions` restarts.
+        """
+        if len(self.write_queue) == 0:
+            return False
+        max_latency = self.scheduler.max_latency
+        return max_latency <= 0 or time.time() - batch_start < max_latency
+
+    def publish_queue_status(self):
+        """Post the write queue depth, age of the oldest pending write and drop count"""
+        self.set_cached_values(
+            {
+                self.server.queue_depth_name: self.write_queue.depth,
+                self.server.queue_age_name: self.write_queue.oldest_age(),
+                self.server.queue_dropped_name: self.write_queue.dropped,
+            },
+            True,
+        )
+
+    def _set_and_simulate(self, new_data: dict, preempt: Callable[[], bool] | None = None):
+        """
+        Updates PVs on the model, then updates the PV cache with results. If `preempt`
+        returns True while tracking or reading back, raises `SimulationPreempted` before
+        anything is published.
+        """
         start = time.time()
 
-        for k in new_data.keys():
-            if k in self.omitted:
-                continue
-            try:
-                self.virtual_accelerator.set_pvs({k: new_data[k]})
-            except AttributeError:
-                pass # Added to the omitted list later
-            except ValueError:
-                pass # Usually this means the attribute has no set method. Just going to ignore
+        # Apply all new values at once, and one by one if the model can not apply some of them
+        applicable = {k: v for k, v in new_data.items() if k not in self.omitted}
+        try:
+            self.virtual_accelerator.set_pvs(applicable, track=False)
+        except (AttributeError, ValueError):
+            for k, v in applicable.items():
+                try:
+                    self.virtual_accelerator.set_pvs({k: v}, track=False)
+                except AttributeError:
+                    pass # Added to the omitted list later
+                except ValueError:
+                    pass # Usually this means the attribute has no set method. Just going to ignore
+        # Track once for all of the new values, or not at all if linear readbacks serve all of
+        # the readbacks to publish, never for some of them only
+        pv_list = self.get_downstream_pvs(new_data) + self.get_changed_derived_pvs(new_data)
+        self.virtual_accelerator.update_readings(preempt, pv_list)
 
         # update PV cache with new values, pump monitors
-        self.update_cache(self.measurement_pvs, True)
+        generation = self.pv_cache.get(self.server.generation_name, 0) + 1
+        self.update_cache(pv_list, True, preempt, {self.server.generation_name: generation})
+
+        # A reset moves every setpoint back to its lattice value
+        if "VIRT:BEAM:RESET_SIM" in new_data:
+            self._read_model_setpoints()
+        self.publish_setpoints()
 
         print(f"Simulation took {time.time() - start:.3f} seconds")
 
     def _model_update_thread(self):
-        while True:
+        while self.running:
             # Unlocked by thread_cond.wait()
             self.write_guard.acquire()
 
-            # Wait for a trigger if no additional data is ready (unlocks write_guard)
-            if len(self.new_data.keys()) == 0:
+            # Wait for a trigger if no additional data is ready, or if writes that arrived
+            # during the last simulation are still within their debounce window (unlocks write_guard)
+            if len(self.write_queue) == 0 or self.scheduler.pending:
                 self.thread_cond.wait()
-
-            # Grab updated data
-            new_data = self.new_data.copy()
-            self.new_data = {}
+            if not self.running:
+                self.write_guard.release()
+                break
+
+            # Report how far behind we were, then grab updated data in priority order
+            self.publish_queue_status()
+            batch_start = time.time() - self.write_queue.oldest_age()
+            new_data = dict(self.write_queue.drain())
+            self._applied.update(new_data)
+            # These writes no longer need a trigger
+            self.scheduler.cancel()
 
             # Done with the write guard
             self.write_guard.release()
@@ -419,47 +881,239 @@ class SimDriver(Driver):
 
             start = time.time()
 
-            # run simulation
-            self._set_and_simulate(new_data)
+            # run simulation, starting over with the newest values when writes supersede it,
+            # at most max_preemptions times
+            preemptions = 0
+            preempt = (
+                (lambda: preemptions < self.max_preemptions and self._superseded(batch_start))
+                if self.preempt else None
+            )
+            while True:
+                try:
+                    self._set_and_simulate(new_data, preempt)
+                    break
+                except SimulationPreempted:
+                    preemptions += 1
+                    with self.write_guard:
+                        newer = dict(self.write_queue.drain())
+                        self._applied.update(newer)
+                        self.scheduler.cancel()
+                    print(f"Simulation preempted by writes to {len(newer)} PVs, restarting")
+                    # Newer writes keep their priority order, after the older ones they do not replace
+                    new_data = {k: v for k, v in new_data.items() if k not in newer}
+                    new_data.update(newer)
+            self.scheduler.record_duration(time.time() - start)
 
             # Indicate that we're done simulating
             self.set_cached_value(self.server.sim_pv_name, 0, True)
+            self.publish_queue_status()
+            with self.write_guard:
+                waiters = []
+                if len(self.write_queue) == 0:
+                    self.idle.set()
+                    waiters, self._snapshot_waiters = self._snapshot_waiters, []
+            for patterns, reply in waiters:
+                self._reply_snapshot(patterns, reply)
+
 
+    def rpc(self, reason: str, request: Any, reply: Callable):
+        """
+        Serve an RPC. A snapshot request (see `utils.snapshot.snapshot_request`) is replied to
+        with the values of the selected PVs from one generation of the cache, right away or,
+        with the wait flag, once every write accepted before it has been simulated.
+        """
+        if reason != self.server.snapshot_name:
+            reply(error=f"No RPC {reason}")
+            return
+        patterns, wait = snapshot_request(request)
+        if wait:
+            with self.write_guard:
+                if not self.idle.is_set():
+                    self._snapshot_waiters.append((patterns, reply))
+                    return
+        self._reply_snapshot(patterns, reply)
+
+    def _reply_snapshot(self, patterns: list, reply: Callable):
+        """Reply to a snapshot request with an NTTable tagged with the simulation generation"""
+        values = self.pv_cache.snapshot()
+        try:
+            rows = snapshot_rows(values, patterns)
+        except (KeyError, ValueError) as e:
+            reply(error=e.args[0])
+            return
+        table = NTTable(SNAPSHOT_COLUMNS).wrap(rows, timestamp=time.time())
+        table["timeStamp.userTag"] = values.get(self.server.generation_name, 0)
+        reply(table)
+
+    def snapshot(self) -> dict:
+        """Get the current value of every setpoint"""
+        values = {}
+        for name in self.setpoint_pvs:
+            try:
+                values[name] = self._setpoint_value(name, self.cached_value(name))
+            except (TypeError, ValueError):
+                print(f"Can not snapshot {name} = {self.cached_value(name)}")
+        return values
+
+    def restore(self, values: dict) -> bool:
+        """
+        Apply a snapshot of setpoints as one bulk update followed by a single simulation.
+        PVs that are not setpoints are ignored. Values are held to the drive limits like
+        single writes; returns False if any is rejected, the others are still restored.
+        """
+        setpoints = set(self.setpoint_pvs)
+        checked, rejected = {}, False
+        for name, value in values.items():
+            if name not in setpoints:
+                continue
+            verdict, value = self.write_filter.check(name, self._setpoint_value(name, value))
+            if verdict == REJECT:
+                print(f"Rejected restore of {float(value)} to {name}, outside of its drive limits")
+                rejected = True
+            elif verdict != UNCHANGED:
+                checked[name] = value
+        values = checked
+        previous = {k: self.pv_cache.get(k) for k in values}
+        for name, value in values.items():
+            self.set_cached_value(name, value, True)
+            if self.recorder:
+                self.recorder.record_write(name, value)
+
+        if not values:
+            return not rejected
+
+        if not self.server.threaded:
+            self._set_and_simulate(values)
+            return not rejected
+
+        # Skip the simulation timeout, the restore is complete already
+        with self.write_guard:
+            for name, value in previous.items():
+                self._applied.setdefault(name, value)
+            self.write_queue.put_many(values)
+            self.idle.clear()
+            self.scheduler.cancel()
+            self.thread_cond.notify_all()
+        self.publish_queue_status()
+        return not rejected
+
+    def publish_setpoints(self):
+        """Post the setpoint snapshot table"""
+        self.server.set_pv(self.server.setpoints_name, snapshot_table(self.snapshot()))
+
+    def _setpoint_value(self, name: str, value: Any) -> int | float:
+        """Plain number of a setpoint, like CA clients write them"""
+        if self.server.pvdb[name].get("type") in ("int", "enum"):
+            return int(value)
+        return float(value)
+
+    def get_pvs_by_role(self, role: str) -> list:
+        """
+        Get the PVs of a role, see `utils.pvdb.ROLES`. PVs without a role are treated as static.
+        """
+        return [k for k, v in self.server.pvdb.items() if v.get("role", ROLE_STATIC) == role]
+
+    def _beam_rate_thread(self):
+        """
+        Generates shots at the beam rate by jittering the last simulated readbacks,
+        without re-tracking, and publishes the history buffers in batches.
+        """
+        period = max(1.0 / self.beam_rate, self.bsa_publish_period)
+        last = time.time()
+        due = 0.0
+        while self.running:
+            time.sleep(period)
+            if not self.running:
+                break
+            now = time.time()
+            due += (now - last) * self.beam_rate
+            last = now
+            n_shots = int(due)
+            if n_shots == 0:
+                continue
+            due -= n_shots
+
+            values = self.pv_cache.snapshot()
+            centre = np.array([float(values.get(k) or 0.0) for k in self.bsa_sources])
+            sigma = self.beam_jitter * (self.bsa_jitter[:, 0] + self.bsa_jitter[:, 1] * np.abs(centre))
+            jitter = np.random.normal(0.0, 1.0, (len(centre), n_shots)) * sigma[:, None]
+            self.bsa_buffer.extend(centre[:, None] + jitter)
+            self.publish_bsa()
+
+    def publish_bsa(self):
+        """Post the shot history of every BSA-like buffer"""
+        history = dict(zip(self.bsa_pvs, self.bsa_buffer.history()))
+        with self.post_guard:
+            self.pv_cache.update(history)
+            for name, values in history.items():
+                self.server.set_pv(name, values)
+                if self._ca:
+                    self.setParam(name, values)
+            if self._ca:
+                self.updatePVs()
 
     def get_measurement_pvs(self):
         """Get a list of PVs that should be updated every time we write to a PV"""
-        key_list = list(self.server.pva_pvs.keys())
-
-        # filter out keys with attributes
-        key_list = [k for k in key_list if not "." in k]
-
-        # filter out keys that will not be updated
-        ignore_flags = [
-            "BMAX",
-            "BMIN",
-            "BDES",
-            "BCON",
-            "ArraySize0_RBV",
-            "ArraySize1_RBV",
-            "RESOLUTION",
-            "ENB",
-            "BST",
-            "MODE",
-            "ENABLE",
-            "SIMULATE",
-            "REQ",
-            "CTRL",
-            "TMIT",
-            "STATCTRLSUB.T"
+        return self.get_pvs_by_role(ROLE_READBACK)
+
+    def get_derived_pvs(self) -> Dict[str, list]:
+        """Map each setpoint to the derived PVs that have to be updated when it is written"""
+        derived_pvs = {}
+        for k in self.get_pvs_by_role(ROLE_DERIVED):
+            for source in self.server.pvdb[k].get("source", []):
+                derived_pvs.setdefault(source, []).append(k)
+        return derived_pvs
+
+    def get_changed_derived_pvs(self, new_data: dict) -> list:
+        """Get the derived PVs depending on the written PVs, all of them after a reset"""
+        if "VIRT:BEAM:RESET_SIM" in new_data:
+            sources = self.derived_pvs.keys()
+        else:
+            sources = new_data.keys()
+        changed = [k for source in sources for k in self.derived_pvs.get(source, [])]
+        return list(dict.fromkeys(changed))
+
+    def get_downstream_pvs(self, new_data: dict) -> list:
+        """
+        Get the readbacks at or downstream of the earliest written element. All of them are
+        returned when a write is not tied to an element (shutter, reset, VIRT PVs), only the
+        ones they change when every write only changes how readings are served (e.g. an ROI).
+        """
+        views = [self.virtual_accelerator.view_readbacks(k) for k in new_data]
+        if views and None not in views:
+            changed = dict.fromkeys(k for readbacks in views for k in readbacks)
+            return [k for k in changed if k in self.readback_positions]
+        positions = [self.virtual_accelerator.get_pv_position(k) for k in new_data]
+        if not positions or None in positions:
+            return self.measurement_pvs
+        start = min(positions)
+        return [
+            k for k in self.measurement_pvs
+            if self.readback_positions[k] is None or self.readback_positions[k] >= start
         ]
-        key_list = [k for k in key_list if not any(flag in k for flag in ignore_flags)]
-        
-        return key_list
 
-    def update_cache(self, pv_list: list, post_monitors: bool):
+    def _read_model_setpoints(self):
+        """Initialize setpoints from the model, keeping the pvdb value where it has none"""
+        for name in self.setpoint_pvs:
+            try:
+                value = self.virtual_accelerator.get_pvs([name])[name]
+            except (AttributeError, ValueError):
+                continue
+            self._applied[name] = value
+            self.set_cached_value(name, value, True)
+
+    def update_cache(
+        self,
+        pv_list: list,
+        post_monitors: bool,
+        preempt: Callable[[], bool] | None = None,
+        extra_values: dict | None = None,
+    ):
         """
         Updates the PV cache for the list of PVs, optionally updating monitors along the way.
-        Locks the PV cache for you.
+        Every value is read from the model before any is posted, so a `preempt` that returns
+        True raises `SimulationPreempted` with nothing posted. The new values replace the old
+        ones in the cache at once, readers see either all or none of them.
 
         Parameters
         ----------
@@ -467,41 +1121,70 @@ class SimDriver(Driver):
             List of PVs to update
         post_monitors : bool
             If true, update PV monitors
+        preempt : Callable[[], bool] | None
+            Checked before tracking and before every readback
+        extra_values : dict | None
+            Values of other PVs to publish in the same cache update, such as the generation
         """
-        self.pv_guard.acquire()
+        values = {}
         for name in pv_list:
             if name in self.omitted:
                 continue
+            if preempt is not None and preempt():
+                raise SimulationPreempted()
             try:
-                value = self.virtual_accelerator.get_pvs([name])[name]
+                values[name] = self.virtual_accelerator.get_pvs([name], preempt)[name]
             except AttributeError as e:
                 # Attributes that error out should be omitted in subsequent runs
                 if name not in self.omitted:
                     self.omitted.append(name)
                     print(f'Error getting param "{name}": {e}, do not use {name}')
-                continue
-            self.pv_cache[name] = value
-            if post_monitors:
+        values.update(extra_values or {})
+
+        if not post_monitors:
+            self.pv_cache.update(values)
+            return
+        with self.post_guard:
+            self.pv_cache.update(values)
+            for name, value in values.items():
+                if self.recorder:
+                    self.recorder.record_readback(name, value)
+                if self._unchanged(name, value):
+                    continue
                 self.server.set_pv(name, value)
-                self.setParam(name, value)
-        if post_monitors:
-            self.updatePVs()
-        self.pv_guard.release()
+                if self._ca:
+                    self.setParam(name, self._ca_value(name, value))
+                self._published[name] = value
+            if self._ca:
+                self.updatePVs()
 
     def set_cached_value(self, pv: str, value: Any, post_monitors: bool):
         """
-        Sets a value in the PV cache, optionally updating monitors/PVs.
-        Locks the PV cache for you.
+        Sets a value in the PV cache, optionally updating monitors/PVs if the value differs
+        from the one they were last sent.
         """
-        self.pv_guard.acquire()
-        self.pv_cache[pv] = value
+        self.set_cached_values({pv: value}, post_monitors)
 
-        if post_monitors:
+    def set_cached_values(self, values: dict, post_monitors: bool):
+        """
+        Sets several values in the PV cache with a single cache update (one copy of the
+        cache instead of one per PV), optionally updating monitors/PVs like `set_cached_value`.
+        """
+        self.pv_cache.update(values)
+        if not post_monitors:
+            return
+        for pv, value in values.items():
+            if self._unchanged(pv, value):
+                continue
             self.server.set_pv(pv, value)
-            self.setParam(pv, value)
-            self.updatePV(pv)
+            if self._ca:
+                self.setParam(pv, self._ca_value(pv, value))
+                self.updatePV(pv)
+            self._published[pv] = value
 
-        self.pv_guard.release()
+    def _unchanged(self, pv: str, value: Any) -> bool:
+        """Whether a value was the last one posted to the monitors of a PV"""
+        return pv in self._published and same_value(self._published[pv], value)
 
     def cached_value(self, reason: str) -> Any|None:
         """
@@ -517,45 +1200,67 @@ class SimDriver(Driver):
         Any|None
             Value fetched from cache, or None if it doesn't exist
         """
-        with self.pv_guard:
-            try:
-                value = self.pv_cache[reason]
-            except KeyError:
-                print(f'{reason} had no entry in the cache: {self.pv_cache}')
-                return None
-        return value
+        try:
+            return self.pv_cache[reason]
+        except KeyError:
+            print(f'{reason} had no entry in the cache')
+            return None
 
     def read(self, reason):
-        # grab latest value from the cache
-        value = self.cached_value(reason)
-
-        try:
-            self.setParam(reason, value)
-        except Exception as e:
-            print(f"Error setting param for {reason}: {e}")
+        """
+        Serve a CA read from the published values, without side effects: monitors are only
+        posted when a value changes, not when a client reads it.
+        """
+        # Queue age keeps growing between simulations, compute it on demand
+        if reason == self.server.queue_age_name:
+            return self.write_queue.oldest_age()
 
-        self.updatePV(reason)
-        return value
+        return self._ca_value(reason, self.cached_value(reason))
 
     def write(self, reason, value):
         """write to a PV, run the simulation, and then update all other PVs"""
         #print(f"Writing {value} to {reason}")
+        if reason in self.control_handlers:
+            self.set_cached_value(reason, value, True)
+            return self.control_handlers[reason](value)
+
+        # A setpoint table is restored as a whole
+        if reason == self.server.setpoints_name:
+            return self.restore(table_snapshot(value))
+
+        # Writes that change nothing are not simulated, others are held to the drive limits
+        if reason in self._filtered_pvs:
+            verdict, value = self.write_filter.check(reason, value)
+            if verdict == REJECT:
+                print(f"Rejected write of {float(value)} to {reason}, outside of its drive limits")
+                return False
+            if verdict == UNCHANGED:
+                return True
+
+        if self.recorder:
+            self.recorder.record_write(reason, value)
 
         # Update internal values quickly so readbacks dont fail
+        previous = self.pv_cache.get(reason)
         self.set_cached_value(reason, value, True)
 
-        # Halt countdown
-        self.timer.cancel()
-
-        # Re-run the entire simulation if requested
+        # Re-run the entire simulation if requested, pending writes go with it
         if reason == self.server.sim_pv_name:
             with self.write_guard:
+                self.scheduler.cancel()
                 self.thread_cond.notify_all()
             return True
 
-        # Adjust simulation timeout
-        if reason == self.server.sim_timeout_name:
-            self.timer.interval = int(value)
+        # Adjust the debounce window or maximum latency
+        if reason in (self.server.sim_timeout_name, self.server.sim_max_latency_name):
+            try:
+                if reason == self.server.sim_timeout_name:
+                    self.scheduler.window = float(value)
+                else:
+                    self.scheduler.max_latency = float(value)
+            except ValueError:
+                self.set_cached_value(reason, previous, True)
+                return False
             return True
 
         # Single threaded mode; do all updates immediately
@@ -566,9 +1271,25 @@ class SimDriver(Driver):
 
         with self.write_guard:
             # this is sent to the updater thread
-            self.new_data[reason] = value
-
-            # Begin simulation timeout period
-            self.timer.reset()
-
-        return True
\ No newline at end of file
+            self._applied.setdefault(reason, previous)
+            accepted = self.write_queue.put(reason, value)
+            if accepted:
+                self.idle.clear()
+
+            # (Re)start the debounce window
+            self.scheduler.poke()
+
+        self.publish_queue_status()
+
+        if not accepted:
+            print(f"Write queue full, rejected write of {value} to {reason}")
+            # Roll back the optimistic cache update
+            self.set_cached_value(reason, previous, True)
+            return False
+        return True
+
+    def _rollback_write(self, reason: str, value: Any):
+        """Roll back the optimistic cache update of a write the full queue dropped"""
+        print(f"Write queue full, dropped write of {value} to {reason}")
+        if reason in self._applied:
+            self.set_cached_value(reason, self._applied[reason], True)
\ No newline at end of file
@@ -5,12 +5,52 @@ import pathlib
 from cheetah.particles import ParticleBeam
 
 from simulation_server.virtual_accelerator import VirtualAccelerator
+from simulation_server.virtual_accelerator.artifact_cache import load_beam
+from simulation_server.virtual_accelerator.virtual_accelerator import PRECISIONS
+from simulation_server.virtual_accelerator.surrogate import SurrogateAccelerator, SurrogateModel
+from simulation_server.utils.default_params import default_nc_hxr, default_sc_diag0
+from simulation_server.utils.load_yaml import load_relevant_controls
+from simulation_server.utils.pvdb import create_pvdb
 
 FILEPATH = pathlib.Path(__file__).parent.resolve()
 LCLS_LATTICE = pathlib.Path(os.environ.get("LCLS_LATTICE", "/sdf/group/ad/sw/scm/repos/optics/lcls-lattice/cheetah"))
 
 
-def get_virtual_accelerator(name, monitor_overview=False, measurement_noise_level=None):
+def get_pvdb(name, bsa_length=0):
+    """
+    Create the PV database of a given beamline, see `simulation_server.utils.pvdb.create_pvdb`.
+
+    Parameters
+    ----------
+    name: str
+        The name of the beamline, see `get_virtual_accelerator`.
+    bsa_length: int, optional
+        Number of shots kept in the BSA-like history buffers, 0 to not serve them.
+
+    Returns
+    -------
+    dict
+        PV database of the beamline's devices
+    """
+    # The device files come with lcls-tools, which the model itself does not need
+    import lcls_tools.common.devices.yaml as yaml_directory
+
+    yaml_path = pathlib.Path(yaml_directory.__file__).parent.resolve()
+    if name == "diag0":
+        areas = ["DIAG0.yaml"]
+        default_params = default_sc_diag0
+    elif name in ("nc_injector", "nc_hxr"):
+        areas = ["GUN.yaml", "L0.yaml", "DL1.yaml"]
+        default_params = default_nc_hxr
+    else:
+        raise ValueError(f"Unknown virtual accelerator name: {name}")
+
+    devices = load_relevant_controls([os.path.join(yaml_path, area) for area in areas])
+    return create_pvdb(devices, default_params, bsa_length=bsa_length)
+
+
+def get_virtual_accelerator(name, monitor_overview=False, measurement_noise_level=None, lattice_file=None, surrogate=None,
+                            linear_readbacks=(), execution_mode="eager", precision="float32", cache_dir=None):
     """
     Create an instance of VirtualAccelerator for a given beamline.
 
@@ -26,51 +66,95 @@ def get_virtual_accelerator(name, monitor_overview=False, measurement_noise_leve
     measurement_noise_level: float, optional
         If provided, adds realistic noise to measurements.
         See `simulation_server.virtual_accelerator.utils.add_noise` for details.
+    lattice_file: str, optional
+        Cheetah lattice JSON to use instead of the default one of the beamline.
+    surrogate: str, optional
+        Surrogate model file, see `simulation_server.virtual_accelerator.surrogate`.
+        If provided, readbacks are predicted by the surrogate where it was trained.
+    linear_readbacks: tuple[str], optional
+        Readback classes served by cached first-order transfer maps instead of tracking,
+        see `simulation_server.virtual_accelerator.linear_optics.READBACK_CLASSES`.
+    execution_mode: str, optional
+        How the lattice is tracked, see
+        `simulation_server.virtual_accelerator.virtual_accelerator.EXECUTION_MODES`.
+    precision: str, optional
+        Floating point precision of the lattice, beam and readbacks, "float32" or "float64".
+    cache_dir: str, optional
+        Directory of the binary cache of the lattice and initial beam, see
+        `simulation_server.virtual_accelerator.artifact_cache`. If not provided, they are
+        parsed (or generated) on every start.
 
     Returns
     -------
-    VirtualAccelerator
-        An instance of the VirtualAccelerator class.
+    VirtualAccelerator | SurrogateAccelerator
+        An instance of the VirtualAccelerator class, wrapped in a SurrogateAccelerator
+        if a surrogate is used.
 
     """
+    dtype = PRECISIONS[precision]
     if name == "diag0":
-        incoming_beam = ParticleBeam.from_twiss(
-            beta_x=torch.tensor(9.34),
-            alpha_x=torch.tensor(-1.6946),
-            emittance_x=torch.tensor(1e-7),
-            beta_y=torch.tensor(9.34),
-            alpha_y=torch.tensor(-1.6946),
-            emittance_y=torch.tensor(1e-7),
-            energy=torch.tensor(90e6),
+        twiss = dict(
+            beta_x=9.34,
+            alpha_x=-1.6946,
+            emittance_x=1e-7,
+            beta_y=9.34,
+            alpha_y=-1.6946,
+            emittance_y=1e-7,
+            energy=90e6,
+            total_charge=1.0,
+        )
+        incoming_beam = load_beam(
+            lambda: ParticleBeam.from_twiss(
+                **{key: torch.tensor(value) for key, value in twiss.items()},
+                num_particles=100000,
+                dtype=dtype,
+            ),
+            cache_dir=cache_dir,
             num_particles=100000,
-            total_charge=torch.tensor(1.0),
+            dtype=dtype,
+            **twiss,
         )
 
         mapping_file = os.path.join(FILEPATH, "mappings", "lcls_elements.csv")
-        lattice_file = os.path.join(LCLS_LATTICE, "sc_diag0.json")
+        lattice_file = lattice_file or os.path.join(LCLS_LATTICE, "sc_diag0.json")
         subcell_dest = None
+        screen_params = default_sc_diag0
         
     elif name in ("nc_injector", 'nc_hxr'):
-        incoming_beam = ParticleBeam.from_openpmd_file(
-            path=os.path.join(FILEPATH, "beams", "impact_inj_output_YAG03.h5"),
-            energy=torch.tensor(64e6),
-            dtype=torch.float32,
+        beam_file = os.path.join(FILEPATH, "beams", "impact_inj_output_YAG03.h5")
+        incoming_beam = load_beam(
+            lambda: _openpmd_beam(beam_file, dtype), [beam_file], cache_dir, dtype=dtype
         )
-        incoming_beam.particle_charges = torch.tensor(1.0)
 
         mapping_file = os.path.join(FILEPATH, "mappings", "lcls_elements.csv") 
-        lattice_file = os.path.join(LCLS_LATTICE,"nc_hxr.json")
+        lattice_file = lattice_file or os.path.join(LCLS_LATTICE,"nc_hxr.json")
 
         if name == "nc_injector":
             subcell_dest = 'otr2'
         else:
             subcell_dest = None
+        screen_params = default_nc_hxr
 
-    return VirtualAccelerator(
+    va = VirtualAccelerator(
         lattice_file=lattice_file,
         initial_beam_distribution=incoming_beam,
         mapping_file=mapping_file,
         monitor_overview=monitor_overview,
         measurement_noise_level=measurement_noise_level,
-        subcell_dest=subcell_dest
+        subcell_dest=subcell_dest,
+        screen_params=screen_params,
+        linear_readbacks=linear_readbacks,
+        execution_mode=execution_mode,
+        precision=precision,
+        cache_dir=cache_dir,
     )
+    if surrogate:
+        return SurrogateAccelerator(va, SurrogateModel.load(surrogate))
+    return va
+
+
+def _openpmd_beam(path, dtype):
+    """Injector output beam, with unit particle charges"""
+    beam = ParticleBeam.from_openpmd_file(path=path, energy=torch.tensor(64e6), dtype=dtype)
+    beam.particle_charges = torch.tensor(1.0, dtype=dtype)
+    return beam
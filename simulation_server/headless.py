@@ -0,0 +1,266 @@
+"""
+In-process access to a virtual accelerator by PV name, without CA or PVA: neither pcaspy
+nor p4p is imported. Optimizers (e.g. a Badger/Xopt `Evaluator`) call it directly instead of
+paying network round trips, the debounce window and SIMULATE polling on every evaluation:
+
+    sim = HeadlessSimulator.create("diag0")
+    readings = sim.evaluate({"QUAD:DIAG0:190:BCTRL": 1.5}, ["OTRS:DIAG0:420:XRMS"])
+
+Every instance drives its own model, so any number of them can be used in one process.
+"""
+import threading
+from typing import Any, Dict, Iterable, Mapping
+
+from simulation_server.factory import get_pvdb, get_virtual_accelerator
+from simulation_server.utils.pvdb import ROLE_DERIVED, ROLE_READBACK, ROLE_SETPOINT, ROLE_STATIC
+from simulation_server.utils.write_filter import REJECT, UNCHANGED, WriteFilter
+
+RESET_PV = "VIRT:BEAM:RESET_SIM"
+
+
+class HeadlessSimulator:
+    """
+    PV-named reads and writes of a virtual accelerator with the semantics of the server.
+
+    Setpoint writes are checked like the server checks them (drive limits, unchanged values,
+    see `utils.write_filter.WriteFilter`) and held until the next read, which simulates all
+    of them at once. A read therefore sees every write made before it, like a snapshot read
+    with the wait flag, and all reads between two writes come from the same simulation
+    (see `generation`). Readbacks are only read from the model when asked for.
+
+    An instance can be shared between threads, every call is applied as a whole.
+    """
+
+    def __init__(
+        self,
+        virtual_accelerator,
+        pvdb: dict,
+        limit_policy: str = "clamp",
+        suppress_unchanged: bool = True,
+    ):
+        """
+        Parameters
+        ----------
+        virtual_accelerator : VirtualAccelerator | SurrogateAccelerator
+            Model to drive, not shared with anything else
+        pvdb : dict
+            PV database, as returned by `create_pvdb`, naming the PVs and their roles
+        limit_policy : str
+            What to do with setpoint writes outside of their DRVL/DRVH limits, see
+            `utils.write_filter.LIMIT_POLICIES`
+        suppress_unchanged : bool
+            Whether setpoint writes within the deadband of the current value are ignored
+            instead of simulated
+        """
+        self.virtual_accelerator = virtual_accelerator
+        self.pvdb = pvdb
+        self.limit_policy = limit_policy
+        self.suppress_unchanged = suppress_unchanged
+        self.write_filter = WriteFilter(pvdb, self._current, limit_policy, suppress_unchanged)
+
+        roles = {k: v.get("role", ROLE_STATIC) for k, v in pvdb.items()}
+        self.setpoint_pvs = [k for k, role in roles.items() if role == ROLE_SETPOINT]
+        self._setpoints = set(self.setpoint_pvs)
+        # PVs read from the model again after every simulation
+        self._reread_pvs = {k for k, role in roles.items() if role in (ROLE_READBACK, ROLE_DERIVED)}
+        self.omitted = []
+
+        self._lock = threading.RLock()
+        # Accepted writes waiting for the next simulation
+        self._pending: Dict[str, Any] = {}
+        # Values of the current generation. Setpoints start out at the model's values, and
+        # like readbacks are read from the model when first needed
+        self._values: Dict[str, Any] = {
+            k: v.get("value", 0) for k, v in pvdb.items()
+            if k not in self._reread_pvs and roles[k] != ROLE_SETPOINT
+        }
+        self._generation = 0
+
+    @classmethod
+    def create(
+        cls, name: str, limit_policy: str = "clamp", suppress_unchanged: bool = True, **kwargs
+    ) -> "HeadlessSimulator":
+        """
+        Create a simulator of a beamline, with the PVs the server would serve for it.
+
+        Parameters
+        ----------
+        name : str
+            Beamline, see `factory.get_virtual_accelerator`
+        limit_policy : str
+            See `HeadlessSimulator`
+        suppress_unchanged : bool
+            See `HeadlessSimulator`
+        kwargs
+            Passed to `factory.get_virtual_accelerator`, e.g. measurement_noise_level
+        """
+        return cls(get_virtual_accelerator(name, **kwargs), get_pvdb(name), limit_policy, suppress_unchanged)
+
+    def clone(self) -> "HeadlessSimulator":
+        """
+        Create an independent simulator of the same PVs, with its model in the initial state
+        of this one (see `VirtualAccelerator.clone`), e.g. for parallel evaluations.
+        """
+        return HeadlessSimulator(
+            self.virtual_accelerator.clone(), self.pvdb, self.limit_policy, self.suppress_unchanged
+        )
+
+    @property
+    def generation(self) -> int:
+        """Number of simulations run so far, like VIRT:BEAM:GENERATION"""
+        with self._lock:
+            self.simulate()
+            return self._generation
+
+    def get(self, name: str) -> Any:
+        """Value of a PV, after simulating any pending writes"""
+        return self.get_many([name])[name]
+
+    def get_many(self, names: Iterable[str]) -> Dict[str, Any]:
+        """Values of several PVs, all from the same simulation"""
+        with self._lock:
+            self.simulate()
+            return {name: self._read(name) for name in names}
+
+    def put(self, name: str, value: Any) -> bool:
+        """
+        Write a PV. Returns False if the write is rejected, like a failed put to the server.
+        """
+        return self.put_many({name: value})
+
+    def put_many(self, values: Mapping[str, Any]) -> bool:
+        """
+        Write several PVs, to be simulated together. Returns False if any write is rejected,
+        the others are still applied.
+        """
+        with self._lock:
+            writes, rejected = self._check(values)
+            self._apply(writes)
+            return not rejected
+
+    def evaluate(self, setpoints: Mapping[str, Any], readbacks: Iterable[str]) -> Dict[str, Any]:
+        """
+        Apply setpoints and read PVs from the one simulation of exactly these settings.
+        Raises ValueError without applying anything if a setpoint write is rejected.
+        """
+        with self._lock:
+            writes, rejected = self._check(setpoints)
+            if rejected:
+                raise ValueError(f"Rejected writes to {', '.join(rejected)}, outside of their drive limits")
+            self._apply(writes)
+            return self.get_many(readbacks)
+
+    def reset(self):
+        """Move every setpoint back to its lattice value, like writing VIRT:BEAM:RESET_SIM"""
+        self.put(RESET_PV, 1)
+
+    def snapshot(self) -> Dict[str, int | float]:
+        """Get the current value of every setpoint"""
+        values = {}
+        for name, value in self.get_many(self.setpoint_pvs).items():
+            try:
+                values[name] = self._setpoint_value(name, value)
+            except (TypeError, ValueError):
+                print(f"Can not snapshot {name} = {value}")
+        return values
+
+    def restore(self, values: Mapping[str, Any]) -> bool:
+        """
+        Apply a snapshot of setpoints in one simulation, like the server restores one.
+        PVs that are not setpoints are ignored. Returns False if any value is rejected by
+        the drive limits, the others are still restored.
+        """
+        with self._lock:
+            writes, rejected = self._check(
+                {k: self._setpoint_value(k, v) for k, v in values.items() if k in self._setpoints}
+            )
+            self._apply(writes)
+            return not rejected
+
+    def simulate(self):
+        """Simulate the pending writes, if any. Reads do this first."""
+        with self._lock:
+            if not self._pending:
+                return
+            new_data, self._pending = self._pending, {}
+            # Like on the server, a reset is applied before the writes that come with it
+            reset = RESET_PV in new_data
+            if reset:
+                new_data = {RESET_PV: new_data.pop(RESET_PV), **new_data}
+
+            # All at once, and one by one if the model can not apply some of them
+            applicable = {k: v for k, v in new_data.items() if k not in self.omitted}
+            try:
+                self.virtual_accelerator.set_pvs(applicable, track=False)
+            except (AttributeError, ValueError):
+                for name, value in applicable.items():
+                    try:
+                        self.virtual_accelerator.set_pvs({name: value}, track=False)
+                    except (AttributeError, ValueError):
+                        pass  # Like the server, setpoints the model can not apply are only cached
+            # The model tracks when the first readback is read
+
+            for name in self._reread_pvs:
+                self._values.pop(name, None)
+            # A reset moves every setpoint back to its lattice value
+            if reset:
+                new_data.pop(RESET_PV)
+                for name in self.setpoint_pvs:
+                    self._values.pop(name, None)
+            self._values.update(new_data)
+            self._generation += 1
+
+    def _check(self, values: Mapping[str, Any]) -> tuple[dict, list]:
+        """Accepted writes (with clamped values) and the names of rejected ones"""
+        writes, rejected = {}, []
+        for name, value in values.items():
+            if name not in self.pvdb and name != RESET_PV:
+                raise KeyError(f"Unknown PV {name}")
+            if name in self._setpoints:
+                verdict, value = self.write_filter.check(name, value)
+                if verdict == REJECT:
+                    rejected.append(name)
+                    continue
+                if verdict == UNCHANGED:
+                    continue
+            writes[name] = value
+        return writes, rejected
+
+    def _apply(self, writes: Mapping[str, Any]):
+        """Hold setpoint writes for the next simulation, other PVs only keep the value"""
+        for name, value in writes.items():
+            if name in self._setpoints or name == RESET_PV:
+                self._pending[name] = value
+            else:
+                self._values[name] = value
+
+    def _current(self, name: str) -> Any:
+        """Value of a PV including pending writes, None if unknown, for the write filter"""
+        if name in self._pending:
+            return self._pending[name]
+        if name not in self.pvdb:
+            return None
+        return self._read(name)
+
+    def _read(self, name: str) -> Any:
+        """Value of a PV in the current generation, read from the model when first needed"""
+        if name in self._values:
+            return self._values[name]
+        if name not in self.pvdb:
+            raise KeyError(f"Unknown PV {name}")
+        value = self.pvdb[name].get("value", 0)
+        if name not in self.omitted:
+            try:
+                value = self.virtual_accelerator.get_pvs([name])[name]
+            except (AttributeError, ValueError) as e:
+                # Attributes that error out keep their pvdb value, like on the server
+                self.omitted.append(name)
+                print(f'Error getting param "{name}": {e}, do not use {name}')
+        self._values[name] = value
+        return value
+
+    def _setpoint_value(self, name: str, value: Any) -> int | float:
+        """Plain number of a setpoint, like CA clients write them"""
+        if self.pvdb[name].get("type") in ("int", "enum"):
+            return int(value)
+        return float(value)
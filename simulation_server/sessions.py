@@ -0,0 +1,144 @@
+import re
+import threading
+from copy import deepcopy
+
+from simulation_server.beamdriver import SimDriver, SimServer
+from simulation_server.utils.pvdb import ROLE_STATIC
+
+# Session control PVs, served by the main server
+SESSION_CREATE_PV = "VIRT:SESSION:CREATE"
+SESSION_DESTROY_PV = "VIRT:SESSION:DESTROY"
+SESSION_LIST_PV = "VIRT:SESSION:LIST"
+SESSION_COUNT_PV = "VIRT:SESSION:COUNT"
+
+# Session names become PV prefixes, so keep them to characters that are safe in PV names
+SESSION_NAME = re.compile(r"^[A-Za-z0-9_\-]{1,32}$")
+
+
+def add_session_pvs(pvdb: dict):
+    """Add the session control PVs to the PV database of the main server"""
+    for name in (SESSION_CREATE_PV, SESSION_DESTROY_PV, SESSION_LIST_PV):
+        pvdb[name] = {"type": "string", "value": "", "role": ROLE_STATIC}
+    pvdb[SESSION_COUNT_PV] = {"type": "int", "value": 0, "role": ROLE_STATIC}
+
+
+class SessionManager:
+    """
+    Hosts independent simulation sessions in the process of a main server.
+
+    Writing a name to VIRT:SESSION:CREATE serves the PVs of the main server again under
+    the prefix "<name>:", with their own setpoints and model, and writing it to
+    VIRT:SESSION:DESTROY removes them. Sessions share the CA and PVA servers, the parsed
+    lattice, mapping and initial beam of the main server (see `VirtualAccelerator.clone`),
+    so an extra session costs a lattice copy rather than a server process.
+    """
+
+    def __init__(self, driver: SimDriver, pvdb: dict, max_sessions: int = 8, **driver_kwargs):
+        """
+        Parameters
+        ----------
+        driver : SimDriver
+            Driver of the main server, which must serve the PVs from `add_session_pvs`
+        pvdb : dict
+            PV database of a session, as returned by `create_pvdb`
+        max_sessions : int
+            Maximum number of sessions besides the main one
+        driver_kwargs
+            Passed to the SimDriver of each session, e.g. queue_size
+        """
+        self.driver = driver
+        self.max_sessions = max_sessions
+        self.sessions: dict[str, SimDriver] = {}
+        self._template = {k: v for k, v in deepcopy(pvdb).items() if not k.startswith("VIRT:SESSION:")}
+        self._driver_kwargs = driver_kwargs
+        self._lock = threading.Lock()
+
+        driver.control_handlers[SESSION_CREATE_PV] = self._on_create
+        driver.control_handlers[SESSION_DESTROY_PV] = self._on_destroy
+
+    def create(self, name: str) -> SimDriver:
+        """
+        Create a session serving PVs under "<name>:"
+
+        Raises
+        ------
+        ValueError
+            If the name is invalid or taken, or there are too many sessions
+        """
+        if not SESSION_NAME.match(name):
+            raise ValueError(f"Invalid session name {name!r}")
+        with self._lock:
+            if name in self.sessions:
+                raise ValueError(f"Session {name} already exists")
+            if len(self.sessions) >= self.max_sessions:
+                raise ValueError(f"Too many sessions, at most {self.max_sessions} are allowed")
+
+            server = SimServer(
+                deepcopy(self._template),
+                prefix=f"{name}:",
+                threading=self.driver.server.threaded,
+                port=name,
+                parent=self.driver.server,
+            )
+            # pcaspy finds the driver of a PV through the class attribute "port"
+            driver_class = type(f"SimDriver_{name}", (SimDriver,), {"port": name})
+            self.sessions[name] = driver_class(
+                server=server,
+                virtual_accelerator=self.driver.virtual_accelerator.clone(),
+                **self._driver_kwargs,
+            )
+        self._publish()
+        print(f"Created session {name}")
+        return self.sessions[name]
+
+    def destroy(self, name: str):
+        """
+        Stop serving a session and free its model
+
+        Raises
+        ------
+        ValueError
+            If there is no such session
+        """
+        with self._lock:
+            if name not in self.sessions:
+                raise ValueError(f"No session {name}")
+            driver = self.sessions.pop(name)
+        driver.stop()
+        driver.server.remove()
+        self._publish()
+        print(f"Destroyed session {name}")
+
+    def _publish(self):
+        self.driver.set_cached_values(
+            {SESSION_LIST_PV: " ".join(sorted(self.sessions)), SESSION_COUNT_PV: len(self.sessions)},
+            True,
+        )
+
+    def _on_create(self, name) -> bool:
+        # Building a session takes a tracking pass, keep it off the CA/PVA threads
+        name = _session_name(name)
+        if not SESSION_NAME.match(name) or name in self.sessions:
+            print(f"Can not create session {name!r}")
+            return False
+        threading.Thread(target=self._run, args=(self.create, name)).start()
+        return True
+
+    def _on_destroy(self, name) -> bool:
+        name = _session_name(name)
+        if name not in self.sessions:
+            print(f"No session {name!r} to destroy")
+            return False
+        threading.Thread(target=self._run, args=(self.destroy, name)).start()
+        return True
+
+    def _run(self, method, name: str):
+        try:
+            method(name)
+        except ValueError as e:
+            print(e)
+
+
+def _session_name(value) -> str:
+    # Slicing turns PVA's ntstr into a plain str, whose str() includes the timestamp
+    return value[:].strip()
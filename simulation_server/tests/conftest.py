@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+from cheetah.particles import ParticleBeam
+
+from simulation_server.virtual_accelerator import VirtualAccelerator
+from simulation_server.virtual_accelerator.surrogate import (
+    SurrogateAccelerator,
+    default_io,
+    generate_samples,
+    train_surrogate,
+)
+
+RESOURCES = os.path.join(os.path.split(os.path.abspath(__file__))[0], "virtual_accelerator", "resources")
+DIAG0_LATTICE = os.path.join(RESOURCES, "diag0.json")
+
+# Elements of the diag0 test lattice by control system name, as in the lcls_elements.csv mapping
+DIAG0_ELEMENTS = {
+    "XCOR:DIAG0:178": "XCDG001",
+    "QUAD:DIAG0:190": "QDG001",
+    "YCOR:DIAG0:199": "YCDG001",
+    "TCAV:DIAG0:11": "TCXDG0",
+    "BPMS:DIAG0:136": "BPMDG000",
+    "BPMS:DIAG0:190": "BPMDG001",
+    "BPMS:DIAG0:210": "BPMDG002",
+    "BPMS:DIAG0:390": "BPMDG009",
+    "OTRS:DIAG0:420": "OTRDG02",
+    "OTRS:DIAG0:525": "OTRDG04",
+}
+
+
+def make_beam(num_particles: int = 1000, energy: float = 90e6) -> ParticleBeam:
+    """Gaussian diag0 beam of 1 nC, the same for every test"""
+    torch.manual_seed(0)
+    return ParticleBeam.from_twiss(
+        beta_x=torch.tensor(9.34),
+        alpha_x=torch.tensor(-1.6946),
+        emittance_x=torch.tensor(1e-7),
+        beta_y=torch.tensor(9.34),
+        alpha_y=torch.tensor(-1.6946),
+        emittance_y=torch.tensor(1e-7),
+        num_particles=num_particles,
+        total_charge=torch.tensor(1e-9),
+        energy=torch.tensor(energy),
+    )
+
+
+def make_surrogate(va: VirtualAccelerator) -> SurrogateAccelerator:
+    """
+    Surrogate of a test accelerator, trained within 0.01 of its corrector and 1 of its
+    quadrupole settings
+    """
+    inputs, outputs = default_io(va)
+    current = va.get_pvs(inputs)
+    span = {name: 1.0 if name.startswith("QUAD") else 0.01 for name in inputs}
+    bounds = np.array([[current[k] - span[k], current[k] + span[k]] for k in inputs])
+    X, Y = generate_samples(va, inputs, outputs, bounds, 64, seed=0)
+    va.set_pvs(current)
+    return SurrogateAccelerator(va, train_surrogate(X, Y, inputs, outputs, epochs=500, seed=0))
+
+
+@pytest.fixture
+def beam() -> ParticleBeam:
+    return make_beam()
+
+
+@pytest.fixture
+def make_va(tmp_path, beam):
+    """
+    Builds virtual accelerators on the diag0 test lattice, mapping the given devices (all of
+    DIAG0_ELEMENTS by default). Keyword arguments are passed to VirtualAccelerator.
+    """
+
+    def make(devices=tuple(DIAG0_ELEMENTS), initial_beam_distribution=None, **kwargs) -> VirtualAccelerator:
+        mapping_file = tmp_path / "lcls_elements.csv"
+        mapping_file.write_text(
+            "Element,Control System Name\n"
+            + "".join(f"{DIAG0_ELEMENTS[device]},{device}\n" for device in devices)
+        )
+        return VirtualAccelerator(
+            lattice_file=DIAG0_LATTICE,
+            mapping_file=str(mapping_file),
+            initial_beam_distribution=beam if initial_beam_distribution is None else initial_beam_distribution,
+            **kwargs,
+        )
+
+    return make
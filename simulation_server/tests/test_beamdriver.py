@@ -0,0 +1,105 @@
+import pytest
+
+from simulation_server.beamdriver import SimDriver, SimServer
+from simulation_server.tests.conftest import make_surrogate
+
+DEVICES = ["XCOR:DIAG0:178", "QUAD:DIAG0:190", "BPMS:DIAG0:390"]
+
+PVDB = {
+    "QUAD:DIAG0:190:BCTRL": {"type": "float", "value": 0.0, "prec": 5, "drvh": 20, "drvl": -20, "role": "setpoint"},
+    "QUAD:DIAG0:190:BACT": {"type": "float", "value": 0.0, "prec": 5, "role": "derived", "source": ["QUAD:DIAG0:190:BCTRL"]},
+    "XCOR:DIAG0:178:BCTRL": {"type": "float", "value": 0.0, "prec": 5, "role": "setpoint"},
+    "BPMS:DIAG0:390:X": {"type": "float", "value": 0.0, "role": "readback"},
+}
+
+
+class TestSimDriver:
+    @pytest.fixture(autouse=True)
+    def setup_driver(self, make_va):
+        def make(threaded: bool, surrogate: bool = False, **kwargs) -> SimDriver:
+            va = make_va(DEVICES)
+            driver = SimDriver(
+                SimServer(dict(PVDB), threading=threaded, protocols="pva"),
+                make_surrogate(va) if surrogate else va,
+                **kwargs,
+            )
+            self.drivers.append(driver)
+            return driver
+
+        self.drivers = []
+        self.make_driver = make
+        yield
+        for driver in self.drivers:
+            driver.stop()
+
+    def test_restore(self):
+        driver = self.make_driver(threaded=False)
+        tracks = []
+        track = driver.virtual_accelerator.track
+        driver.virtual_accelerator.track = lambda *args: tracks.append(args) or track(*args)
+
+        # one tracking pass for the whole snapshot, held to the drive limits
+        assert driver.restore({"QUAD:DIAG0:190:BCTRL": 25.0, "XCOR:DIAG0:178:BCTRL": 0.01})
+        assert len(tracks) == 1
+        assert driver.snapshot() == {"QUAD:DIAG0:190:BCTRL": 20.0, "XCOR:DIAG0:178:BCTRL": 0.01}
+        assert driver.cached_value("QUAD:DIAG0:190:BACT") == pytest.approx(20.0)
+
+        # nothing to restore, nothing to simulate
+        assert driver.restore(driver.snapshot())
+        assert len(tracks) == 1
+
+    def test_restore_reject(self):
+        driver = self.make_driver(threaded=True, limit_policy="reject")
+        quad = driver.cached_value("QUAD:DIAG0:190:BCTRL")
+        assert not driver.restore({"QUAD:DIAG0:190:BCTRL": 25.0, "XCOR:DIAG0:178:BCTRL": 0.01})
+        assert driver.wait_idle(10.0)
+        assert driver.snapshot() == {"QUAD:DIAG0:190:BCTRL": quad, "XCOR:DIAG0:178:BCTRL": 0.01}
+        assert driver.virtual_accelerator.get_pvs(["XCOR:DIAG0:178:BCTRL"])["XCOR:DIAG0:178:BCTRL"] == pytest.approx(0.01)
+
+    def test_bounded_preemption(self):
+        driver = self.make_driver(threaded=True, max_preemptions=2)
+        # every simulation is superseded, as by a steady stream of writes without a maximum latency
+        driver._superseded = lambda batch_start: True
+        simulations = []
+        simulate = driver._set_and_simulate
+        driver._set_and_simulate = lambda *args: simulations.append(args) or simulate(*args)
+
+        assert driver.write("QUAD:DIAG0:190:BCTRL", 1.5)
+        assert driver.wait_idle(30.0)
+        assert len(simulations) == 3
+        assert driver.cached_value("QUAD:DIAG0:190:BACT") == pytest.approx(1.5)
+
+    def test_queue_status(self):
+        driver = self.make_driver(threaded=False)
+        version = driver.pv_cache.version
+
+        # the queue status PVs are published in a single cache generation
+        driver.publish_queue_status()
+        assert driver.pv_cache.version == version + 1
+        assert driver.cached_value(driver.server.queue_depth_name) == driver.write_queue.depth
+        assert driver.cached_value(driver.server.queue_dropped_name) == driver.write_queue.dropped
+
+    @pytest.mark.parametrize("threaded", [False, True])
+    def test_surrogate(self, threaded):
+        driver = self.make_driver(threaded=threaded, surrogate=True)
+        surrogate = driver.virtual_accelerator
+        tracks = []
+        track = surrogate.virtual_accelerator.track
+        surrogate.virtual_accelerator.track = lambda *args: tracks.append(args) or track(*args)
+
+        # writes to inputs within the training domain are predicted, not tracked
+        xcor = driver.cached_value("XCOR:DIAG0:178:BCTRL")
+        assert driver.write("XCOR:DIAG0:178:BCTRL", xcor + 0.005)
+        assert driver.wait_idle(10.0)
+        assert tracks == []
+        assert surrogate.stale
+        predicted = surrogate.model.predict(surrogate._x)
+        assert driver.cached_value("BPMS:DIAG0:390:X") == predicted["BPMS:DIAG0:390:X"]
+
+        # others fall back to tracking
+        assert driver.write("XCOR:DIAG0:178:BCTRL", xcor + 0.05)
+        assert driver.wait_idle(10.0)
+        assert len(tracks) == 1
+        assert surrogate.fallbacks == 1
+        reading = surrogate.virtual_accelerator.get_pvs(["BPMS:DIAG0:390:X"])["BPMS:DIAG0:390:X"]
+        assert driver.cached_value("BPMS:DIAG0:390:X") == reading
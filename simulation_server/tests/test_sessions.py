@@ -0,0 +1,100 @@
+import time
+
+import pytest
+
+from simulation_server.beamdriver import SimDriver, SimServer
+from simulation_server.sessions import (
+    SESSION_COUNT_PV,
+    SESSION_CREATE_PV,
+    SESSION_DESTROY_PV,
+    SESSION_LIST_PV,
+    SessionManager,
+    add_session_pvs,
+)
+
+DEVICES = ["XCOR:DIAG0:178", "QUAD:DIAG0:190", "BPMS:DIAG0:390"]
+
+PVDB = {
+    "QUAD:DIAG0:190:BCTRL": {"type": "float", "value": 0.0, "prec": 5, "drvh": 20, "drvl": -20, "role": "setpoint"},
+    "QUAD:DIAG0:190:BACT": {"type": "float", "value": 0.0, "prec": 5, "role": "derived", "source": ["QUAD:DIAG0:190:BCTRL"]},
+    "XCOR:DIAG0:178:BCTRL": {"type": "float", "value": 0.0, "prec": 5, "role": "setpoint"},
+    "BPMS:DIAG0:390:X": {"type": "float", "value": 0.0, "role": "readback"},
+}
+
+
+class TestSessionManager:
+    @pytest.fixture(autouse=True)
+    def setup_driver(self, make_va):
+        pvdb = dict(PVDB)
+        add_session_pvs(pvdb)
+        self.server = SimServer(pvdb, threading=True, protocols="pva")
+        self.driver = SimDriver(self.server, make_va(DEVICES))
+        # Sessions simulate a while after their last write
+        self.manager = SessionManager(self.driver, PVDB, max_sessions=1, debounce=0.2)
+        yield
+        for name in list(self.manager.sessions):
+            self.manager.destroy(name)
+        self.driver.stop()
+
+    def served(self, name: str) -> bool:
+        return name in self.server._provider.keys()
+
+    def test_lifecycle(self):
+        session = self.manager.create("alice")
+        assert self.served("alice:QUAD:DIAG0:190:BCTRL")
+        assert self.driver.cached_value(SESSION_LIST_PV) == "alice"
+        assert self.driver.cached_value(SESSION_COUNT_PV) == 1
+
+        # sessions have their own setpoints and model
+        quad = self.driver.cached_value("QUAD:DIAG0:190:BCTRL")
+        assert session.write("QUAD:DIAG0:190:BCTRL", 1.5)
+        assert session.wait_idle(10.0)
+        assert session.cached_value("QUAD:DIAG0:190:BACT") == pytest.approx(1.5)
+        assert self.driver.cached_value("QUAD:DIAG0:190:BCTRL") == quad
+        assert session.virtual_accelerator is not self.driver.virtual_accelerator
+
+        self.manager.destroy("alice")
+        assert not self.served("alice:QUAD:DIAG0:190:BCTRL")
+        assert self.served("QUAD:DIAG0:190:BCTRL")
+        assert self.driver.cached_value(SESSION_LIST_PV) == ""
+        assert self.driver.cached_value(SESSION_COUNT_PV) == 0
+        with pytest.raises(ValueError):
+            self.manager.destroy("alice")
+
+    def test_limits(self):
+        for name in ("", "a b", "a:b", "x" * 33):
+            with pytest.raises(ValueError):
+                self.manager.create(name)
+        self.manager.create("alice")
+        with pytest.raises(ValueError):
+            self.manager.create("alice")
+        with pytest.raises(ValueError):
+            self.manager.create("bob")
+        assert list(self.manager.sessions) == ["alice"]
+
+    def test_control_pvs(self):
+        assert not self.driver.write(SESSION_CREATE_PV, "a b")
+        assert self.driver.write(SESSION_CREATE_PV, " alice ")
+        deadline = time.time() + 30.0
+        while "alice" not in self.manager.sessions and time.time() < deadline:
+            time.sleep(0.01)
+        assert self.served("alice:QUAD:DIAG0:190:BCTRL")
+
+        assert not self.driver.write(SESSION_DESTROY_PV, "bob")
+        assert self.driver.write(SESSION_DESTROY_PV, "alice")
+        while self.manager.sessions and time.time() < deadline:
+            time.sleep(0.01)
+        assert not self.manager.sessions
+
+    def test_no_simulation_after_destroy(self):
+        session = self.manager.create("alice")
+        simulations = []
+        simulate = session._set_and_simulate
+        session._set_and_simulate = lambda *args: simulations.append(args) or simulate(*args)
+
+        # the write is still within its debounce window when the session is destroyed
+        assert session.write("QUAD:DIAG0:190:BCTRL", 1.5)
+        self.manager.destroy("alice")
+        assert not session.thread.is_alive()
+        time.sleep(0.4)
+        assert simulations == []
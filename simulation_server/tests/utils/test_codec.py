@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from simulation_server.utils.codec import (
+    available_codecs,
+    check_codec,
+    compress_array,
+    decompress_array,
+)
+
+
+class TestCodec:
+    @pytest.mark.parametrize("codec", available_codecs())
+    def test_round_trip(self, codec):
+        image = np.zeros((64, 48))
+        image[20:30, 10:20] = np.random.uniform(size=(10, 10))
+
+        data, type_code = compress_array(image, codec)
+        assert data.dtype == np.uint8
+        assert data.size < image.nbytes
+
+        restored = decompress_array(data, codec, type_code, image.nbytes)
+        assert restored.dtype == image.dtype
+        assert np.array_equal(restored, image.ravel())
+
+    def test_check_codec(self):
+        assert check_codec(None) is None
+        assert check_codec("none") is None
+        assert check_codec("zlib") == "zlib"
+        with pytest.raises(ValueError):
+            check_codec("jpeg")
@@ -0,0 +1,94 @@
+import threading
+import time
+
+import pytest
+
+from simulation_server.utils.debounce import DebounceScheduler
+
+
+class TestDebounceScheduler:
+    def setup_method(self):
+        self.calls = []
+        self.called = threading.Event()
+
+    def callback(self):
+        self.calls.append(time.monotonic())
+        self.called.set()
+
+    def poke_for(self, scheduler, seconds, interval=0.005):
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            scheduler.poke()
+            time.sleep(interval)
+
+    def test_debounce(self):
+        scheduler = DebounceScheduler(self.callback, window=0.05)
+        scheduler.start()
+        try:
+            self.poke_for(scheduler, 0.15)
+            last = time.monotonic()
+            assert self.called.wait(1.0)
+            # one trigger for the whole burst, a window after its last write
+            assert len(self.calls) == 1
+            assert self.calls[0] - last >= 0.04
+            assert not scheduler.pending
+        finally:
+            scheduler.stop()
+
+    def test_max_latency(self):
+        scheduler = DebounceScheduler(self.callback, window=0.05, max_latency=0.1)
+        scheduler.start()
+        try:
+            start = time.monotonic()
+            self.poke_for(scheduler, 0.5)
+            assert len(self.calls) >= 3
+            assert self.calls[0] - start < 0.2
+        finally:
+            scheduler.stop()
+
+    def test_cancel(self):
+        scheduler = DebounceScheduler(self.callback, window=0.05)
+        scheduler.start()
+        try:
+            scheduler.poke()
+            scheduler.cancel()
+            assert not self.called.wait(0.15)
+        finally:
+            scheduler.stop()
+
+    def test_adaptive(self):
+        scheduler = DebounceScheduler(
+            self.callback, window=0.01, adaptive=True, max_window=0.5, idle_half_life=0.05
+        )
+        assert scheduler.effective_window() == 0.01
+        for _ in range(10):
+            scheduler.record_duration(0.3)
+        # widened to the simulation time
+        assert 0.25 < scheduler.effective_window() <= 0.3
+        for _ in range(10):
+            scheduler.record_duration(2.0)
+        assert scheduler.effective_window() == 0.5
+        # and narrowed back when idle
+        time.sleep(0.5)
+        assert scheduler.effective_window() == 0.01
+
+        scheduler.adaptive = False
+        scheduler.record_duration(2.0)
+        assert scheduler.effective_window() == 0.01
+
+    def test_settings(self):
+        scheduler = DebounceScheduler(self.callback)
+        scheduler.window = 0.25
+        assert scheduler.window == 0.25
+        with pytest.raises(ValueError):
+            scheduler.max_latency = -1
+        # never started
+        scheduler.stop()
+
+    def test_stop(self):
+        scheduler = DebounceScheduler(self.callback, window=10.0)
+        scheduler.start()
+        scheduler.poke()
+        scheduler.stop(timeout=1.0)
+        assert not scheduler._thread.is_alive()
+        assert not self.calls
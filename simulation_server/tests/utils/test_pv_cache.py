@@ -0,0 +1,65 @@
+import threading
+
+import numpy as np
+import pytest
+import torch
+
+from simulation_server.utils.pv_cache import PVCache, same_value
+
+
+class TestPVCache:
+    def test_mapping(self):
+        cache = PVCache({"QUAD:1:BCTRL": 1.0})
+        cache["QUAD:1:BACT"] = 1.0
+        assert cache["QUAD:1:BCTRL"] == 1.0
+        assert cache.get("QUAD:2:BCTRL") is None
+        assert "QUAD:1:BACT" in cache
+        assert sorted(cache) == ["QUAD:1:BACT", "QUAD:1:BCTRL"]
+        with pytest.raises(KeyError):
+            cache["QUAD:2:BCTRL"]
+
+    def test_generations(self):
+        cache = PVCache({"BPMS:1:X": 0.0, "BPMS:1:Y": 0.0})
+        snapshot = cache.snapshot()
+        version = cache.update({"BPMS:1:X": 1.0, "BPMS:1:Y": 2.0})
+
+        assert version == cache.version == 1
+        # a snapshot keeps the generation it was taken from
+        assert snapshot == {"BPMS:1:X": 0.0, "BPMS:1:Y": 0.0}
+        assert cache.snapshot() == {"BPMS:1:X": 1.0, "BPMS:1:Y": 2.0}
+
+    def test_consistent_reads(self):
+        cache = PVCache({"BPMS:1:X": 0, "BPMS:1:Y": 0})
+        done = threading.Event()
+        torn = []
+
+        def read():
+            while not done.is_set():
+                snapshot = cache.snapshot()
+                if snapshot["BPMS:1:X"] != snapshot["BPMS:1:Y"]:
+                    torn.append(snapshot)
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        for i in range(1, 5000):
+            cache.update({"BPMS:1:X": i, "BPMS:1:Y": i})
+        done.set()
+        for reader in readers:
+            reader.join()
+
+        assert not torn
+        assert cache.version == 4999
+
+    def test_same_value(self):
+        assert same_value(1.0, 1.0)
+        assert not same_value(1.0, 1.5)
+        assert not same_value(None, 0.0)
+        image = np.arange(6, dtype=np.uint16).reshape(2, 3)
+        assert same_value(image, image.copy())
+        assert not same_value(image, image.astype(np.int32))
+        assert not same_value(image, image.T)
+        assert not same_value(image, 0)
+        assert same_value(torch.tensor(2.0), torch.tensor(2.0))
+        # multi-element tensors are never taken as unchanged
+        assert not same_value(torch.ones(3), torch.ones(3))
@@ -0,0 +1,81 @@
+from simulation_server.utils.pvdb import (
+    create_pvdb,
+    ROLES,
+    ROLE_SETPOINT,
+    ROLE_STATIC,
+    ROLE_DERIVED,
+    ROLE_READBACK,
+    ROLE_BUFFER,
+)
+
+
+DEVICES = {
+    "QUAD:DIAG0:190": {
+        "madname": "QDG001",
+        "pvs": {
+            "bact": "QUAD:DIAG0:190:BACT",
+            "bctrl": "QUAD:DIAG0:190:BCTRL",
+            "bmax": "QUAD:DIAG0:190:BMAX",
+            "bmin": "QUAD:DIAG0:190:BMIN",
+            "bdes": "QUAD:DIAG0:190:BDES",
+            "bcon": "QUAD:DIAG0:190:BCON",
+            "ctrl": "QUAD:DIAG0:190:CTRL",
+        },
+    },
+    "BPMS:DIAG0:190": {
+        "madname": "BPMDG000",
+        "pvs": {
+            "tmit": "BPMS:DIAG0:190:TMIT",
+            "x": "BPMS:DIAG0:190:X",
+            "y": "BPMS:DIAG0:190:Y",
+        },
+    },
+    "OTRS:DIAG0:420": {
+        "madname": "OTRDG02",
+        "pvs": {
+            "image": "OTRS:DIAG0:420:Image:ArrayData",
+            "n_row": "OTRS:DIAG0:420:Image:ArraySize0_RBV",
+            "n_col": "OTRS:DIAG0:420:Image:ArraySize1_RBV",
+            "resolution": "OTRS:DIAG0:420:RESOLUTION",
+            "target_control": "OTRS:DIAG0:420:PNEUMATIC",
+        },
+    },
+}
+
+
+class TestPVDB:
+    def test_roles(self):
+        pvdb = create_pvdb(DEVICES, {"OTRDG02": {"n_row": 8, "n_col": 10}})
+
+        assert all(desc["role"] in ROLES for desc in pvdb.values())
+
+        assert pvdb["QUAD:DIAG0:190:BCTRL"]["role"] == ROLE_SETPOINT
+        assert pvdb["QUAD:DIAG0:190:BACT"]["role"] == ROLE_DERIVED
+        assert pvdb["QUAD:DIAG0:190:BACT"]["source"] == ["QUAD:DIAG0:190:BCTRL"]
+        assert pvdb["QUAD:DIAG0:190:BMAX"]["role"] == ROLE_STATIC
+        assert pvdb["QUAD:DIAG0:190:BCTRL.DRVH"]["role"] == ROLE_STATIC
+
+        assert pvdb["BPMS:DIAG0:190:X"]["role"] == ROLE_READBACK
+        assert pvdb["OTRS:DIAG0:420:Image:ArrayData"]["role"] == ROLE_READBACK
+        assert pvdb["OTRS:DIAG0:420:PNEUMATIC"]["role"] == ROLE_SETPOINT
+        assert pvdb["OTRS:DIAG0:420:ROI:MinX_RBV"]["role"] == ROLE_DERIVED
+        assert "OTRS:DIAG0:420:ROI:SizeX" in pvdb["OTRS:DIAG0:420:ROI:MinX_RBV"]["source"]
+
+    def test_roles_are_not_fields(self):
+        pvdb = create_pvdb(DEVICES)
+
+        assert "QUAD:DIAG0:190:BACT.ROLE" not in pvdb
+        assert "QUAD:DIAG0:190:BACT.SOURCE" not in pvdb
+
+    def test_bsa_buffers(self):
+        assert not any(k.endswith("HSTBR") for k in create_pvdb(DEVICES))
+
+        pvdb = create_pvdb(DEVICES, bsa_length=100)
+        buffer = pvdb["BPMS:DIAG0:190:XHSTBR"]
+        assert buffer["role"] == ROLE_BUFFER
+        assert buffer["source"] == ["BPMS:DIAG0:190:X"]
+        assert buffer["count"] == 100
+        # positions jitter in the units of their readback, the charge relative to itself
+        assert buffer["jitter"] == (1e-3, 0.0)
+        assert pvdb["BPMS:DIAG0:190:TMITHSTBR"]["jitter"] == (0.0, 1.0)
+        assert "BPMS:DIAG0:190:XHSTBR.JITTER" not in pvdb
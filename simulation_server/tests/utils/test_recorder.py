@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+h5py = pytest.importorskip("h5py")
+
+from simulation_server.utils.recorder import Recorder
+
+
+class TestRecorder:
+    def test_record(self, tmp_path):
+        path = tmp_path / "session.h5"
+        recorder = Recorder(str(path), batch_size=2, flush_interval=0.01)
+        recorder.record_write("QUAD:DIAG0:190:BCTRL", 1.5)
+        recorder.record_readback("QUAD:DIAG0:190:BACT", 1.5)
+        recorder.record_readback("BPMS:DIAG0:190:X", 0.1)
+        recorder.record_readback("OTRS:DIAG0:420:Image:ArrayData", np.arange(6, dtype=np.uint16))
+        recorder.record_readback("OTRS:DIAG0:420:Image:ArrayData", np.arange(4, dtype=np.uint16))
+        recorder.record_write("OTRS:DIAG0:420:PNEUMATIC", "IN")
+        recorder.close()
+
+        with h5py.File(path, "r") as f:
+            assert list(f["writes/name"].asstr()) == ["QUAD:DIAG0:190:BCTRL", "OTRS:DIAG0:420:PNEUMATIC"]
+            assert f["writes/value"][0] == 1.5
+            assert np.isnan(f["writes/value"][1])
+            assert list(f["writes/text"].asstr()) == ["", "IN"]
+            assert list(f["readbacks/value"]) == [1.5, 0.1]
+            assert np.all(np.diff(f["readbacks/time"]) >= 0)
+
+            image = f["arrays/OTRS:DIAG0:420:Image:ArrayData"]
+            assert list(image["offset"]) == [0, 6]
+            assert image["data"].dtype == np.uint16
+            assert np.array_equal(image["data"][6:], np.arange(4))
+
+    def test_bounded(self, tmp_path):
+        recorder = Recorder(str(tmp_path / "session.h5"), max_pending_bytes=2**20, flush_interval=10.0)
+        # images count with their size: one of 1 MiB does not fit, scalars still do
+        for _ in range(10):
+            recorder.record_readback("OTRS:DIAG0:420:Image:ArrayData", np.zeros(2**19, dtype=np.uint16))
+        recorder.record_write("QUAD:DIAG0:190:BCTRL", 1.0)
+        assert recorder.dropped == 10
+        assert recorder.pending_bytes <= 2**20
+        recorder.close()
+        assert recorder.pending_bytes == 0
@@ -0,0 +1,67 @@
+import pytest
+
+pytest.importorskip("h5py")
+
+from simulation_server.beamdriver import SimDriver, SimServer
+from simulation_server.tests.conftest import make_beam
+from simulation_server.utils.recorder import Recorder
+from simulation_server.utils.replay import load_session, replay
+
+PVDB = {
+    "QUAD:DIAG0:190:BCTRL": {"type": "float", "value": 0.0, "prec": 5, "drvh": 20, "drvl": -20, "role": "setpoint"},
+    "QUAD:DIAG0:190:BACT": {"type": "float", "value": 0.0, "prec": 5, "role": "derived", "source": ["QUAD:DIAG0:190:BCTRL"]},
+    "BPMS:DIAG0:136:X": {"type": "float", "value": 0.0, "role": "readback"},
+}
+
+
+class TestReplay:
+    @pytest.fixture(autouse=True)
+    def setup_va(self, make_va):
+        self.make_va = lambda: make_va(
+            ["QUAD:DIAG0:190", "BPMS:DIAG0:136"], initial_beam_distribution=make_beam(100)
+        )
+
+    def test_replay(self, tmp_path):
+        path = str(tmp_path / "session.h5")
+        recorder = Recorder(path)
+        recorder.record_write("QUAD:DIAG0:190:BCTRL", 0.5)
+        recorder.record_write("VIRT:BEAM:SIMULATE", 1)
+        recorder.record_write("QUAD:DIAG0:190:BCTRL", 1.5)
+        recorder.record_write("OTRS:DIAG0:420:PNEUMATIC", "IN")
+        recorder.close()
+
+        writes = load_session(path)
+        assert [name for _, name, _ in writes] == [
+            "QUAD:DIAG0:190:BCTRL",
+            "VIRT:BEAM:SIMULATE",
+            "QUAD:DIAG0:190:BCTRL",
+            "OTRS:DIAG0:420:PNEUMATIC",
+        ]
+        assert writes[-1][2] == "IN"
+        writes = writes[:-1]
+
+        result = replay(writes, self.make_va(), readbacks=["QUAD:DIAG0:190:BACT"])
+        assert len(result["durations"]) == 3
+        assert result["total"] >= result["durations"].sum()
+        assert result["readbacks"]["QUAD:DIAG0:190:BACT"] == pytest.approx(1.5)
+
+    def test_realtime(self):
+        writes = [(100.0, "QUAD:DIAG0:190:BCTRL", 0.5), (100.2, "QUAD:DIAG0:190:BCTRL", 1.0)]
+        result = replay(writes, self.make_va(), realtime=True, speed=2.0)
+        assert result["total"] >= 0.1
+
+    def test_driver(self):
+        driver = SimDriver(SimServer(dict(PVDB), threading=True, protocols="pva"), self.make_va())
+        try:
+            writes = [
+                (100.0, "QUAD:DIAG0:190:BCTRL", 0.5),
+                (100.1, "QUAD:DIAG0:190:BCTRL", 25.0),
+            ]
+            result = replay(writes, driver)
+            # writes go through the write filter, the replay ends once they are simulated
+            assert driver.idle.is_set()
+            assert driver.cached_value("QUAD:DIAG0:190:BCTRL") == 20.0
+            assert driver.cached_value("QUAD:DIAG0:190:BACT") == pytest.approx(20.0)
+            assert "BPMS:DIAG0:136:X" in result["readbacks"]
+        finally:
+            driver.stop()
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from simulation_server.utils.ring_buffer import RingBuffer
+
+
+class TestRingBuffer:
+    def test_extend(self):
+        buffer = RingBuffer(2, 5)
+        assert buffer.history().shape == (2, 0)
+
+        buffer.extend(np.array([[1.0, 2.0, 3.0], [10.0, 20.0, 30.0]]))
+        assert len(buffer) == 3
+        assert np.array_equal(buffer.history(), [[1, 2, 3], [10, 20, 30]])
+
+    def test_wrap_around(self):
+        buffer = RingBuffer(1, 4)
+        buffer.extend(np.arange(3.0)[None, :])
+        buffer.extend(np.arange(3.0, 6.0)[None, :])
+
+        # oldest shots are overwritten, history stays in shot order
+        assert len(buffer) == 4
+        assert np.array_equal(buffer.history(), [[2, 3, 4, 5]])
+
+        # blocks longer than the buffer keep their newest shots
+        buffer.extend(np.arange(10.0)[None, :])
+        assert np.array_equal(buffer.history(), [[6, 7, 8, 9]])
+
+    def test_invalid_length(self):
+        with pytest.raises(ValueError):
+            RingBuffer(1, 0)
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+from p4p.nt import NTURI
+
+from simulation_server.utils.snapshot import (
+    load_snapshot,
+    save_snapshot,
+    snapshot_request,
+    snapshot_rows,
+    snapshot_table,
+    table_snapshot,
+)
+
+
+class TestSnapshot:
+    def test_file_round_trip(self, tmp_path):
+        values = {"QUAD:DIAG0:190:BCTRL": 1.5, "OTRS:DIAG0:420:ROI:MinX": 10, "OTRS:DIAG0:420:PNEUMATIC": True}
+        path = str(tmp_path / "machine.json")
+        save_snapshot(path, values)
+
+        assert load_snapshot(path) == {
+            "QUAD:DIAG0:190:BCTRL": 1.5,
+            "OTRS:DIAG0:420:ROI:MinX": 10.0,
+            "OTRS:DIAG0:420:PNEUMATIC": 1.0,
+        }
+
+    def test_table_round_trip(self):
+        values = {"QUAD:DIAG0:190:BCTRL": 1.5, "QUAD:DIAG0:210:BCTRL": -0.5}
+        rows = snapshot_table(values)
+
+        assert rows[0] == {"name": "QUAD:DIAG0:190:BCTRL", "value": 1.5}
+        assert table_snapshot(rows) == values
+
+    def test_request(self):
+        request = NTURI([("pvs", "as"), ("wait", "?")]).wrap(
+            "VIRT:BEAM:SNAPSHOT", kws={"pvs": ["BPMS:*:X", "QUAD:DIAG0:190:BCTRL"], "wait": True}
+        )
+        assert snapshot_request(request) == (["BPMS:*:X", "QUAD:DIAG0:190:BCTRL"], True)
+
+        request = NTURI([("pvs", "s")]).wrap("VIRT:BEAM:SNAPSHOT", kws={"pvs": "BPMS:*:X, BPMS:*:Y"})
+        assert snapshot_request(request) == (["BPMS:*:X", "BPMS:*:Y"], False)
+
+        with pytest.raises(ValueError):
+            snapshot_request({"wait": True})
+
+    def test_rows(self):
+        values = {
+            "BPMS:DIAG0:190:X": 1e-4,
+            "BPMS:DIAG0:190:Y": 2e-4,
+            "BPMS:DIAG0:210:X": 3e-4,
+            "OTRS:DIAG0:420:XRMS": np.float32(5e-5),
+            "OTRS:DIAG0:420:Image:ArrayData": np.zeros((4, 4)),
+            "VIRT:BEAM:GENERATION": 3,
+        }
+        rows = snapshot_rows(values, ["VIRT:BEAM:GENERATION", "BPMS:*:X", "BPMS:DIAG0:190:X", "OTRS:*"])
+        # in the order of the patterns, without duplicates, skipping arrays
+        assert [row["name"] for row in rows] == [
+            "VIRT:BEAM:GENERATION", "BPMS:DIAG0:190:X", "BPMS:DIAG0:210:X", "OTRS:DIAG0:420:XRMS",
+        ]
+        assert rows[0]["value"] == 3.0
+        assert snapshot_rows(values, ["QUAD:*"]) == []
+
+        with pytest.raises(KeyError):
+            snapshot_rows(values, ["BPMS:DIAG0:390:X"])
+        with pytest.raises(ValueError):
+            snapshot_rows(values, ["OTRS:DIAG0:420:Image:ArrayData"])
@@ -0,0 +1,73 @@
+import math
+
+import pytest
+
+from simulation_server.utils.write_filter import REJECT, UNCHANGED, WRITE, WriteFilter
+
+PVDB = {
+    "QUAD:1:BCTRL": {"type": "float", "value": 0.0, "prec": 3, "drvl": -20, "drvh": 20},
+    "TCAV:1:AREQ": {"type": "float", "value": 0.0, "mdel": 0.1},
+    "XCOR:1:BCTRL": {"type": "float", "value": 0.0},
+    "OTRS:1:ROI:MinX": {"type": "int", "value": 0, "drvl": 0, "drvh": 1000},
+    "OTRS:1:PNEUMATIC": {"type": "enum", "enums": ["OUT", "IN"]},
+}
+
+
+class TestWriteFilter:
+    def setup_method(self):
+        self.values = {"QUAD:1:BCTRL": 1.0, "TCAV:1:AREQ": 1.0, "XCOR:1:BCTRL": 0.5, "OTRS:1:ROI:MinX": 10}
+
+    def make_filter(self, **kwargs):
+        return WriteFilter(PVDB, self.values.get, **kwargs)
+
+    def test_unchanged(self):
+        write_filter = self.make_filter()
+        # within half a unit of the last digit shown
+        assert write_filter.check("QUAD:1:BCTRL", 1.0004) == (UNCHANGED, 1.0004)
+        assert write_filter.check("QUAD:1:BCTRL", 1.0006) == (WRITE, 1.0006)
+        # the monitor deadband when there is one
+        assert write_filter.check("TCAV:1:AREQ", 1.05)[0] == UNCHANGED
+        assert write_filter.check("TCAV:1:AREQ", 1.2)[0] == WRITE
+        # exact without either
+        assert write_filter.check("XCOR:1:BCTRL", 0.5)[0] == UNCHANGED
+        assert write_filter.check("XCOR:1:BCTRL", 0.5000001)[0] == WRITE
+        assert write_filter.check("OTRS:1:ROI:MinX", 10)[0] == UNCHANGED
+        # enums and PVs unknown to the pvdb always go through
+        assert write_filter.check("OTRS:1:PNEUMATIC", 1) == (WRITE, 1)
+        assert write_filter.check("VIRT:BEAM:RESET_SIM", 1) == (WRITE, 1)
+
+        assert self.make_filter(suppress_unchanged=False).check("XCOR:1:BCTRL", 0.5)[0] == WRITE
+
+    def test_clamp(self):
+        write_filter = self.make_filter()
+        assert write_filter.check("QUAD:1:BCTRL", 25.0) == (WRITE, 20)
+        assert write_filter.check("QUAD:1:BCTRL", -30.0) == (WRITE, -20)
+        assert write_filter.check("OTRS:1:ROI:MinX", 2000) == (WRITE, 1000)
+        assert isinstance(write_filter.check("QUAD:1:BCTRL", 25.0)[1], float)
+        # no limits
+        assert write_filter.check("XCOR:1:BCTRL", 100.0) == (WRITE, 100.0)
+        assert write_filter.check("QUAD:1:BCTRL", math.nan)[0] == REJECT
+
+        # a clamped write may leave the setpoint unchanged
+        self.values["QUAD:1:BCTRL"] = 20.0
+        assert write_filter.check("QUAD:1:BCTRL", 25.0)[0] == UNCHANGED
+
+    def test_reject(self):
+        write_filter = self.make_filter(limit_policy="reject")
+        assert write_filter.check("QUAD:1:BCTRL", 25.0) == (REJECT, 25.0)
+        assert write_filter.check("QUAD:1:BCTRL", 20.0) == (WRITE, 20.0)
+
+        write_filter = self.make_filter(limit_policy="off")
+        assert write_filter.check("QUAD:1:BCTRL", 25.0) == (WRITE, 25.0)
+
+        with pytest.raises(ValueError):
+            self.make_filter(limit_policy="wrap")
+
+    def test_field_limits(self):
+        write_filter = self.make_filter()
+        # limits written to the record fields override the pvdb
+        self.values["QUAD:1:BCTRL.DRVH"] = 5.0
+        assert write_filter.check("QUAD:1:BCTRL", 10.0) == (WRITE, 5.0)
+        # DRVH <= DRVL disables the limits, like EPICS records
+        self.values["QUAD:1:BCTRL.DRVH"] = self.values["QUAD:1:BCTRL.DRVL"] = 0.0
+        assert write_filter.check("QUAD:1:BCTRL", 100.0) == (WRITE, 100.0)
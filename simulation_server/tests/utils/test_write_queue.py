@@ -0,0 +1,81 @@
+import pytest
+
+from simulation_server.utils.write_queue import (
+    WriteQueue,
+    PRIORITY_CRITICAL,
+    PRIORITY_NORMAL,
+)
+
+
+def shutter_first(name):
+    return PRIORITY_CRITICAL if name == "SHUTTER" else PRIORITY_NORMAL
+
+
+class TestWriteQueue:
+    def test_coalescing(self):
+        queue = WriteQueue()
+        queue.put("QUAD:1:BCTRL", 1.0)
+        queue.put("QUAD:2:BCTRL", 2.0)
+        queue.put("QUAD:1:BCTRL", 3.0)
+
+        assert queue.depth == 2
+        # last write wins, but keeps its original place
+        assert queue.drain() == [("QUAD:1:BCTRL", 3.0), ("QUAD:2:BCTRL", 2.0)]
+        assert len(queue) == 0
+        assert queue.oldest_age() == 0.0
+
+    def test_priority(self):
+        queue = WriteQueue(priority=shutter_first)
+        queue.put("XCOR:1:BCTRL", 0.1)
+        queue.put("SHUTTER", 1)
+        queue.put("XCOR:2:BCTRL", 0.2)
+
+        assert [k for k, _ in queue.drain()] == ["SHUTTER", "XCOR:1:BCTRL", "XCOR:2:BCTRL"]
+
+    def test_drop_oldest(self):
+        queue = WriteQueue(max_size=2, overflow="drop_oldest", priority=shutter_first)
+        assert queue.put("SHUTTER", 1)
+        assert queue.put("XCOR:1:BCTRL", 0.1)
+        assert queue.put("XCOR:2:BCTRL", 0.2)
+        # coalescing into a pending PV never overflows
+        assert queue.put("XCOR:2:BCTRL", 0.3)
+
+        assert queue.dropped == 1
+        assert queue.drain() == [("SHUTTER", 1), ("XCOR:2:BCTRL", 0.3)]
+
+        # a queue full of critical writes refuses normal ones
+        queue = WriteQueue(max_size=1, overflow="drop_oldest", priority=shutter_first)
+        assert queue.put("SHUTTER", 1)
+        assert not queue.put("XCOR:1:BCTRL", 0.1)
+
+    def test_on_evict(self):
+        evicted = []
+        queue = WriteQueue(max_size=1, overflow="drop_oldest", on_evict=lambda *e: evicted.append(e))
+        assert queue.put("XCOR:1:BCTRL", 0.1)
+        assert queue.put("XCOR:2:BCTRL", 0.2)
+        assert evicted == [("XCOR:1:BCTRL", 0.1)]
+
+        # refused writes are not evictions
+        queue = WriteQueue(max_size=1, overflow="reject", on_evict=lambda *e: evicted.append(e))
+        assert queue.put("XCOR:1:BCTRL", 0.1)
+        assert not queue.put("XCOR:2:BCTRL", 0.2)
+        assert evicted == [("XCOR:1:BCTRL", 0.1)]
+
+    def test_reject(self):
+        queue = WriteQueue(max_size=1, overflow="reject")
+        assert queue.put("XCOR:1:BCTRL", 0.1)
+        assert not queue.put("XCOR:2:BCTRL", 0.2)
+        assert queue.dropped == 1
+        assert queue.drain() == [("XCOR:1:BCTRL", 0.1)]
+
+    def test_put_many(self):
+        queue = WriteQueue(max_size=1, overflow="reject")
+        assert queue.put("XCOR:1:BCTRL", 0.1)
+        queue.put_many({"XCOR:1:BCTRL": 0.2, "XCOR:2:BCTRL": 0.3})
+
+        assert queue.dropped == 0
+        assert queue.drain() == [("XCOR:1:BCTRL", 0.2), ("XCOR:2:BCTRL", 0.3)]
+
+    def test_invalid_policy(self):
+        with pytest.raises(ValueError):
+            WriteQueue(overflow="block")
@@ -0,0 +1,79 @@
+import os
+
+import pytest
+import torch
+from cheetah.accelerator import Segment
+
+from simulation_server.virtual_accelerator import artifact_cache
+from simulation_server.virtual_accelerator.artifact_cache import (
+    load_beam,
+    load_lattice,
+    parse_lattice,
+)
+
+RESOURCES = os.path.join(os.path.split(os.path.abspath(__file__))[0], "resources")
+LATTICE = os.path.join(RESOURCES, "diag0.json")
+
+
+class TestArtifactCache:
+    def test_subcell(self):
+        lattice = parse_lattice(LATTICE, torch.float64, subcell_dest="bpmdg002")
+        reference = Segment.from_lattice_json(LATTICE, dtype=torch.float64).subcell(end="bpmdg002")
+        assert [e.name for e in lattice.elements] == [e.name for e in reference.elements]
+        assert lattice.length == pytest.approx(reference.length.item())
+        assert {b.dtype for b in lattice.buffers() if b.is_floating_point()} == {torch.float64}
+
+        with pytest.raises(ValueError):
+            parse_lattice(LATTICE, torch.float32, subcell_dest="nowhere")
+
+    def test_lattice_cache(self, tmp_path, monkeypatch):
+        lattice = load_lattice(LATTICE, torch.float32, "bpmdg002", str(tmp_path))
+        assert len(list(tmp_path.glob("lattice-*.pt"))) == 1
+
+        # hits do not parse the lattice
+        monkeypatch.setattr(artifact_cache, "parse_lattice", None)
+        cached = load_lattice(LATTICE, torch.float32, "bpmdg002", str(tmp_path))
+        assert [e.name for e in cached.elements] == [e.name for e in lattice.elements]
+        for a, b in zip(cached.buffers(), lattice.buffers()):
+            torch.testing.assert_close(a, b, rtol=0, atol=0, equal_nan=True)
+        monkeypatch.undo()
+
+        # a different precision, subcell or source is another artifact
+        load_lattice(LATTICE, torch.float64, "bpmdg002", str(tmp_path))
+        load_lattice(LATTICE, torch.float32, None, str(tmp_path))
+        changed = tmp_path / "diag0.json"
+        changed.write_text(open(LATTICE).read().replace("bpmdg002", "bpmdg00x"))
+        load_lattice(str(changed), torch.float32, "bpmdg00x", str(tmp_path))
+        assert len(list(tmp_path.glob("lattice-*.pt"))) == 4
+
+    def test_beam_cache(self, tmp_path):
+        calls = []
+
+        def build():
+            calls.append(1)
+            return torch.nn.Linear(2, 2)
+
+        first = load_beam(build, cache_dir=str(tmp_path), energy=90e6)
+        second = load_beam(build, cache_dir=str(tmp_path), energy=90e6)
+        assert len(calls) == 1
+        assert torch.equal(first.weight, second.weight)
+        load_beam(build, cache_dir=str(tmp_path), energy=64e6)
+        load_beam(build, energy=90e6)
+        assert len(calls) == 3
+
+    def test_unreadable(self, tmp_path):
+        load_lattice(LATTICE, torch.float32, cache_dir=str(tmp_path))
+        (path,) = tmp_path.glob("lattice-*.pt")
+        path.write_bytes(b"not a lattice")
+
+        lattice = load_lattice(LATTICE, torch.float32, cache_dir=str(tmp_path))
+        assert isinstance(lattice, Segment)
+        assert isinstance(torch.load(path, weights_only=False), Segment)
+
+    def test_no_cache(self, tmp_path, monkeypatch):
+        # without a cache directory the sources are not hashed
+        monkeypatch.setattr(artifact_cache, "source_key", None)
+        assert isinstance(load_lattice(LATTICE, torch.float32), Segment)
+        assert isinstance(load_beam(lambda: torch.zeros(2), [str(tmp_path / "beam.h5")]), torch.Tensor)
+        with pytest.raises(FileNotFoundError, match="missing.json"):
+            load_lattice(str(tmp_path / "missing.json"), torch.float32)
@@ -0,0 +1,107 @@
+import subprocess
+import sys
+
+import pytest
+
+from simulation_server.headless import HeadlessSimulator
+from simulation_server.tests.conftest import make_surrogate
+
+DEVICES = ["XCOR:DIAG0:178", "QUAD:DIAG0:190", "BPMS:DIAG0:390", "OTRS:DIAG0:420"]
+
+PVDB = {
+    "QUAD:DIAG0:190:BCTRL": {"type": "float", "value": 0.0, "prec": 5, "drvh": 20, "drvl": -20, "role": "setpoint"},
+    "QUAD:DIAG0:190:BACT": {"type": "float", "value": 0.0, "prec": 5, "role": "derived", "source": ["QUAD:DIAG0:190:BCTRL"]},
+    "QUAD:DIAG0:190:BMAX": {"type": "float", "value": 20.0, "role": "static"},
+    "XCOR:DIAG0:178:BCTRL": {"type": "float", "value": 0.0, "prec": 5, "role": "setpoint"},
+    "BPMS:DIAG0:390:X": {"type": "float", "value": 0.0, "role": "readback"},
+    "OTRS:DIAG0:420:XRMS": {"type": "float", "value": 0.0, "role": "readback"},
+}
+
+
+class TestHeadlessSimulator:
+    @pytest.fixture(autouse=True)
+    def setup_va(self, make_va):
+        def make():
+            va = make_va(DEVICES)
+            va.lattice.otrdg02.is_active = True
+            return va
+
+        self.make_va = make
+
+    def test_no_epics(self):
+        code = "import sys, simulation_server.headless; print('pcaspy' in sys.modules or 'p4p' in sys.modules)"
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        assert result.stdout.strip() == "False"
+
+    def test_evaluate(self):
+        sim = HeadlessSimulator(self.make_va(), PVDB)
+        reference = self.make_va()
+        reference.set_pvs({"QUAD:DIAG0:190:BCTRL": 1.5, "XCOR:DIAG0:178:BCTRL": 0.01})
+
+        readings = sim.evaluate(
+            {"QUAD:DIAG0:190:BCTRL": 1.5, "XCOR:DIAG0:178:BCTRL": 0.01},
+            ["BPMS:DIAG0:390:X", "OTRS:DIAG0:420:XRMS", "QUAD:DIAG0:190:BMAX"],
+        )
+        assert readings["BPMS:DIAG0:390:X"] == reference.get_pvs(["BPMS:DIAG0:390:X"])["BPMS:DIAG0:390:X"]
+        assert readings["OTRS:DIAG0:420:XRMS"] == reference.get_pvs(["OTRS:DIAG0:420:XRMS"])["OTRS:DIAG0:420:XRMS"]
+        assert readings["QUAD:DIAG0:190:BMAX"] == 20.0
+        assert sim.get("QUAD:DIAG0:190:BCTRL") == 1.5
+        assert sim.get("QUAD:DIAG0:190:BACT") == pytest.approx(1.5, rel=1e-5)
+        assert sim.generation == 1
+
+        with pytest.raises(KeyError):
+            sim.get("QUAD:DIAG0:210:BCTRL")
+
+    def test_writes(self):
+        sim = HeadlessSimulator(self.make_va(), PVDB, limit_policy="reject")
+        sim.get("BPMS:DIAG0:390:X")
+        # writes are simulated together at the next read, unchanged ones not at all
+        assert sim.put("QUAD:DIAG0:190:BCTRL", 1.0)
+        assert sim.put("XCOR:DIAG0:178:BCTRL", 0.01)
+        assert sim.put("QUAD:DIAG0:190:BCTRL", 1.5)
+        assert sim.generation == 1
+        assert sim.put("QUAD:DIAG0:190:BCTRL", 1.500001)
+        assert sim.generation == 1
+
+        assert not sim.put("QUAD:DIAG0:190:BCTRL", 25.0)
+        with pytest.raises(ValueError):
+            sim.evaluate({"XCOR:DIAG0:178:BCTRL": 0.0, "QUAD:DIAG0:190:BCTRL": 25.0}, ["BPMS:DIAG0:390:X"])
+        # nothing of a rejected evaluation is applied
+        assert sim.snapshot() == {"QUAD:DIAG0:190:BCTRL": 1.5, "XCOR:DIAG0:178:BCTRL": 0.01}
+        assert sim.generation == 1
+
+        # restored values are held to the drive limits too
+        assert not sim.restore({"QUAD:DIAG0:190:BCTRL": 25.0, "XCOR:DIAG0:178:BCTRL": 0.02})
+        assert sim.snapshot() == {"QUAD:DIAG0:190:BCTRL": 1.5, "XCOR:DIAG0:178:BCTRL": 0.02}
+
+    def test_independent_instances(self):
+        sim = HeadlessSimulator(self.make_va(), PVDB)
+        initial = sim.snapshot()
+        other = sim.clone()
+
+        sim.put("XCOR:DIAG0:178:BCTRL", 0.01)
+        assert sim.get("BPMS:DIAG0:390:X") != other.get("BPMS:DIAG0:390:X")
+        assert other.snapshot() == initial
+        assert other.generation == 0
+
+        sim.restore(initial)
+        sim.reset()
+        assert sim.snapshot() == initial
+
+    def test_surrogate(self):
+        surrogate = make_surrogate(self.make_va())
+        sim = HeadlessSimulator(surrogate, PVDB)
+        tracks = []
+        track = surrogate.virtual_accelerator.track
+        surrogate.virtual_accelerator.track = lambda *args: tracks.append(args) or track(*args)
+
+        xcor = sim.get("XCOR:DIAG0:178:BCTRL")
+        readings = sim.evaluate({"XCOR:DIAG0:178:BCTRL": xcor + 0.005}, ["BPMS:DIAG0:390:X"])
+        assert tracks == []
+        assert readings["BPMS:DIAG0:390:X"] == surrogate.model.predict(surrogate._x)["BPMS:DIAG0:390:X"]
+
+        # settings outside of the training domain are tracked
+        readings = sim.evaluate({"XCOR:DIAG0:178:BCTRL": xcor + 0.05}, ["BPMS:DIAG0:390:X"])
+        assert len(tracks) == 1
+        reading = surrogate.virtual_accelerator.get_pvs(["BPMS:DIAG0:390:X"])["BPMS:DIAG0:390:X"]
+        assert readings["BPMS:DIAG0:390:X"] == reading
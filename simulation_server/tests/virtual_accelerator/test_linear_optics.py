@@ -0,0 +1,90 @@
+import pytest
+import torch
+
+from simulation_server.virtual_accelerator.linear_optics import READBACK_CLASSES
+
+DEVICES = [
+    "XCOR:DIAG0:178", "YCOR:DIAG0:199", "QUAD:DIAG0:190", "BPMS:DIAG0:210", "BPMS:DIAG0:390", "OTRS:DIAG0:420",
+]
+
+SETPOINTS = {
+    "XCOR:DIAG0:178:BCTRL": 0.01,
+    "YCOR:DIAG0:199:BCTRL": -0.01,
+    "QUAD:DIAG0:190:BCTRL": 2.0,
+}
+BPM_READBACKS = ["BPMS:DIAG0:210:X", "BPMS:DIAG0:210:Y", "BPMS:DIAG0:390:X", "BPMS:DIAG0:390:Y"]
+SCREEN_READBACKS = ["OTRS:DIAG0:420:X", "OTRS:DIAG0:420:Y", "OTRS:DIAG0:420:XRMS", "OTRS:DIAG0:420:YRMS"]
+
+
+class TestLinearOptics:
+    @pytest.fixture(autouse=True)
+    def setup_va(self, make_va):
+        def make(linear_readbacks=tuple(READBACK_CLASSES), tcav_off=True):
+            va = make_va(DEVICES, linear_readbacks=linear_readbacks)
+            if tcav_off:
+                # Screens are behind the TCAV, which only tracks linearly when it is off
+                for element in va.lattice.tcxdg0:
+                    element.voltage = torch.zeros_like(element.voltage)
+                va.linear_optics.invalidate("tcxdg0")
+                va.track()
+            return va
+
+        self.make_va = make
+
+    def test_cross_check(self):
+        va = self.make_va()
+        va.set_pvs(SETPOINTS)
+        linear = va.get_pvs(BPM_READBACKS + SCREEN_READBACKS)
+
+        va.track()
+        tracked = va.get_pvs(BPM_READBACKS + SCREEN_READBACKS)
+        for name in BPM_READBACKS:
+            assert linear[name] == pytest.approx(tracked[name], rel=1e-4, abs=1e-9)
+        for name in SCREEN_READBACKS:
+            assert linear[name] == pytest.approx(tracked[name], rel=1e-4, abs=1e-3)
+
+    def test_no_tracking(self):
+        va = self.make_va()
+        reading = va.lattice.bpmdg002.reading
+
+        va.set_pvs(SETPOINTS)
+        values = va.get_pvs(BPM_READBACKS)
+        # The BPM did not see a new beam
+        assert va.lattice.bpmdg002.reading is reading
+        assert values["BPMS:DIAG0:210:X"] != pytest.approx(reading[0].item())
+
+        # Images need tracking
+        va.get_pvs(["OTRS:DIAG0:420:Image:ArrayData"])
+        assert va.lattice.bpmdg002.reading is not reading
+
+    def test_consistent_readings(self):
+        va = self.make_va()
+        reading = va.lattice.bpmdg002.reading
+        va.set_pvs(SETPOINTS, track=False)
+        va.update_readings(readbacks=BPM_READBACKS)
+        assert va.lattice.bpmdg002.reading is reading
+
+        # An image among the readbacks tracks, so none of them come from the linear optics
+        va.update_readings(readbacks=BPM_READBACKS + ["OTRS:DIAG0:420:Image:ArrayData"])
+        assert va.lattice.bpmdg002.reading is not reading
+
+    def test_nonlinear_upstream(self):
+        va = self.make_va(tcav_off=False)
+        reading = va.lattice.otrdg02.get_read_beam()
+
+        va.set_pvs(SETPOINTS)
+        va.get_pvs(["BPMS:DIAG0:210:X"])
+        assert va.lattice.otrdg02.get_read_beam() is reading
+        # The screen is behind the TCAV that is on, so it is tracked
+        va.get_pvs(["OTRS:DIAG0:420:X"])
+        assert va.lattice.otrdg02.get_read_beam() is not reading
+
+    def test_selected_classes(self):
+        va = self.make_va(linear_readbacks=("bpm_orbit",))
+        reading = va.lattice.otrdg02.get_read_beam()
+        va.set_pvs(SETPOINTS)
+        va.get_pvs(["OTRS:DIAG0:420:XRMS"])
+        assert va.lattice.otrdg02.get_read_beam() is not reading
+
+        with pytest.raises(ValueError):
+            self.make_va(linear_readbacks=("orbit",))
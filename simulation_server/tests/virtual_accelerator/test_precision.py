@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+import torch
+
+DEVICES = ["XCOR:DIAG0:178", "QUAD:DIAG0:190", "TCAV:DIAG0:11", "BPMS:DIAG0:390", "OTRS:DIAG0:420"]
+
+SETPOINTS = {
+    "XCOR:DIAG0:178:BCTRL": 0.01,
+    "QUAD:DIAG0:190:BCTRL": 1.5,
+    "TCAV:DIAG0:11:AREQ": 1.0,
+}
+READBACKS = ["BPMS:DIAG0:390:X", "BPMS:DIAG0:390:Y", "OTRS:DIAG0:420:X", "OTRS:DIAG0:420:XRMS"]
+
+
+class TestPrecision:
+    @pytest.fixture(autouse=True)
+    def setup_va(self, make_va, beam):
+        self.beam = beam
+        self.make_va = lambda precision: make_va(DEVICES, precision=precision)
+
+    def test_dtype(self):
+        va = self.make_va("float64")
+        assert va.initial_beam_distribution.particles.dtype == torch.float64
+        assert va.initial_beam_distribution.energy.dtype == torch.float64
+        assert {buffer.dtype for buffer in va.lattice.buffers() if buffer.is_floating_point()} == {torch.float64}
+        # The caller's beam is left alone
+        assert self.beam.particles.dtype == torch.float32
+
+        va.set_pvs(SETPOINTS)
+        assert va.lattice.qdg001[0].k1.dtype == torch.float64
+        assert va.lattice.tcxdg0[0].voltage.dtype == torch.float64
+
+        with pytest.raises(ValueError):
+            self.make_va("float16")
+
+    def test_readback_deviation(self):
+        values = {}
+        for precision in ("float32", "float64"):
+            va = self.make_va(precision)
+            va.set_pvs(SETPOINTS)
+            values[precision] = va.get_pvs(READBACKS + ["OTRS:DIAG0:420:Image:ArrayData"])
+
+        for name in READBACKS:
+            assert values["float32"][name] == pytest.approx(values["float64"][name], rel=1e-3, abs=1e-8)
+
+        single = values["float32"]["OTRS:DIAG0:420:Image:ArrayData"].astype(float)
+        double = values["float64"]["OTRS:DIAG0:420:Image:ArrayData"].astype(float)
+        assert single.sum() == pytest.approx(double.sum(), rel=1e-5)
+        # Particles next to a pixel edge may change pixel with the precision, at most 1% of them
+        assert np.abs(single - double).sum() <= 2 * 0.01 * double.sum()
@@ -0,0 +1,51 @@
+
+import numpy as np
+import pytest
+
+from simulation_server.virtual_accelerator import SimulationPreempted
+
+DEVICES = ["XCOR:DIAG0:178", "QUAD:DIAG0:190", "BPMS:DIAG0:390", "OTRS:DIAG0:420"]
+
+SETPOINTS = {
+    "XCOR:DIAG0:178:BCTRL": 0.01,
+    "QUAD:DIAG0:190:BCTRL": 1.5,
+}
+READBACKS = ["BPMS:DIAG0:390:X", "BPMS:DIAG0:390:Y", "OTRS:DIAG0:420:XRMS", "OTRS:DIAG0:420:Image:ArrayData"]
+
+
+class TestPreemption:
+    @pytest.fixture(autouse=True)
+    def setup_va(self, make_va):
+        def make(**kwargs):
+            va = make_va(DEVICES, **kwargs)
+            va.lattice.otrdg02.is_active = True
+            return va
+
+        self.make_va = make
+
+    @pytest.mark.parametrize("execution_mode", ["eager", "inference"])
+    def test_same_readings(self, execution_mode):
+        va = self.make_va(execution_mode=execution_mode)
+        va.set_pvs(SETPOINTS)
+        reference = va.get_pvs(READBACKS)
+
+        va.track(preempt=lambda: False)
+        values = va.get_pvs(READBACKS)
+        for name in READBACKS:
+            assert np.array_equal(values[name], reference[name])
+
+    def test_preempt(self):
+        va = self.make_va()
+        reference = self.make_va()
+        reference.set_pvs(SETPOINTS)
+
+        checks = []
+        va.set_pvs(SETPOINTS, track=False)
+        with pytest.raises(SimulationPreempted):
+            va.update_readings(lambda: checks.append(1) or len(checks) > 2)
+        assert len(checks) == 3
+
+        # readings of an abandoned track are never served, the next read tracks again
+        values = va.get_pvs(READBACKS)
+        for name in READBACKS:
+            assert np.array_equal(values[name], reference.get_pvs([name])[name])
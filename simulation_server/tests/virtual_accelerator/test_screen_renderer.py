@@ -0,0 +1,160 @@
+import numpy as np
+import pytest
+import torch
+from cheetah.accelerator import Screen
+from cheetah.particles import ParticleBeam
+
+from simulation_server.utils.default_params import default_sc_diag0
+from simulation_server.virtual_accelerator.screen_renderer import (
+    BincountRenderer,
+    BinnedRenderer,
+    ScreenRenderer,
+    SplatRenderer,
+    make_renderer,
+    render_screen,
+)
+
+
+class TestScreenRenderer:
+    def setup_method(self):
+        self.screen = Screen(
+            resolution=(64, 48),
+            pixel_size=torch.tensor([1e-5, 1e-5]),
+            method="histogram",
+            is_active=True,
+        )
+        beam = ParticleBeam.from_parameters(
+            num_particles=20000,
+            sigma_x=torch.tensor(1.5e-4),
+            sigma_y=torch.tensor(1e-4),
+            total_charge=torch.tensor(1e-9),
+            energy=torch.tensor(90e6),
+        )
+        self.screen.track(beam)
+
+    def reference(self):
+        self.screen.set_read_beam(self.screen.get_read_beam())
+        return self.screen.reading.clone()
+
+    def render(self, renderer):
+        self.screen.renderer = renderer
+        self.screen.set_read_beam(self.screen.get_read_beam())
+        return render_screen(self.screen)
+
+    def test_bincount(self):
+        reference = self.reference()
+        # the beam is larger than the sensor
+        assert reference.sum() < 1e-9 * 0.99
+        image = self.render(BincountRenderer())
+        assert image.shape == reference.shape
+        assert torch.allclose(image, reference, rtol=1e-5, atol=0)
+
+    def test_bin_edges(self):
+        edges_x, edges_y = self.screen.pixel_bin_edges
+        # on the first, an inner and the last edge, just outside and off the sensor
+        x = torch.stack([edges_x[0], edges_x[10], edges_x[-1], edges_x[-1] + 1e-9, torch.tensor(1.0)])
+        y = torch.stack([edges_y[0], edges_y[7], edges_y[-1], edges_y[3], edges_y[3]])
+        particles = torch.zeros(5, 7)
+        particles[:, 0], particles[:, 2], particles[:, 6] = x, y, 1.0
+        beam = ParticleBeam(particles, energy=torch.tensor(90e6), particle_charges=torch.ones(5))
+        self.screen.track(beam)
+
+        reference = self.reference()
+        image = self.render(BincountRenderer())
+        assert torch.equal(image, reference)
+        assert image.sum() == 3
+
+    def test_buffers(self):
+        renderer = BincountRenderer()
+        first = self.render(renderer)
+        second = self.render(renderer)
+        # consecutive readings are different tensors, see screen_frame
+        assert first is not second
+        assert torch.equal(first, second)
+
+    def test_binned(self):
+        reference = self.reference()
+        image = self.render(BinnedRenderer(factor=4))
+        assert image.shape == reference.shape
+        assert image.sum() == pytest.approx(reference.sum().item(), rel=1e-5)
+        # 4x4 blocks have the intensity of the histogram
+        blocks = torch.nn.functional.avg_pool2d(image[None], 4)
+        reference_blocks = torch.nn.functional.avg_pool2d(reference[None], 4)
+        assert torch.allclose(blocks, reference_blocks, rtol=1e-4, atol=1e-16)
+
+        image = self.render(BinnedRenderer(factor=5, mode="bilinear"))
+        assert image.shape == reference.shape
+
+    def test_splat(self):
+        reference = self.reference()
+        image = self.render(SplatRenderer(num_samples=5000, sigma=1.5))
+        assert image.shape == reference.shape
+        assert image.sum() == pytest.approx(reference.sum().item(), rel=0.05)
+
+        def centroid(image):
+            rows, cols = torch.meshgrid(
+                torch.arange(image.shape[0]), torch.arange(image.shape[1]), indexing="ij"
+            )
+            return [(image * rows).sum() / image.sum(), (image * cols).sum() / image.sum()]
+
+        assert [float(c) for c in centroid(image)] == pytest.approx(
+            [float(c) for c in centroid(reference)], abs=0.5
+        )
+        # the same subsample every time
+        assert torch.equal(image.clone(), self.render(self.screen.renderer))
+
+    def test_make_renderer(self):
+        assert isinstance(make_renderer({}), BincountRenderer)
+        assert make_renderer({"renderer": "cheetah"}) is None
+        renderer = make_renderer({"renderer": "binned", "renderer_options": {"factor": 2}})
+        assert renderer.factor == 2
+        with pytest.raises(ValueError):
+            make_renderer({"renderer": "kde"})
+        with pytest.raises(ValueError):
+            make_renderer({"renderer": "splat", "renderer_options": {"sigma": 0}})
+
+        # renderers have to implement render
+        class Incomplete(ScreenRenderer):
+            pass
+
+        with pytest.raises(TypeError):
+            Incomplete()
+
+    def test_virtual_accelerator(self, make_va):
+        frames = {}
+        for renderer in ["cheetah", "bincount"]:
+            va = make_va(
+                ["OTRS:DIAG0:420"], screen_params={"OTRDG02": {"renderer": renderer, "dtype": "uint12"}}
+            )
+            frames[renderer] = va.get_pvs(["OTRS:DIAG0:420:Image:ArrayData"])[
+                "OTRS:DIAG0:420:Image:ArrayData"
+            ]
+        assert frames["bincount"].dtype == np.uint16
+        assert np.array_equal(frames["bincount"], frames["cheetah"])
+        assert isinstance(va.lattice.otrdg02.renderer, BincountRenderer)
+
+    def test_quantized_frame(self, make_va):
+        # scaled like the float frames by default
+        va = make_va(["OTRS:DIAG0:420"], screen_params=default_sc_diag0)
+        frame = va.get_pvs(["OTRS:DIAG0:420:Image:ArrayData"])["OTRS:DIAG0:420:Image:ArrayData"]
+        reading = va.lattice.otrdg02.reading.T.numpy().ravel()
+        assert frame.dtype == np.uint16
+        assert np.array_equal(frame, np.clip(np.rint(reading * np.float32(65535)), 0, 4095))
+
+        # Readings are ~1e-13 C per pixel, auto-exposure brings the peak to full scale
+        params = {"OTRDG02": {**default_sc_diag0["OTRDG02"], "gain": "auto"}}
+        va = make_va(["OTRS:DIAG0:420"], screen_params=params)
+        frame = va.get_pvs(["OTRS:DIAG0:420:Image:ArrayData"])["OTRS:DIAG0:420:Image:ArrayData"]
+        reading = va.lattice.otrdg02.reading.T.numpy().ravel()
+
+        assert frame.dtype == np.uint16
+        assert frame.max() == 4095
+        assert np.count_nonzero(frame) > 0.5 * np.count_nonzero(reading)
+        # counts follow the charge
+        assert np.argmax(frame) == np.argmax(reading)
+
+        gain = 1e16
+        va = make_va(["OTRS:DIAG0:420"], screen_params={"OTRDG02": {"dtype": "uint12", "gain": gain}})
+        frame = va.get_pvs(["OTRS:DIAG0:420:Image:ArrayData"])["OTRS:DIAG0:420:Image:ArrayData"]
+        reading = va.lattice.otrdg02.reading.T.numpy().ravel()
+        assert np.array_equal(frame, np.clip(np.rint(reading * np.float32(gain)), 0, 4095))
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from simulation_server.tests.conftest import make_beam
+from simulation_server.virtual_accelerator.surrogate import (
+    SurrogateAccelerator,
+    SurrogateModel,
+    default_io,
+    generate_samples,
+    train_surrogate,
+)
+
+DEVICES = ["XCOR:DIAG0:178", "QUAD:DIAG0:190", "BPMS:DIAG0:210"]
+
+
+class TestSurrogate:
+    @pytest.fixture(autouse=True)
+    def setup_va(self, make_va):
+        self.make_va = lambda: make_va(DEVICES, initial_beam_distribution=make_beam(100))
+
+    def train(self, va):
+        inputs, outputs = default_io(va)
+        assert inputs == ["XCOR:DIAG0:178:BCTRL", "QUAD:DIAG0:190:BCTRL"]
+        assert outputs == ["BPMS:DIAG0:210:X", "BPMS:DIAG0:210:Y", "BPMS:DIAG0:210:TMIT"]
+
+        bounds = np.array([[-0.01, 0.01], [-1.0, 1.0]])
+        X, Y = generate_samples(va, inputs, outputs, bounds, 64, seed=0)
+        return train_surrogate(X, Y, inputs, outputs, epochs=500, seed=0)
+
+    def test_predict(self):
+        va = self.make_va()
+        surrogate = SurrogateAccelerator(va, self.train(va))
+
+        surrogate.set_pvs({"XCOR:DIAG0:178:BCTRL": 0.005})
+        assert surrogate.stale
+        predicted = surrogate.get_pvs(["BPMS:DIAG0:210:X", "XCOR:DIAG0:178:BCTRL"])
+        assert surrogate.stale
+        assert surrogate.fallbacks == 0
+        # Setpoints are read from the lattice
+        assert predicted["XCOR:DIAG0:178:BCTRL"] == pytest.approx(0.005)
+
+        va.track()
+        tracked = va.get_pvs(["BPMS:DIAG0:210:X"])["BPMS:DIAG0:210:X"]
+        spread = abs(tracked) + 1e-6
+        assert abs(predicted["BPMS:DIAG0:210:X"] - tracked) < 0.2 * spread
+
+    def test_fallback(self):
+        va = self.make_va()
+        surrogate = SurrogateAccelerator(va, self.train(va))
+
+        # Outside of the training domain
+        surrogate.set_pvs({"XCOR:DIAG0:178:BCTRL": 0.05})
+        assert not surrogate.stale
+        assert surrogate.fallbacks == 1
+
+        # Back inside, then a PV the model does not take
+        surrogate.set_pvs({"XCOR:DIAG0:178:BCTRL": 0.0})
+        assert surrogate.stale
+        surrogate.set_pvs({"VIRT:BEAM:RESET_SIM": 1})
+        assert not surrogate.stale
+        assert surrogate.fallbacks == 2
+
+    def test_save_load(self, tmp_path):
+        va = self.make_va()
+        model = self.train(va)
+        model.save(str(tmp_path / "surrogate.pt"))
+        loaded = SurrogateModel.load(str(tmp_path / "surrogate.pt"))
+
+        x = np.array([0.001, 0.5])
+        assert loaded.inputs == model.inputs
+        assert loaded.predict(x) == pytest.approx(model.predict(x))
+        assert loaded.in_domain(x)
+        assert not loaded.in_domain(np.array([0.02, 0.5]))
+        assert loaded.in_domain(np.array([0.02, 0.5]), margin=1.0)
@@ -1,5 +1,14 @@
 import numpy as np
-from simulation_server.virtual_accelerator.utils import add_noise
+from simulation_server.virtual_accelerator.utils import (
+    add_noise,
+    bin_image,
+    camera_format,
+    camera_gain,
+    clamp_roi,
+    crop_image,
+    quantize_image,
+)
+import pytest
 
 
 class TestUtils:
@@ -19,3 +28,47 @@ class TestUtils:
         # Check that noise is within expected range
         assert np.all(noisy_1d >= 0)
         assert np.all(noisy_2d >= 0)
+
+    def test_bin_image(self):
+        data = np.arange(7 * 9, dtype=float).reshape(7, 9)
+        binned = bin_image(data, 2)
+
+        # remainder rows/columns are dropped, each pixel sums a 2x2 block
+        assert binned.shape == (3, 4)
+        assert binned[0, 0] == data[0:2, 0:2].sum()
+        assert binned[2, 3] == data[4:6, 6:8].sum()
+        assert bin_image(data, 1) is data
+
+    def test_crop_image(self):
+        data = np.arange(10 * 20).reshape(10, 20)
+        assert np.array_equal(crop_image(data, 2, 3, 4, 5), data[2:6, 3:8])
+
+        # regions are clamped to the image
+        assert clamp_roi(data.shape, 8, -1, 10, 100) == (8, 0, 2, 20)
+        assert crop_image(data, 8, -1, 10, 100).shape == (2, 20)
+
+    def test_quantize_image(self):
+        data = np.array([[-1.0, 0.4], [0.6, 5000.0]])
+        image = quantize_image(data, np.uint16, 12)
+
+        assert image.dtype == np.uint16
+        assert np.array_equal(image, [[0, 0], [1, 4095]])
+
+    def test_camera_gain(self):
+        data = np.array([[0.0, 1e-13], [2e-13, 4e-13]])
+        # the float frames' scaling unless auto-exposed to the peak
+        assert camera_gain(data, 12) == 65535.0
+        assert camera_gain(data, 12, gain="auto") == pytest.approx(4095 / 4e-13)
+        assert camera_gain(np.zeros((2, 2)), 12, gain="auto") == 0.0
+        assert camera_gain(data, 12, gain=1e15) == 1e15
+
+    def test_camera_format(self):
+        assert camera_format({}) == (None, 16)
+        assert camera_format({"dtype": "uint12"}) == (np.uint16, 12)
+        assert camera_format({"dtype": "uint8"}) == (np.uint8, 8)
+        assert camera_format({"dtype": "uint16", "bit_depth": 14}) == (np.uint16, 14)
+        with pytest.raises(ValueError):
+            camera_format({"dtype": "uint8", "bit_depth": 12})
+        with pytest.raises(ValueError):
+            camera_format({"dtype": "uint12", "gain": 0})
+        assert camera_format({"dtype": "uint12", "gain": "auto"}) == (np.uint16, 12)
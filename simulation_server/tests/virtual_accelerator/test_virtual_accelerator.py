@@ -1,38 +1,18 @@
-from cheetah.particles import ParticleBeam
 from cheetah.accelerator import Screen
 from matplotlib import pyplot as plt
 import torch
+import numpy as np
 from simulation_server.virtual_accelerator.virtual_accelerator import VirtualAccelerator
-import os
+import pytest
 
+from simulation_server.tests.conftest import make_beam
 
-class TestVirtualAccelerator:
-    def setup_method(self):
-        # Create a mock initial beam distribution
-        beam = ParticleBeam.from_twiss(
-            beta_x=torch.tensor(9.34),
-            alpha_x=torch.tensor(-1.6946),
-            emittance_x=torch.tensor(1e-7),
-            beta_y=torch.tensor(9.34),
-            alpha_y=torch.tensor(-1.6946),
-            emittance_y=torch.tensor(1e-7),
-            num_particles=100,
-            total_charge=torch.tensor(1e-9),
-            energy=torch.tensor(2e9 / 33.356),  # magnetic rigidity of 2 kG-m
-        )
 
-        # Initialize the virtual accelerator with a the diag0 lattice file and mapping file
-        self.va = VirtualAccelerator(
-            lattice_file=os.path.join(
-                os.path.split(os.path.abspath(__file__))[0], "resources", "diag0.json"
-            ),
-            mapping_file=os.path.join(
-                os.path.split(os.path.abspath(__file__))[0],
-                "resources",
-                "lcls_elements.csv",
-            ),
-            initial_beam_distribution=beam,
-        )
+class TestVirtualAccelerator:
+    @pytest.fixture(autouse=True)
+    def setup_va(self, make_va):
+        # A beam with a magnetic rigidity of 2 kG-m
+        self.va = make_va(initial_beam_distribution=make_beam(100, 2e9 / 33.356))
 
     def test_set_pvs(self):
         # Set values for various PVS
@@ -102,9 +82,9 @@ class TestVirtualAccelerator:
 
         values = self.va.get_pvs(pv_names)
 
-        # make sure what is returned is an int, float or list
+        # make sure what is returned is an int, float, list or (image) array
         for name, value in values.items():
-            assert isinstance(value, (float, list, int))
+            assert isinstance(value, (float, list, int, np.ndarray))
 
         # make sure images are flattened to the correct length
         for name, value in values.items():
@@ -185,3 +165,57 @@ class TestVirtualAccelerator:
                 assert not torch.all(ele.reading == old_readings[ele.name]), (
                     f"Element {ele.name} did not change reading after simulation run."
                 )
+
+    def test_get_pv_position(self):
+        quad = self.va.get_pv_position("QUAD:DIAG0:190:BCTRL")
+        screen = self.va.get_pv_position("OTRS:DIAG0:420:Image:ArrayData")
+
+        assert quad is not None and screen is not None
+        assert quad < screen
+        assert self.va.get_pv_position("VIRT:BEAM:RESET_SIM") is None
+
+    def test_clone(self):
+        clone = self.va.clone()
+        clone.set_pvs({"QUAD:DIAG0:190:BCTRL": 0.5})
+        clone.set_shutter(True)
+
+        # the clone has its own lattice and beam
+        assert clone.get_pvs(["QUAD:DIAG0:190:BACT"])["QUAD:DIAG0:190:BACT"] == pytest.approx(0.5)
+        assert self.va.get_pvs(["QUAD:DIAG0:190:BACT"])["QUAD:DIAG0:190:BACT"] != pytest.approx(0.5)
+        assert not torch.all(self.va.initial_beam_distribution.particle_charges == 0.0)
+
+    def test_inference_mode(self):
+        va = VirtualAccelerator(
+            lattice_file=self.va.lattice_file,
+            mapping_file=self.va.mapping_file,
+            initial_beam_distribution=self.va.initial_beam_distribution,
+            execution_mode="inference",
+        )
+        values = {"QUAD:DIAG0:190:BCTRL": 0.5, "XCOR:DIAG0:178:BCTRL": 0.1}
+        self.va.set_pvs(values)
+        va.set_pvs(values)
+
+        names = ["BPMS:DIAG0:390:X", "BPMS:DIAG0:390:Y"]
+        assert va.get_pvs(names) == pytest.approx(self.va.get_pvs(names))
+
+        with pytest.raises(ValueError):
+            VirtualAccelerator(
+                lattice_file=self.va.lattice_file,
+                mapping_file=self.va.mapping_file,
+                initial_beam_distribution=self.va.initial_beam_distribution,
+                execution_mode="jit",
+            )
+
+    def test_roi_write(self, monkeypatch):
+        self.va.track()
+        tracks = []
+        track = self.va.track
+        monkeypatch.setattr(self.va, "track", lambda *args, **kwargs: (tracks.append(1), track(*args, **kwargs)))
+
+        self.va.set_pvs({"OTRS:DIAG0:420:ROI:MinX": 10, "OTRS:DIAG0:420:ROI:SizeX": 100})
+        assert tracks == []
+        assert self.va.view_readbacks("OTRS:DIAG0:420:ROI:MinX") == ["OTRS:DIAG0:420:ROI:ArrayData"]
+        assert self.va.view_readbacks("QUAD:DIAG0:190:BCTRL") is None
+
+        self.va.set_pvs({"QUAD:DIAG0:190:BCTRL": 0.5})
+        assert tracks == [1]
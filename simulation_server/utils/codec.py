@@ -0,0 +1,144 @@
+import zlib
+
+import numpy as np
+
+# Optional compressors. zlib ships with python, the others are used when installed.
+try:
+    import lz4.block as lz4_block
+except ImportError:
+    lz4_block = None
+
+try:
+    import blosc
+except ImportError:
+    try:
+        import blosc2 as blosc
+    except ImportError:
+        blosc = None
+
+
+# pvData ScalarType codes of the uncompressed data, stored in NTNDArray codec.parameters
+# like areaDetector does, so clients know what to decompress into
+SCALAR_TYPE_CODES = {
+    "?": 0,
+    "b": 1,
+    "h": 2,
+    "i": 3,
+    "l": 4,
+    "B": 5,
+    "H": 6,
+    "I": 7,
+    "L": 8,
+    "f": 9,
+    "d": 10,
+}
+
+
+def _compress_zlib(data: bytes, itemsize: int, level: int) -> bytes:
+    return zlib.compress(data, level)
+
+
+def _compress_lz4(data: bytes, itemsize: int, level: int) -> bytes:
+    # raw block without size header, as produced by the areaDetector lz4 codec
+    return lz4_block.compress(data, store_size=False)
+
+
+def _compress_blosc(data: bytes, itemsize: int, level: int) -> bytes:
+    return blosc.compress(data, typesize=itemsize, clevel=level)
+
+
+def _decompress_zlib(data: bytes, size: int) -> bytes:
+    return zlib.decompress(data)
+
+
+def _decompress_lz4(data: bytes, size: int) -> bytes:
+    return lz4_block.decompress(data, uncompressed_size=size)
+
+
+def _decompress_blosc(data: bytes, size: int) -> bytes:
+    return blosc.decompress(data)
+
+
+CODECS = {
+    "zlib": _compress_zlib,
+    "lz4": _compress_lz4,
+    "blosc": _compress_blosc,
+}
+
+DECODERS = {
+    "zlib": _decompress_zlib,
+    "lz4": _decompress_lz4,
+    "blosc": _decompress_blosc,
+}
+
+
+def available_codecs() -> list[str]:
+    """Names of the codecs whose compressor is importable"""
+    installed = {"zlib": True, "lz4": lz4_block is not None, "blosc": blosc is not None}
+    return [name for name in CODECS if installed[name]]
+
+
+def check_codec(name: str | None) -> str | None:
+    """
+    Validates a codec name, returns None for no compression.
+
+    Raises
+    ------
+    ValueError
+        If the codec is unknown or its compressor is not installed
+    """
+    if name in (None, "", "none"):
+        return None
+    if name not in CODECS:
+        raise ValueError(f"Unknown image codec {name}, expected one of {list(CODECS)}")
+    if name not in available_codecs():
+        raise ValueError(f"Image codec {name} is not installed, available: {available_codecs()}")
+    return name
+
+
+def compress_array(array: np.ndarray, codec: str, level: int = 1) -> tuple[np.ndarray, int]:
+    """
+    Compress the raw bytes of an array.
+
+    Parameters
+    ----------
+    array : np.ndarray
+        Data to compress, in its final (uncompressed) dtype
+    codec : str
+        One of CODECS
+    level : int
+        Compression level, where the codec supports one
+
+    Returns
+    -------
+    tuple[np.ndarray, int]
+        Compressed bytes as a uint8 array, and the pvData ScalarType code of the input
+    """
+    array = np.ascontiguousarray(array)
+    data = CODECS[codec](array.tobytes(), array.itemsize, level)
+    return np.frombuffer(data, dtype=np.uint8), SCALAR_TYPE_CODES[array.dtype.char]
+
+
+def decompress_array(data: np.ndarray, codec: str, type_code: int, size: int) -> np.ndarray:
+    """
+    Inverse of compress_array.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        Compressed bytes
+    codec : str
+        One of CODECS
+    type_code : int
+        pvData ScalarType code of the uncompressed data
+    size : int
+        Uncompressed size in bytes
+
+    Returns
+    -------
+    np.ndarray
+        Flat array of the original dtype
+    """
+    char = {code: char for char, code in SCALAR_TYPE_CODES.items()}[type_code]
+    raw = DECODERS[codec](np.ascontiguousarray(data).tobytes(), size)
+    return np.frombuffer(raw, dtype=np.dtype(char))
@@ -0,0 +1,155 @@
+import time
+import threading
+from typing import Callable
+
+
+class DebounceScheduler:
+    """
+    Coalesces bursts of writes into a single simulation trigger.
+
+    Every `poke` restarts the debounce window, and the callback runs once no write has
+    arrived for a whole window. A maximum latency caps how long the first write of a
+    burst may wait, so a steady stream of writes can not postpone the simulation forever.
+
+    In adaptive mode the window follows the simulation time: it widens to the (smoothed)
+    duration of recent simulations, so writes that arrive while the model is busy are
+    batched, and narrows back to the configured window as the model sits idle. The
+    callback runs on the scheduler thread, started with `start`.
+    """
+
+    def __init__(
+        self,
+        callback: Callable[[], None],
+        window: float = 0.0,
+        max_latency: float = 0.0,
+        adaptive: bool = False,
+        max_window: float = 1.0,
+        idle_half_life: float = 1.0,
+    ):
+        """
+        Parameters
+        ----------
+        callback : Callable[[], None]
+            Called when the window of a burst of writes expires
+        window : float
+            Seconds without writes before the callback runs, the minimum window in adaptive mode
+        max_latency : float
+            Maximum seconds between the first write of a burst and the callback, 0 for no limit
+        adaptive : bool
+            Whether to widen the window to the duration of recent simulations
+        max_window : float
+            Widest window in adaptive mode, in seconds
+        idle_half_life : float
+            Seconds of idle time that halve the adaptive widening
+        """
+        if window < 0 or max_latency < 0:
+            raise ValueError("window and max_latency must be >= 0")
+        self._callback = callback
+        self._window = window
+        self._max_latency = max_latency
+        self.adaptive = adaptive
+        self.max_window = max_window
+        self.idle_half_life = idle_half_life
+
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._running = False
+        # Monotonic times of the first and the last write of the pending burst
+        self._first = None
+        self._last = None
+        # Smoothed simulation duration, and when the last simulation finished
+        self._duration = 0.0
+        self._done = time.monotonic()
+
+    @property
+    def window(self) -> float:
+        return self._window
+
+    @window.setter
+    def window(self, seconds: float):
+        if seconds < 0:
+            raise ValueError("window must be >= 0")
+        with self._cond:
+            self._window = seconds
+            self._cond.notify()
+
+    @property
+    def max_latency(self) -> float:
+        return self._max_latency
+
+    @max_latency.setter
+    def max_latency(self, seconds: float):
+        if seconds < 0:
+            raise ValueError("max_latency must be >= 0")
+        with self._cond:
+            self._max_latency = seconds
+            self._cond.notify()
+
+    @property
+    def pending(self) -> bool:
+        """Whether a burst of writes is waiting for its window to expire"""
+        return self._first is not None
+
+    def effective_window(self) -> float:
+        """Current debounce window in seconds, including the adaptive widening"""
+        if not self.adaptive:
+            return self._window
+        idle = max(time.monotonic() - self._done, 0.0)
+        widened = self._duration * 0.5 ** (idle / self.idle_half_life)
+        return max(self._window, min(widened, self.max_window))
+
+    def poke(self):
+        """Note a write, (re)starting the debounce window"""
+        with self._cond:
+            now = time.monotonic()
+            if self._first is None:
+                self._first = now
+            self._last = now
+            self._cond.notify()
+
+    def cancel(self):
+        """Forget the pending burst, e.g. because its writes were simulated already"""
+        with self._cond:
+            self._first = self._last = None
+
+    def record_duration(self, seconds: float):
+        """Note how long a simulation took, for the adaptive window"""
+        with self._cond:
+            # Exponential moving average, so one slow simulation does not double the window
+            self._duration = 0.5 * (self._duration + seconds)
+            self._done = time.monotonic()
+
+    def start(self):
+        self._running = True
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None):
+        """Stop the scheduler thread, a pending burst is dropped"""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _deadline(self) -> float:
+        deadline = self._last + self.effective_window()
+        if self._max_latency > 0:
+            deadline = min(deadline, self._first + self._max_latency)
+        return deadline
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    if self._first is None:
+                        self._cond.wait()
+                        continue
+                    remaining = self._deadline() - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    # Woken early by new writes or settings, the deadline is computed again
+                    self._cond.wait(remaining)
+                if not self._running:
+                    return
+                self._first = self._last = None
+            self._callback()
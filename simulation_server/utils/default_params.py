@@ -1,12 +1,22 @@
+# Per-screen parameters keyed by screen name. Besides the sensor geometry, screens may set
+#   "binning": binned image PVs to serve, a subset of pv_mapping.SCREEN_BINNING (all by default)
+#   "codec": PVA compression of the screen's images (see utils.codec.CODECS, "none" to disable)
+#   "dtype": camera output format, "uint8", "uint12" (in uint16), "uint16" or "float" (default)
+#   "bit_depth": overrides the bit depth implied by "dtype"
+#   "gain": camera counts per coulomb on a pixel of an integer "dtype", 65535 (the scaling of
+#       float frames) by default, "auto" to auto-expose so the brightest pixel reaches full scale
+#   "renderer": how images are rendered from the particles, see
+#       virtual_accelerator.screen_renderer.RENDERERS ("bincount" by default, "cheetah" for
+#       Cheetah's histogram), with keyword arguments in "renderer_options"
 default_nc_hxr = {
-                'OTR1': {"n_row": 1040, "n_col": 1392, "resolution":12.66},
-                'OTR2': {"n_row": 1040, "n_col": 1392, "resolution":12.66},
-                'OTR3': {"n_row": 1040, "n_col": 1392, "resolution":12.12},
-                'OTR4': {"n_row": 1040, "n_col": 1392, "resolution":17.06},
-                'OTRH1': {"n_row": 1040, "n_col": 1392, "resolution":18.59},
-                'OTRH2': {"n_row": 1040, "n_col": 1392,  "resolution":19.16},
+                'OTR1': {"n_row": 1040, "n_col": 1392, "resolution":12.66, "dtype": "uint12"},
+                'OTR2': {"n_row": 1040, "n_col": 1392, "resolution":12.66, "dtype": "uint12"},
+                'OTR3': {"n_row": 1040, "n_col": 1392, "resolution":12.12, "dtype": "uint12"},
+                'OTR4': {"n_row": 1040, "n_col": 1392, "resolution":17.06, "dtype": "uint12"},
+                'OTRH1': {"n_row": 1040, "n_col": 1392, "resolution":18.59, "dtype": "uint12"},
+                'OTRH2': {"n_row": 1040, "n_col": 1392,  "resolution":19.16, "dtype": "uint12"},
                 }
 
 default_sc_diag0 = {
-                'OTRDG02': {"n_row": 1472, "n_col": 1944, "resolution":23.29},
-                'OTRDG04': {"n_row": 1472, "n_col": 1944, "resolution":17.48},}
\ No newline at end of file
+                'OTRDG02': {"n_row": 1472, "n_col": 1944, "resolution":23.29, "dtype": "uint12"},
+                'OTRDG04': {"n_row": 1472, "n_col": 1944, "resolution":17.48, "dtype": "uint12"},}
\ No newline at end of file
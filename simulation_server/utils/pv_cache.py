@@ -0,0 +1,69 @@
+import threading
+from typing import Any, Dict, Iterator, Mapping
+
+import numpy as np
+
+
+def same_value(a: Any, b: Any) -> bool:
+    """Whether two PV values are equal, so posting one after the other changes nothing"""
+    if a is b:
+        return True
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return (
+            isinstance(a, np.ndarray)
+            and isinstance(b, np.ndarray)
+            and a.shape == b.shape
+            and a.dtype == b.dtype
+            and np.array_equal(a, b)
+        )
+    try:
+        return type(a) is type(b) and bool(a == b)
+    except (TypeError, ValueError, RuntimeError):
+        # e.g. tensors with more than one element
+        return False
+
+
+class PVCache(Mapping):
+    """
+    Versioned copy-on-write cache of PV values.
+
+    Every update builds a new generation of the values off to the side and publishes it
+    with one reference swap, so readers never take a lock and never see half of an update:
+    `snapshot` returns a generation that stays consistent for as long as it is used.
+    Only writers are serialized, against each other.
+    """
+
+    def __init__(self, values: Mapping[str, Any] | None = None):
+        self._values: Dict[str, Any] = dict(values or {})
+        self._version = 0
+        self._write_lock = threading.Lock()
+
+    @property
+    def version(self) -> int:
+        """Number of updates published so far"""
+        return self._version
+
+    def snapshot(self) -> Mapping[str, Any]:
+        """Current generation of the values, must not be modified"""
+        return self._values
+
+    def __getitem__(self, name: str) -> Any:
+        return self._values[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._values)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __setitem__(self, name: str, value: Any):
+        self.update({name: value})
+
+    def update(self, values: Mapping[str, Any]) -> int:
+        """Publish a new generation with `values` changed, returns its version"""
+        with self._write_lock:
+            generation = dict(self._values)
+            generation.update(values)
+            self._values = generation
+            self._version += 1
+            return self._version
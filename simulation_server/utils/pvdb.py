@@ -1,10 +1,51 @@
 import pprint
 
+from simulation_server.virtual_accelerator.utils import camera_format
+
+# PV roles, deciding when the driver re-evaluates a PV against the model:
+# setpoints are written by clients and applied to the model, static PVs are never re-read,
+# derived PVs are re-read when one of their "source" setpoints is written,
+# and readbacks depend on the beam so they are re-read after every simulation.
+# Buffers hold the shot history of their "source" readback in beam-rate mode.
+ROLE_SETPOINT = "setpoint"
+ROLE_STATIC = "static"
+ROLE_DERIVED = "derived"
+ROLE_READBACK = "readback"
+ROLE_BUFFER = "buffer"
+ROLES = (ROLE_SETPOINT, ROLE_STATIC, ROLE_DERIVED, ROLE_READBACK, ROLE_BUFFER)
+
+# Per-shot readbacks that get a BSA-like history buffer, served as e.g. BPMS:...:XHSTBR
+BSA_SIGNALS = ("X", "Y", "TMIT")
+# Shot-to-shot jitter of the BSA signals at a beam jitter of 1, by device type, as (absolute sigma
+# in the units of the readback, sigma relative to the readback): positions jitter by 1 mm
+# (BPMs read meters, screens micrometers), the charge by its whole value
+BSA_JITTER = {
+    "BPMS": {"X": (1e-3, 0.0), "Y": (1e-3, 0.0), "TMIT": (0.0, 1.0)},
+    "OTRS": {"X": (1e3, 0.0), "Y": (1e3, 0.0)},
+}
+
+# Record entries describing how to serve a PV rather than EPICS fields
+NON_FIELD_KEYS = ["type", "value", "count", "codec", "dtype", "bit_depth", "role", "source", "jitter"]
+
 
 def create_pvdb(
         device: dict[str,dict],
-        default_params: dict[str,dict] = {}
+        default_params: dict[str,dict] = {},
+        bsa_length: int = 0,
         ) -> dict:
+    """
+    Build the pcaspy PV database of a set of devices.
+
+    Parameters
+    ----------
+    device : dict[str, dict]
+        Devices keyed by control system name, as returned by `load_relevant_controls`
+    default_params : dict[str, dict]
+        Per-device parameters keyed by upper-case MAD name, see `default_params`
+    bsa_length : int
+        Number of shots kept in the BSA-like history buffers of BPM and screen
+        position readbacks, 0 to not serve them
+    """
     pvdb = {}
     # pprint.pprint(default_params)
     for key, device_info in device.items():
@@ -18,6 +59,8 @@ def create_pvdb(
                 get_pv("bact"): {
                     "type": "float",
                     "value": 0.0,
+                    "role": ROLE_DERIVED,
+                    "source": [get_pv("bctrl")],
                     "prec": 5,
                     "hopr": 20,
                     "lopr": -20,
@@ -27,17 +70,20 @@ def create_pvdb(
                 get_pv("bctrl"): {
                     "type": "float",
                     "value": 0.0,
+                    "role": ROLE_SETPOINT,
                     "prec": 5,
                     "hopr": 20,
                     "lopr": -20,
                     "drvh": 20,
                     "drvl": -20,
                 },
-                get_pv("bmax"): {"type": "float", "value": 20.0, "prec": 5},
-                get_pv("bmin"): {"type": "float", "value": -20.0, "prec": 5},
+                get_pv("bmax"): {"type": "float", "value": 20.0, "prec": 5, "role": ROLE_STATIC},
+                get_pv("bmin"): {"type": "float", "value": -20.0, "prec": 5, "role": ROLE_STATIC},
                 get_pv("bdes"): {
                     "type": "float",
                     "value": 0.0,
+                    "role": ROLE_DERIVED,
+                    "source": [get_pv("bctrl")],
                     "prec": 5,
                     "hopr": 20,
                     "lopr": -20,
@@ -47,6 +93,7 @@ def create_pvdb(
                 get_pv("bcon"): {
                     "type": "float",
                     "value": 0.0,
+                    "role": ROLE_STATIC,
                     "prec": 5,
                     "hopr": 20,
                     "lopr": -20,
@@ -56,10 +103,12 @@ def create_pvdb(
                 get_pv("ctrl"): {
                     "type": "enum",
                     "enums": ["Ready", "TRIM", "Perturb", "MORE_IF_NEEDED"],
+                    "role": ROLE_STATIC,
                 },
                 f"{key}:STATCTRLSUB.T": {
                     "type": "int",
-                    "value": 0
+                    "value": 0,
+                    "role": ROLE_STATIC,
                 }
             }
 
@@ -68,93 +117,181 @@ def create_pvdb(
             n_row = default_params.get(madname,{}).get("n_row", 1472)
             n_col = default_params.get(madname,{}).get("n_col", 1944)
             resolution = default_params.get(madname,{}).get("resolution", 23.33)
+            dtype, bit_depth = camera_format(default_params.get(madname, {}))
             device_params = {
                 get_pv("image"): {
                     "type": "float",
                     "count": n_row * n_col,
                     "n_row": n_row,
                     "n_col": n_col,
+                    "role": ROLE_READBACK,
                 },
-                get_pv("n_row"): {"type": "int", "value": n_row},
-                get_pv("n_col"): {"type": "int", "value": n_col},
+                get_pv("n_row"): {"type": "int", "value": n_row, "role": ROLE_STATIC},
+                get_pv("n_col"): {"type": "int", "value": n_col, "role": ROLE_STATIC},
                 get_pv("resolution"): {
                     "value": resolution,
                     "unit": "um/px",
+                    "role": ROLE_STATIC,
                 },
-                get_pv("target_control"): {"type": "enum", "enums": ["OUT", "IN"]},
+                get_pv("target_control"): {"type": "enum", "enums": ["OUT", "IN"], "role": ROLE_SETPOINT},
                 f'{key}:XRMS': {
                     "type": "float",
                     "value": 0.0,
                     "prec": 5,
+                    "role": ROLE_READBACK,
                 },
                 f'{key}:YRMS': {
                     "type": "float",
                     "value": 0.0,
                     "prec": 5,
+                    "role": ROLE_READBACK,
                 },
                 f'{key}:X': {
                     "type": "float",
                     "value": 0.0,
                     "prec": 5,
+                    "role": ROLE_READBACK,
                 },
                 f'{key}:Y': {
                     "type": "float",
                     "value": 0.0,
                     "prec": 5,
+                    "role": ROLE_READBACK,
                 },
             }
 
+            # Binned preview images, computed from the full frame once per simulation
+            for factor in default_params.get(madname, {}).get("binning", (2, 4, 8)):
+                device_params[f"{key}:Image:Bin{factor}:ArrayData"] = {
+                    "type": "float",
+                    "count": (n_row // factor) * (n_col // factor),
+                    "n_row": n_row // factor,
+                    "n_col": n_col // factor,
+                    "role": ROLE_READBACK,
+                }
+                device_params[f"{key}:Image:Bin{factor}:ArraySize0_RBV"] = {
+                    "type": "int",
+                    "value": n_row // factor,
+                    "role": ROLE_STATIC,
+                }
+                device_params[f"{key}:Image:Bin{factor}:ArraySize1_RBV"] = {
+                    "type": "int",
+                    "value": n_col // factor,
+                    "role": ROLE_STATIC,
+                }
+
+            # areaDetector-like region of interest, defaults to the full frame
+            roi_limits = {"MinX": n_col - 1, "MinY": n_row - 1, "SizeX": n_col, "SizeY": n_row}
+            roi_defaults = {"MinX": 0, "MinY": 0, "SizeX": n_col, "SizeY": n_row}
+            # Clamping couples the fields, so every readback depends on all ROI setpoints
+            roi_setpoints = [f"{key}:ROI:{field}" for field in roi_limits]
+            for field, limit in roi_limits.items():
+                device_params[f"{key}:ROI:{field}"] = {
+                    "type": "int",
+                    "value": roi_defaults[field],
+                    "drvl": 0,
+                    "drvh": limit,
+                    "role": ROLE_SETPOINT,
+                }
+                device_params[f"{key}:ROI:{field}_RBV"] = {
+                    "type": "int",
+                    "value": roi_defaults[field],
+                    "role": ROLE_DERIVED,
+                    "source": roi_setpoints,
+                }
+            # ROI images are variable size, so allocate for the full frame
+            device_params[f"{key}:ROI:ArrayData"] = {
+                "type": "float",
+                "count": n_row * n_col,
+                "n_row": n_row,
+                "n_col": n_col,
+                "role": ROLE_READBACK,
+            }
+
+            # Per-screen PVA compression and camera output format of every image PV.
+            # Integer frames go out as DBF_SHORT over CA when they fit, DBF_LONG otherwise.
+            codec = default_params.get(madname, {}).get("codec")
+            for desc in device_params.values():
+                if "count" not in desc:
+                    continue
+                if codec is not None:
+                    desc["codec"] = codec
+                if dtype is not None:
+                    desc["type"] = "short" if bit_depth < 16 else "int"
+                    desc["dtype"] = dtype.name
+                    desc["bit_depth"] = bit_depth
+            if "n_bits" in pvs:
+                device_params[get_pv("n_bits")] = {"type": "int", "value": bit_depth, "role": ROLE_STATIC}
+
 
         elif "TCAV" in key:
+            # Feedback and mode fields are status only, the model has no counterpart for them
             device_params= {
-                get_pv("amplitude_fbenb"): {"type": "enum", "enums": ["Disable", "Enable"]},
+                get_pv("amplitude_fbenb"): {"type": "enum", "enums": ["Disable", "Enable"], "role": ROLE_STATIC},
                 get_pv("amplitude_fbst"): {
                     "type": "enum",
                     "enums": ["Disable", "Pause", "Feedforward", "Enable"],
+                    "role": ROLE_STATIC,
                 },
-                get_pv("phase_fbenb"): {"type": "enum", "enums": ["Disable", "Enable"]},
+                get_pv("phase_fbenb"): {"type": "enum", "enums": ["Disable", "Enable"], "role": ROLE_STATIC},
                 get_pv("phase_fbst"): {
                     "type": "enum",
                     "enums": ["Disable", "Pause", "Feedforward", "Enable"],
+                    "role": ROLE_STATIC,
                 },
-                get_pv("rf_enable"): {"type": "enum", "enums": ["Disable", "Enable"]},
+                get_pv("rf_enable"): {"type": "enum", "enums": ["Disable", "Enable"], "role": ROLE_STATIC},
                 get_pv("amplitude"): {
                     "type": "float",
                     "value": 0.0,
                     "prec": 5,
+                    "role": ROLE_SETPOINT,
                 },
                 get_pv("phase"): {
                     "type": "float",
                     "value": 0.0,
                     "prec": 5,
+                    "role": ROLE_SETPOINT,
                 },
                 get_pv("mode_config"): {
                     "type": "enum",
                     "enums": ["Disable", "ACCEL", "STDBY"],
+                    "role": ROLE_STATIC,
                 },
             }
 
 
         elif "BPMS" in key:
             device_params = {
-                get_pv("tmit"): {"type": "float", "value": 0.0, "prec": 5},
-                get_pv("x"): {"type": "float", "value": 0.0, "prec": 5},
-                get_pv("y"): {"type": "float", "value": 0.0, "prec": 5},
+                get_pv("tmit"): {"type": "float", "value": 0.0, "prec": 5, "role": ROLE_READBACK},
+                get_pv("x"): {"type": "float", "value": 0.0, "prec": 5, "role": ROLE_READBACK},
+                get_pv("y"): {"type": "float", "value": 0.0, "prec": 5, "role": ROLE_READBACK},
             }
 
         #check in the key had missing pv values if so omit it since lcls_elements.csv did not agree with yaml
         if any('missing' in pkey for pkey in device_params.keys()):
             continue
 
+        # Shot history of the per-shot readbacks, filled in beam-rate mode
+        if bsa_length:
+            jitter = BSA_JITTER.get(key.split(":", 1)[0], {})
+            for k in [k for k in device_params if k.rsplit(":", 1)[-1] in BSA_SIGNALS]:
+                device_params[f"{k}HSTBR"] = {
+                    "type": "float",
+                    "count": bsa_length,
+                    "role": ROLE_BUFFER,
+                    "source": [k],
+                    "jitter": jitter.get(k.rsplit(":", 1)[-1], (1.0, 0.0)),
+                }
+
         # Create DRVL/DRVH/HOPR/LOPR PVs, since pcaspy doesn't do that for us.
         new_pvs = {}
         for k, v in device_params.items():
             if "type" in v and v["type"] not in ["float", "int"]:
                 continue
             for parm, val in v.items():
-                if parm in ["type", "value"]:
+                if parm in NON_FIELD_KEYS:
                     continue
-                new_pvs[f"{k}.{parm.upper()}"] = {"type": "float", "value": val}
+                new_pvs[f"{k}.{parm.upper()}"] = {"type": "float", "value": val, "role": ROLE_STATIC}
         device_params.update(new_pvs)
 
         #update pvdb with device pvs
@@ -0,0 +1,202 @@
+"""
+Columnar on-disk record of a server session.
+
+Layout of the HDF5 file, every dataset is chunked and grows along its first axis:
+
+    writes/time, writes/name, writes/value,          client writes
+    writes/text
+    readbacks/time, readbacks/name, readbacks/value, scalar readbacks published after a simulation
+    readbacks/text
+    arrays/<PV>/time, arrays/<PV>/offset             array readbacks (images, ...), one row per
+    arrays/<PV>/data                                 publish; row i is data[offset[i]:offset[i+1]]
+
+Times are unix timestamps. Numeric scalars are stored as float64 in value, with an empty text.
+Other scalars (e.g. enum strings) are stored as strings in text, with a NaN value.
+"""
+import queue
+import threading
+import time
+from typing import Any
+
+import numpy as np
+
+# h5py comes with openpmd-beamphysics, but the recorder is the only thing that needs it
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+WRITE = "writes"
+READBACK = "readbacks"
+
+# Marks the end of the session in the record queue
+_STOP = object()
+
+# Approximate memory of a queued record besides its array data, in bytes
+RECORD_OVERHEAD = 200
+
+
+class Recorder:
+    """
+    Records writes and published readbacks on a background thread, so the simulation
+    thread only pays for a queue put. Records are written in batches; when the records
+    waiting to be written hold too much memory, new ones are dropped and counted rather
+    than blocking the caller.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_pending_bytes: int = 256 * 2**20,
+        batch_size: int = 1000,
+        flush_interval: float = 1.0,
+    ):
+        """
+        Parameters
+        ----------
+        path : str
+            HDF5 file to create, overwritten if it exists
+        max_pending_bytes : int
+            Maximum memory held by the records waiting to be written, images count with
+            their size
+        batch_size : int
+            Maximum number of records written at once
+        flush_interval : float
+            Maximum time in seconds a record waits before being written
+        """
+        if h5py is None:
+            raise ImportError("Recording needs the h5py package")
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending_bytes = max_pending_bytes
+        self.dropped = 0
+        self._pending_bytes = 0
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._file = h5py.File(path, "w")
+        self._thread = threading.Thread(target=self._writer_thread)
+        self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        """Number of records waiting to be written"""
+        return self._queue.qsize()
+
+    @property
+    def pending_bytes(self) -> int:
+        """Approximate memory held by the records waiting to be written"""
+        return self._pending_bytes
+
+    def record(self, kind: str, name: str, value: Any):
+        """
+        Queue a record without blocking.
+
+        Parameters
+        ----------
+        kind : str
+            WRITE or READBACK
+        name : str
+            PV name
+        value : Any
+            Scalar or array value, arrays must not be modified afterwards
+        """
+        size = RECORD_OVERHEAD + (np.asarray(value).nbytes if _is_array(value) else 0)
+        with self._lock:
+            if self._pending_bytes + size > self.max_pending_bytes:
+                self.dropped += 1
+                return
+            self._pending_bytes += size
+        self._queue.put_nowait((kind, name, value, time.time(), size))
+
+    def record_write(self, name: str, value: Any):
+        self.record(WRITE, name, value)
+
+    def record_readback(self, name: str, value: Any):
+        self.record(READBACK, name, value)
+
+    def close(self):
+        """Write out all pending records and close the file"""
+        if not self._thread.is_alive():
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _writer_thread(self):
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+                if batch[-1] is _STOP:
+                    break
+
+            stop = _STOP in batch
+            batch = [r for r in batch if r is not _STOP]
+            self._write_batch(batch)
+            self._file.flush()
+            with self._lock:
+                self._pending_bytes -= sum(r[-1] for r in batch)
+        self._file.close()
+
+    def _write_batch(self, batch: list):
+        scalars = {WRITE: [], READBACK: []}
+        arrays = {}
+        for kind, name, value, timestamp, _ in batch:
+            if _is_array(value):
+                arrays.setdefault(name, []).append((timestamp, np.ravel(value)))
+            else:
+                scalars[kind].append((timestamp, name, *_to_scalar(value)))
+
+        for kind, rows in scalars.items():
+            if not rows:
+                continue
+            timestamps, names, values, texts = zip(*rows)
+            self._append(f"{kind}/time", np.array(timestamps))
+            self._append(f"{kind}/name", np.array(names, dtype=object), h5py.string_dtype())
+            self._append(f"{kind}/value", np.array(values))
+            self._append(f"{kind}/text", np.array(texts, dtype=object), h5py.string_dtype())
+
+        for name, rows in arrays.items():
+            group = f"arrays/{name}"
+            start = self._file[f"{group}/data"].shape[0] if f"{group}/data" in self._file else 0
+            sizes = [data.size for _, data in rows]
+            self._append(f"{group}/time", np.array([timestamp for timestamp, _ in rows]))
+            self._append(f"{group}/offset", start + np.cumsum([0] + sizes[:-1]))
+            self._append(f"{group}/data", np.concatenate([data for _, data in rows]))
+
+    def _append(self, path: str, values: np.ndarray, dtype=None):
+        """Append values to a 1D dataset, creating it on first use"""
+        if path not in self._file:
+            self._file.create_dataset(
+                path,
+                shape=(0,),
+                maxshape=(None,),
+                chunks=True,
+                dtype=dtype or values.dtype,
+                compression="gzip" if path.endswith("/data") else None,
+            )
+        dataset = self._file[path]
+        start = dataset.shape[0]
+        dataset.resize((start + len(values),))
+        dataset[start:] = values
+
+
+def _is_array(value: Any) -> bool:
+    return isinstance(value, (np.ndarray, list, tuple))
+
+
+def _to_scalar(value: Any) -> tuple[float, str]:
+    """(value, text) columns of a scalar, see the module docstring"""
+    try:
+        return float(value), ""
+    except (TypeError, ValueError):
+        return np.nan, str(value)
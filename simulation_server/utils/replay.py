@@ -0,0 +1,162 @@
+"""
+Replay the writes of a recorded session (see `recorder`) against a server or a model.
+
+    python -m simulation_server.utils.replay session.h5 --name diag0 --lattice_file new_lattice.json
+
+From the command line, writes go through a `SimDriver` (write filter, queue and debounce
+window) like live client writes, without serving any PVs.
+"""
+import argparse
+import time
+from typing import Any
+
+import numpy as np
+
+from simulation_server.utils.recorder import WRITE, h5py
+
+
+def load_session(path: str) -> list[tuple[float, str, Any]]:
+    """
+    Read the scalar writes of a recorded session.
+
+    Returns
+    -------
+    list[tuple[float, str, Any]]
+        (time, PV name, value) of every write in recording order, non-numeric values
+        (e.g. enum strings) as strings
+    """
+    if h5py is None:
+        raise ImportError("Loading sessions needs the h5py package")
+    with h5py.File(path, "r") as f:
+        if WRITE not in f:
+            return []
+        times = f[f"{WRITE}/time"][:]
+        names = f[f"{WRITE}/name"].asstr()[:]
+        values = f[f"{WRITE}/value"][:]
+        texts = f[f"{WRITE}/text"].asstr()[:] if f"{WRITE}/text" in f else None
+
+    # Python floats like the ones CA and PVA hand to the driver
+    values = values.tolist()
+    if texts is not None:
+        values = [text if text else value for value, text in zip(values, texts)]
+        return list(zip(times.tolist(), names, values))
+
+    # Sessions recorded before the text column stored non-numeric writes as NaN
+    writes = [(t, n, v) for t, n, v in zip(times.tolist(), names, values) if not np.isnan(v)]
+    if len(writes) < len(values):
+        print(f"Skipping {len(values) - len(writes)} non-numeric writes, not recorded in {path}")
+    return writes
+
+
+def replay(
+    writes: list[tuple[float, str, Any]],
+    target,
+    realtime: bool = False,
+    speed: float = 1.0,
+    readbacks: list[str] | None = None,
+) -> dict:
+    """
+    Replay writes against a `SimDriver` or a `VirtualAccelerator`.
+
+    A `SimDriver` receives each write through `SimDriver.write`, the entry point of CA and
+    PVA clients, so writes are filtered, queued and coalesced exactly like live traffic, and
+    the replay ends once the driver is idle. A `VirtualAccelerator` tracks once per write,
+    like the non-threaded server.
+
+    Parameters
+    ----------
+    writes : list[tuple[float, str, Any]]
+        (time, PV name, value) of every write, e.g. from `load_session`
+    target : SimDriver | VirtualAccelerator
+        What to replay against
+    realtime : bool
+        If True, keep the recorded spacing between writes (scaled by `speed`),
+        otherwise send writes as fast as possible
+    speed : float
+        Speed-up of realtime replay
+    readbacks : list[str] | None
+        PVs to read at the end, defaults to every readback of a `SimDriver`
+
+    Returns
+    -------
+    dict
+        "durations": seconds spent in each write call, "total": seconds for the whole
+        replay including the final simulation, "readbacks": final value of each readback
+    """
+    is_driver = hasattr(target, "write_queue")
+    if readbacks is None:
+        readbacks = target.measurement_pvs if is_driver else []
+
+    durations = np.zeros(len(writes))
+    start = time.time()
+    for i, (timestamp, name, value) in enumerate(writes):
+        if realtime:
+            delay = (timestamp - writes[0][0]) / speed - (time.time() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+        step = time.time()
+        if is_driver:
+            target.write(name, value)
+        else:
+            try:
+                target.set_pvs({name: value})
+            except ValueError:
+                pass  # Server-only PVs (VIRT:BEAM:SIMULATE, ...) and read-only attributes
+        durations[i] = time.time() - step
+
+    if is_driver:
+        target.wait_idle()
+        values = {k: target.cached_value(k) for k in readbacks}
+    else:
+        values = target.get_pvs(readbacks)
+
+    return {
+        "durations": durations,
+        "total": time.time() - start,
+        "readbacks": values,
+    }
+
+
+if __name__ == "__main__":
+    from simulation_server.beamdriver import SimDriver, SimServer
+    from simulation_server.factory import get_pvdb, get_virtual_accelerator
+    from simulation_server.utils.write_filter import LIMIT_POLICIES
+
+    parser = argparse.ArgumentParser(description="Replay a recorded session against the virtual accelerator.")
+    parser.add_argument("session", type=str, help="HDF5 file written by run.py --record")
+    parser.add_argument("--name", type=str, choices=["diag0", "nc_injector"], required=True)
+    parser.add_argument("--lattice_file", type=str, default=None, help="Lattice JSON to use instead of the default one.")
+    parser.add_argument("--realtime", action="store_true", help="Keep the recorded spacing between writes.")
+    parser.add_argument("--speed", type=float, default=1.0, help="Speed-up of --realtime replay.")
+    parser.add_argument("--debounce", type=float, default=0.0, help="Debounce window in seconds, like run.py.")
+    parser.add_argument("--max_latency", type=float, default=0.0, help="Maximum simulation latency in seconds, like run.py.")
+    parser.add_argument(
+        "--limit_policy", type=str, choices=LIMIT_POLICIES, default="clamp",
+        help="What to do with setpoint writes outside of their drive limits, like run.py.",
+    )
+    args = parser.parse_args()
+
+    writes = load_session(args.session)
+    va = get_virtual_accelerator(args.name, lattice_file=args.lattice_file)
+    # The PVs are never served, the server only holds the PV database
+    server = SimServer(get_pvdb(args.name), threading=True, protocols="pva")
+    driver = SimDriver(
+        server=server,
+        virtual_accelerator=va,
+        limit_policy=args.limit_policy,
+        debounce=args.debounce,
+        max_latency=args.max_latency,
+    )
+    try:
+        result = replay(writes, driver, realtime=args.realtime, speed=args.speed)
+    finally:
+        driver.stop()
+
+    durations = result["durations"]
+    print(f"Replayed {len(writes)} writes in {result['total']:.3f} seconds")
+    if len(durations):
+        print(
+            f"Per write: mean {durations.mean():.4f} s, median {np.median(durations):.4f} s, "
+            f"max {durations.max():.4f} s"
+        )
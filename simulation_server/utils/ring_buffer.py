@@ -0,0 +1,56 @@
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Fixed-size history of a set of signals, one column per shot, like the
+    beam synchronous acquisition (BSA) buffers of the real machine.
+    """
+
+    def __init__(self, n_signals: int, length: int):
+        """
+        Parameters
+        ----------
+        n_signals : int
+            Number of signals recorded per shot
+        length : int
+            Number of shots kept, older shots are overwritten
+        """
+        if length < 1:
+            raise ValueError(f"Ring buffer length must be positive, got {length}")
+        self._data = np.zeros((n_signals, length))
+        self._next = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def length(self) -> int:
+        return self._data.shape[1]
+
+    def extend(self, shots: np.ndarray):
+        """
+        Append a block of shots.
+
+        Parameters
+        ----------
+        shots : np.ndarray
+            Array of shape (n_signals, n_shots), oldest shot first
+        """
+        shots = shots[:, -self.length:]
+        n_shots = shots.shape[1]
+        index = (self._next + np.arange(n_shots)) % self.length
+        self._data[:, index] = shots
+        self._next = (self._next + n_shots) % self.length
+        self._count = min(self._count + n_shots, self.length)
+
+    def history(self) -> np.ndarray:
+        """
+        Returns
+        -------
+        np.ndarray
+            Copy of the recorded shots, shape (n_signals, len(self)), oldest shot first
+        """
+        start = (self._next - self._count) % self.length
+        return self._data[:, (start + np.arange(self._count)) % self.length]
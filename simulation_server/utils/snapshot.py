@@ -0,0 +1,159 @@
+"""
+Setpoint snapshots, stored as JSON files of PV name to value.
+
+Save or restore the setpoints of a running server through its VIRT:BEAM:SETPOINTS PV:
+
+    python -m simulation_server.utils.snapshot save machine.json
+    python -m simulation_server.utils.snapshot restore machine.json
+
+Any PVs, readbacks included, can be read in one round trip through the VIRT:BEAM:SNAPSHOT
+RPC, see `read_snapshot`.
+"""
+import argparse
+import json
+import re
+from fnmatch import fnmatchcase
+from typing import Any, Iterable, Mapping
+
+SETPOINTS_PV = "VIRT:BEAM:SETPOINTS"
+# NTTable columns of SETPOINTS_PV
+SETPOINTS_COLUMNS = [("name", "s"), ("value", "d")]
+
+# RPC returning the current value of PVs selected by name or glob pattern (PVA only)
+SNAPSHOT_PV = "VIRT:BEAM:SNAPSHOT"
+# NTTable columns of its replies, which carry the simulation generation in timeStamp.userTag
+SNAPSHOT_COLUMNS = [("name", "s"), ("value", "d")]
+
+
+def save_snapshot(path: str, values: dict):
+    """Write a snapshot of {PV name: value} to a JSON file"""
+    with open(path, "w") as f:
+        json.dump({k: float(v) for k, v in values.items()}, f, indent=1, sort_keys=True)
+
+
+def load_snapshot(path: str) -> dict:
+    """Read a snapshot written by save_snapshot"""
+    with open(path) as f:
+        return json.load(f)
+
+
+def snapshot_table(values: dict) -> list[dict]:
+    """Rows of the VIRT:BEAM:SETPOINTS NTTable"""
+    return [{"name": k, "value": float(v)} for k, v in values.items()]
+
+
+def table_snapshot(rows: list[dict]) -> dict:
+    """Inverse of snapshot_table"""
+    return {row["name"]: float(row["value"]) for row in rows}
+
+
+def snapshot_request(request) -> tuple[list[str], bool]:
+    """
+    PV names or glob patterns and the wait flag of a SNAPSHOT_PV request. The request is an
+    NTURI with a "pvs" query argument (string array, or string of names separated by commas
+    or whitespace) and an optional "wait" argument, or a structure with these fields.
+    """
+    query = request.get("query") if "query" in request else request
+    pvs = query.get("pvs")
+    if pvs is None:
+        raise ValueError('Snapshot request has no "pvs" argument')
+    if isinstance(pvs, str):
+        pvs = [pvs]
+    patterns = [p for item in pvs for p in re.split(r"[\s,]+", item) if p]
+    wait = query.get("wait", False)
+    if isinstance(wait, str):
+        wait = wait.lower() in ("1", "true", "yes")
+    return patterns, bool(wait)
+
+
+def _scalar(value: Any) -> float | None:
+    """A value as a float, None if it is not a number (e.g. an image or a string)"""
+    if value is None or isinstance(value, (str, bytes)) or getattr(value, "ndim", 0) != 0:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def snapshot_rows(values: Mapping[str, Any], patterns: Iterable[str]) -> list[dict]:
+    """
+    Rows of a SNAPSHOT_PV reply: the PVs matching the names and glob patterns (e.g.
+    "BPMS:DIAG0:*:X"), in the order of the patterns and without duplicates. Patterns skip
+    PVs without a scalar value, such as images.
+
+    Raises
+    ------
+    KeyError
+        If a name without wildcards is not a PV
+    ValueError
+        If a name without wildcards is not a scalar PV
+    """
+    rows, seen = [], set()
+    for pattern in patterns:
+        is_glob = any(c in pattern for c in "*?[")
+        if is_glob:
+            names = [name for name in values if fnmatchcase(name, pattern)]
+        elif pattern in values:
+            names = [pattern]
+        else:
+            raise KeyError(f"Unknown PV {pattern}")
+        for name in names:
+            if name in seen:
+                continue
+            value = _scalar(values[name])
+            if value is None:
+                if not is_glob:
+                    raise ValueError(f"{name} does not have a scalar value")
+                continue
+            seen.add(name)
+            rows.append({"name": name, "value": value})
+    return rows
+
+
+def read_snapshot(ctx, pvs: Iterable[str], wait: bool = False, prefix: str = "", timeout: float = 5.0) -> tuple[dict, int]:
+    """
+    Read PVs by name or glob pattern with one SNAPSHOT_PV request.
+
+    Parameters
+    ----------
+    ctx : p4p.client.thread.Context
+        PVA client context
+    pvs : Iterable[str]
+        PV names or glob patterns
+    wait : bool
+        Whether to wait until every write made before the request has been simulated
+    prefix : str
+        PV prefix of the server, e.g. a session's "<name>:"
+    timeout : float
+        Seconds to wait for the reply
+
+    Returns
+    -------
+    tuple[dict, int]
+        Values by PV name, and the simulation generation they come from
+    """
+    from p4p.nt import NTTable, NTURI
+
+    request = NTURI([("pvs", "as"), ("wait", "?")]).wrap(
+        f"{prefix}{SNAPSHOT_PV}", kws={"pvs": list(pvs), "wait": wait}
+    )
+    reply = ctx.rpc(f"{prefix}{SNAPSHOT_PV}", request, timeout=timeout)
+    return table_snapshot(NTTable.unwrap(reply)), reply["timeStamp.userTag"]
+
+
+if __name__ == "__main__":
+    from p4p.client.thread import Context
+    from p4p.nt import NTTable
+
+    parser = argparse.ArgumentParser(description="Save or restore the setpoints of a running simulation server.")
+    parser.add_argument("action", choices=["save", "restore"])
+    parser.add_argument("path", type=str, help="Snapshot JSON file")
+    args = parser.parse_args()
+
+    ctx = Context("pva")
+    if args.action == "save":
+        save_snapshot(args.path, table_snapshot(NTTable.unwrap(ctx.get(SETPOINTS_PV))))
+    else:
+        table = NTTable(SETPOINTS_COLUMNS).wrap(snapshot_table(load_snapshot(args.path)))
+        ctx.put(SETPOINTS_PV, table)
@@ -0,0 +1,102 @@
+import math
+from numbers import Real
+from typing import Any, Callable, Tuple
+
+# What to do with a write outside of its PV's DRVL/DRVH drive limits
+#   clamp  - apply the nearest limit instead, like an EPICS record
+#   reject - refuse the write, the client sees a failed put
+#   off    - apply the write as it is
+LIMIT_POLICIES = ("clamp", "reject", "off")
+
+# Outcomes of WriteFilter.check
+WRITE = "write"
+UNCHANGED = "unchanged"
+REJECT = "reject"
+
+
+class WriteFilter:
+    """
+    Checks numeric setpoint writes before they reach the model.
+
+    A write within the deadband of the current setpoint changes nothing, so it is not
+    simulated. The deadband of a PV is its "mdel" if set, otherwise half a unit of the last
+    digit shown with its "prec", otherwise only an equal value is unchanged. Writes outside
+    of the DRVL/DRVH drive limits (if DRVH > DRVL, like EPICS records) are handled by the
+    limit policy. Limits are read through ``current``, so writes to the .DRVL/.DRVH fields
+    take effect, and fall back to the pvdb.
+    """
+
+    def __init__(
+        self,
+        pvdb: dict,
+        current: Callable[[str], Any],
+        limit_policy: str = "clamp",
+        suppress_unchanged: bool = True,
+    ):
+        """
+        Parameters
+        ----------
+        pvdb : dict
+            Record descriptions of the PVs, see `utils.pvdb.create_pvdb`
+        current : Callable[[str], Any]
+            Current value of a PV or field (e.g. "QUAD:...:BCTRL.DRVH"), None if unknown
+        limit_policy : str
+            What to do with writes outside of the drive limits, one of LIMIT_POLICIES
+        suppress_unchanged : bool
+            Whether writes within the deadband of the current value are unchanged
+        """
+        if limit_policy not in LIMIT_POLICIES:
+            raise ValueError(f"Unknown limit policy {limit_policy}, expected one of {LIMIT_POLICIES}")
+        self.pvdb = pvdb
+        self.current = current
+        self.limit_policy = limit_policy
+        self.suppress_unchanged = suppress_unchanged
+
+    def deadband(self, name: str) -> float:
+        desc = self.pvdb[name]
+        if desc.get("mdel", 0) > 0:
+            return desc["mdel"]
+        if desc.get("type", "float") == "float" and "prec" in desc:
+            return 0.5 * 10.0 ** -desc["prec"]
+        return 0.0
+
+    def limits(self, name: str) -> Tuple[float, float] | None:
+        """Drive limits (DRVL, DRVH) of a PV, None if it has none"""
+        desc = self.pvdb[name]
+        low = self.current(f"{name}.DRVL")
+        high = self.current(f"{name}.DRVH")
+        low = desc.get("drvl", 0) if low is None else low
+        high = desc.get("drvh", 0) if high is None else high
+        if high > low:
+            return low, high
+        return None
+
+    def check(self, name: str, value: Any) -> Tuple[str, Any]:
+        """
+        Check a write.
+
+        Returns
+        -------
+        Tuple[str, Any]
+            WRITE with the value to apply (clamped to the limits with the "clamp" policy),
+            UNCHANGED if the write changes nothing, or REJECT if it must be refused
+        """
+        desc = self.pvdb.get(name)
+        numeric = isinstance(value, Real) and not isinstance(value, bool)
+        if desc is None or desc.get("type", "float") not in ("float", "int") or not numeric:
+            return WRITE, value
+
+        limits = self.limits(name) if self.limit_policy != "off" else None
+        if limits is not None and not limits[0] <= value <= limits[1]:
+            # NaN is outside of any limits and can not be clamped
+            if self.limit_policy == "reject" or math.isnan(value):
+                return REJECT, value
+            value = min(max(value, limits[0]), limits[1])
+            # the limits may be of another type than the PV
+            value = float(value) if desc.get("type", "float") == "float" else int(value)
+
+        if self.suppress_unchanged:
+            previous = self.current(name)
+            if isinstance(previous, Real) and abs(value - previous) <= self.deadband(name):
+                return UNCHANGED, value
+        return WRITE, value
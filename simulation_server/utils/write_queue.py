@@ -0,0 +1,157 @@
+import time
+import threading
+from typing import Any, Callable, List, Tuple
+
+# Priority classes. Lower values are applied to the model first.
+PRIORITY_CRITICAL = 0
+PRIORITY_NORMAL = 1
+
+# What to do with a write to a new PV when the queue is already full
+#   drop_oldest - evict the oldest pending write of the lowest priority class
+#   reject      - refuse the new write, the client sees a failed put
+OVERFLOW_POLICIES = ("drop_oldest", "reject")
+
+
+class WriteQueue:
+    """
+    Pending PV writes waiting to be applied to the model.
+
+    Writes are coalesced per PV (last write wins, but the PV keeps its place and
+    enqueue time), and drained ordered by priority class and then arrival order.
+    The queue may be bounded, in which case ``overflow`` decides what happens
+    to a write for a PV that is not already pending.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 0,
+        overflow: str = "drop_oldest",
+        priority: Callable[[str], int] | None = None,
+        on_evict: Callable[[str, Any], Any] | None = None,
+    ):
+        """
+        Parameters
+        ----------
+        max_size : int
+            Maximum number of distinct pending PVs, 0 for unbounded
+        overflow : str
+            Overflow policy, one of OVERFLOW_POLICIES
+        priority : Callable[[str], int] | None
+            Maps a PV name to its priority class. Defaults to PRIORITY_NORMAL for everything.
+        on_evict : Callable[[str, Any], Any] | None
+            Called with the PV name and value of every write dropped by ``drop_oldest``,
+            after the queue is unlocked, e.g. to roll back what the write already changed
+        """
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {overflow}, expected one of {OVERFLOW_POLICIES}")
+        if max_size < 0:
+            raise ValueError("max_size must be >= 0")
+
+        self.max_size = max_size
+        self.overflow = overflow
+        self._priority = priority or (lambda name: PRIORITY_NORMAL)
+        self._on_evict = on_evict
+        self._lock = threading.Lock()
+        # PV name -> (priority, sequence number, enqueue time, value)
+        self._entries = {}
+        self._seq = 0
+        self._dropped = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def depth(self) -> int:
+        """Number of distinct PVs waiting to be applied"""
+        return len(self._entries)
+
+    @property
+    def dropped(self) -> int:
+        """Number of writes lost to the overflow policy since creation"""
+        return self._dropped
+
+    def oldest_age(self) -> float:
+        """Seconds the oldest pending write has been waiting, 0 if the queue is empty"""
+        with self._lock:
+            if not self._entries:
+                return 0.0
+            return time.time() - min(e[2] for e in self._entries.values())
+
+    def put(self, name: str, value: Any) -> bool:
+        """
+        Queue a write.
+
+        Parameters
+        ----------
+        name : str
+            PV name
+        value : Any
+            Value to write
+
+        Returns
+        -------
+        bool
+            False if the write was refused by the overflow policy
+        """
+        evicted = None
+        with self._lock:
+            # Coalesce with a pending write to the same PV
+            if name in self._entries:
+                prio, seq, stamp, _ = self._entries[name]
+                self._entries[name] = (prio, seq, stamp, value)
+                return True
+
+            prio = self._priority(name)
+            if self.max_size and len(self._entries) >= self.max_size:
+                evicted = self._evict(prio) if self.overflow == "drop_oldest" else None
+                if evicted is None:
+                    self._dropped += 1
+                    return False
+
+            self._entries[name] = (prio, self._seq, time.time(), value)
+            self._seq += 1
+
+        if evicted is not None and self._on_evict is not None:
+            self._on_evict(*evicted)
+        return True
+
+    def put_many(self, values: dict):
+        """
+        Queue a bulk update, such as a snapshot restore, as a whole.
+        The size limit does not apply, so none of it is dropped.
+        """
+        with self._lock:
+            for name, value in values.items():
+                if name in self._entries:
+                    prio, seq, stamp, _ = self._entries[name]
+                    self._entries[name] = (prio, seq, stamp, value)
+                    continue
+                self._entries[name] = (self._priority(name), self._seq, time.time(), value)
+                self._seq += 1
+
+    def _evict(self, prio: int) -> Tuple[str, Any] | None:
+        """
+        Drop the oldest write of the lowest priority class, if it is not more important than prio.
+        Returns the dropped (PV name, value), None if nothing could be dropped.
+        """
+        victim = max(self._entries, key=lambda k: (self._entries[k][0], -self._entries[k][1]))
+        if self._entries[victim][0] < prio:
+            return None
+        value = self._entries.pop(victim)[3]
+        self._dropped += 1
+        return victim, value
+
+    def drain(self) -> List[Tuple[str, Any]]:
+        """
+        Remove and return all pending writes.
+
+        Returns
+        -------
+        List[Tuple[str, Any]]
+            (PV name, value) pairs ordered by priority class, then arrival order
+        """
+        with self._lock:
+            entries = self._entries
+            self._entries = {}
+        order = sorted(entries, key=lambda k: entries[k][:2])
+        return [(k, entries[k][3]) for k in order]
@@ -1,3 +1,6 @@
-from simulation_server.virtual_accelerator.virtual_accelerator import VirtualAccelerator
+from simulation_server.virtual_accelerator.virtual_accelerator import (
+    SimulationPreempted,
+    VirtualAccelerator,
+)
 
-__all__ = ["VirtualAccelerator"]
+__all__ = ["SimulationPreempted", "VirtualAccelerator"]
@@ -0,0 +1,130 @@
+"""
+Binary cache of the lattices and initial beams the virtual accelerators start from.
+
+Parsing a lattice JSON constructs every element through Cheetah, and reading an openPMD
+beam goes through openPMD-beamphysics. Both are done once: the resulting `Segment` or
+`ParticleBeam` is saved with `torch.save` (raw tensor storages plus the pickled element
+metadata) and later loaded memory-mapped. Files are keyed by a hash of the source file
+contents and everything else the artifact is built from, so a changed source is parsed
+again. Cache files are unpickled, so the cache directory must only be writable by its
+user.
+"""
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+import cheetah
+import torch
+from cheetah import latticejson
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "SIMULATION_SERVER_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "simulation_server")
+)
+
+# Bump when the cached artifacts change in a way their sources don't show
+CACHE_VERSION = 1
+
+
+def source_key(sources=(), **params) -> str:
+    """
+    Hash of the contents of the source files and of the parameters, with the versions of
+    the libraries that build the artifacts.
+    """
+    digest = hashlib.sha256()
+    for path in sources:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    params = {
+        **{key: str(value) for key, value in params.items()},
+        "cache_version": CACHE_VERSION,
+        "cheetah": cheetah.__version__,
+        "torch": torch.__version__,
+    }
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()[:32]
+
+
+def cached(kind, key, build, cache_dir=None):
+    """
+    Artifact from the cache, built with `build()` and saved on a miss.
+
+    Parameters:
+    -----------
+    kind : str
+        Prefix of the cache file name, e.g. "lattice".
+    key : str
+        Key of the artifact, see `source_key`.
+    build : callable
+        Builds the artifact, an object `torch.save` can save.
+    cache_dir : str, optional
+        Cache directory, None to always build.
+    """
+    if cache_dir is None:
+        return build()
+    path = os.path.join(cache_dir, f"{kind}-{key}.pt")
+    if os.path.exists(path):
+        try:
+            return torch.load(path, mmap=True, weights_only=False)
+        except (OSError, RuntimeError, EOFError, pickle.UnpicklingError) as e:
+            print(f"Rebuilding unreadable cache file {path}: {e}")
+
+    artifact = build()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # written next to its destination and renamed, so readers never see part of it
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=f".{kind}-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                torch.save(artifact, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except OSError as e:
+        print(f"Can not write cache file {path}: {e}")
+    return artifact
+
+
+def parse_lattice(lattice_file, dtype, subcell_dest=None) -> cheetah.Segment:
+    """
+    Parse a Cheetah lattice JSON in a precision. With `subcell_dest`, the lattice is cut
+    after that element before any element is constructed, like `Segment.subcell(end=...)`
+    on the whole lattice.
+    """
+    with open(lattice_file, "r") as f:
+        lattice_dict = json.load(f)
+    root = lattice_dict["root"]
+    if subcell_dest:
+        names = lattice_dict["lattices"][root]
+        if subcell_dest not in names:
+            raise ValueError(f"Element {subcell_dest} is not part of the segment.")
+        lattice_dict["lattices"][root] = names[: names.index(subcell_dest) + 1]
+    lattice = latticejson.parse_segment(root, lattice_dict, dtype=dtype)
+    # the parser leaves some elements in the default precision
+    return lattice.to(dtype)
+
+
+def load_lattice(lattice_file, dtype, subcell_dest=None, cache_dir=None) -> cheetah.Segment:
+    """`parse_lattice` through the cache in `cache_dir` (None to parse)"""
+    if cache_dir is None:
+        # not keyed, so a missing file is reported by the parser
+        return parse_lattice(lattice_file, dtype, subcell_dest)
+    key = source_key([lattice_file], dtype=dtype, subcell_dest=subcell_dest)
+    return cached(
+        "lattice", key, lambda: parse_lattice(lattice_file, dtype, subcell_dest), cache_dir
+    )
+
+
+def load_beam(build, sources=(), cache_dir=None, **params):
+    """
+    Beam built by `build()` through the cache in `cache_dir` (None to build). The beam is
+    keyed by the contents of `sources` and by `params`, which must describe everything
+    else `build` depends on. Randomly generated beams are therefore the same on every
+    start until the cache is cleared.
+    """
+    if cache_dir is None:
+        return build()
+    return cached("beam", source_key(sources, **params), build, cache_dir)
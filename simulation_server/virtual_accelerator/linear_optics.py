@@ -0,0 +1,129 @@
+import torch
+from cheetah.accelerator import BPM, Drift, Marker, Screen, TransverseDeflectingCavity
+
+# Readback classes the linear optics can serve: element type and PV attributes
+READBACK_CLASSES = {
+    "bpm_orbit": ("BPM", ("X", "Y", "XSCDT1H", "YSCDT1H")),
+    "screen_centroid": ("Screen", ("X", "Y")),
+    "screen_size": ("Screen", ("XRMS", "YRMS")),
+}
+
+
+class LinearOptics:
+    """
+    Centroid and covariance of the beam along a lattice from first-order transfer maps,
+    instead of tracking particles.
+
+    The transfer map of each element is cached until the element is invalidated, and the
+    maps from the start of the lattice to each element are composed incrementally: a change
+    only recomposes the maps downstream of the changed element, up to the element read.
+    Readbacks behind an element that does not track linearly (a blocking screen, a TCAV that
+    is on, second order or drift-kick-drift tracking, ...) are not served.
+    """
+
+    def __init__(self, lattice, beam, energies: dict):
+        """
+        Parameters
+        ----------
+        lattice : Segment
+            Lattice to follow, its elements are read but never changed
+        beam : ParticleBeam
+            Incoming beam
+        energies : dict
+            Beam energy at the entrance of each element, keyed by element name
+            (see `VirtualAccelerator.get_energy`)
+        """
+        self.elements = list(lattice.elements)
+        self.species = beam.species
+
+        particles = beam.particles
+        weights = beam.survival_probabilities
+        self.mu0 = (particles * weights.unsqueeze(-1)).sum(0) / weights.sum()
+        self.cov0 = torch.cov(particles.T, aweights=weights)
+        self._energies = [
+            torch.as_tensor(energies[e.name], dtype=particles.dtype) for e in self.elements
+        ]
+
+        self._positions = {}
+        for i, element in enumerate(self.elements):
+            self._positions.setdefault(element.name, []).append(i)
+        # Transfer map of each element, None until computed, False if it is not linear
+        self._maps = [None] * len(self.elements)
+        # _cumulative[i] maps the start of the lattice to the entrance of element i
+        self._cumulative = [torch.eye(7, dtype=particles.dtype)]
+
+    def invalidate(self, name: str):
+        """Drop the cached maps of the elements called `name` and everything downstream"""
+        positions = self._positions.get(name, [])
+        for i in positions:
+            self._maps[i] = None
+        if positions:
+            del self._cumulative[min(positions) + 1 :]
+
+    def _element_map(self, index: int) -> torch.Tensor | bool:
+        if self._maps[index] is None:
+            element = self.elements[index]
+            energy = self._energies[index]
+            if isinstance(element, TransverseDeflectingCavity):
+                # A TCAV that is off is a drift
+                self._maps[index] = bool(element.voltage == 0) and Drift(
+                    element.length, dtype=energy.dtype
+                ).first_order_transfer_map(energy, self.species)
+            elif _is_linear(element):
+                self._maps[index] = element.first_order_transfer_map(energy, self.species)
+            else:
+                self._maps[index] = False
+        return self._maps[index]
+
+    def moments(self, index: int) -> tuple[torch.Tensor, torch.Tensor] | None:
+        """
+        Centroid and covariance of the beam at the entrance of an element
+
+        Returns
+        -------
+        tuple[torch.Tensor, torch.Tensor] | None
+            7D centroid and 7x7 covariance, None if an upstream element is not linear
+        """
+        while len(self._cumulative) <= index:
+            i = len(self._cumulative) - 1
+            transfer_map = self._element_map(i)
+            if transfer_map is False:
+                return None
+            self._cumulative.append(transfer_map @ self._cumulative[i])
+        cumulative = self._cumulative[index]
+        return cumulative @ self.mu0, cumulative @ self.cov0 @ cumulative.T
+
+    def readback(self, index: int, attribute: str) -> torch.Tensor | None:
+        """
+        Value of a BPM or screen PV attribute (see `READBACK_CLASSES`), in the units of
+        `pv_mapping`. None if the element is not active or can not be served.
+        """
+        element = self.elements[index]
+        if not getattr(element, "is_active", False):
+            return None
+        moments = self.moments(index)
+        if moments is None:
+            return None
+        mu, cov = moments
+
+        x = mu[0] - element.misalignment[0]
+        y = mu[2] - element.misalignment[1]
+        if isinstance(element, BPM):
+            return {"X": x, "XSCDT1H": x, "Y": y, "YSCDT1H": y}.get(attribute)
+        if isinstance(element, Screen):
+            return {
+                "X": x * 1e6,
+                "Y": y * 1e6,
+                "XRMS": cov[0, 0].sqrt() * 1e6,
+                "YRMS": cov[2, 2].sqrt() * 1e6,
+            }.get(attribute)
+        return None
+
+
+def _is_linear(element) -> bool:
+    """Whether tracking through an element is its first-order transfer map"""
+    if isinstance(element, Screen):
+        return not (element.is_active and element.is_blocking)
+    if isinstance(element, (BPM, Marker)):
+        return True
+    return getattr(element, "tracking_method", None) == "linear"
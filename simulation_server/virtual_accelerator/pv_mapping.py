@@ -1,6 +1,17 @@
+import numpy as np
 import pandas as pd
 import torch
 
+from simulation_server.virtual_accelerator.screen_renderer import render_screen
+from simulation_server.virtual_accelerator.utils import (
+    DEFAULT_CAMERA_GAIN,
+    bin_image,
+    camera_gain,
+    clamp_roi,
+    crop_image,
+    quantize_image,
+)
+
 
 class NoSetMethodError(Exception):
     pass
@@ -112,20 +123,125 @@ BPM_MAPPING = {
     "TMIT": FieldAccessor(lambda e, energy: 1.0),
 }
 
-# multiply image intensity by 16 bit number range (is similar to real machine?)
+# Binning factors served as separate image PVs for each screen
+SCREEN_BINNING = (2, 4, 8)
+
+
+def screen_frame(e, binning=1):
+    """
+    Camera frame of a screen as a numpy array, optionally binned. Screens with a
+    `camera_dtype` (see `VirtualAccelerator`) are scaled to counts by their
+    `camera_gain` (the float frames' scaling by default, auto-exposed to the full
+    frame's peak with "auto", see `utils.camera_gain`) and quantized at their
+    `bit_depth`, binned frames saturating like the full one. Frames are
+    computed once per simulation and cached on the element until the screen's
+    reading changes. Readings come from the screen's renderer, see `screen_renderer`.
+    """
+    reading = render_screen(e)
+    cache = getattr(e, "_frame_cache", None)
+    if cache is None or cache["reading"] is not reading:
+        frame = reading.T.detach().cpu().numpy()
+        if getattr(e, "camera_dtype", None) is None:
+            # multiply image intensity by 16 bit number range (is similar to real machine?)
+            # in the precision of the simulation
+            scaled = frame * np.float32(DEFAULT_CAMERA_GAIN)
+        else:
+            gain = camera_gain(frame, e.bit_depth, getattr(e, "camera_gain", DEFAULT_CAMERA_GAIN))
+            scaled = frame * frame.dtype.type(gain)
+        cache = {"reading": reading, "scaled": scaled}
+        e._frame_cache = cache
+    if binning not in cache:
+        frame = bin_image(cache["scaled"], binning)
+        dtype = getattr(e, "camera_dtype", None)
+        if dtype is not None:
+            frame = quantize_image(frame, dtype, e.bit_depth)
+        else:
+            frame = frame.astype(np.float64)
+        cache[binning] = frame
+    return cache[binning]
+
+
+def screen_roi(e):
+    """Effective (min_x, min_y, size_x, size_y) region of interest of a screen"""
+    shape = (e.resolution[0], e.resolution[1])
+    requested = getattr(e, "roi_request", (0, 0, shape[0], shape[1]))
+    return clamp_roi(shape, *requested)
+
+
+def set_screen_roi(e, index, value):
+    """Set one of (min_x, min_y, size_x, size_y) of a screen's requested region of interest"""
+    requested = list(getattr(e, "roi_request", (0, 0, e.resolution[0], e.resolution[1])))
+    requested[index] = int(value)
+    e.roi_request = tuple(requested)
+
+
+def binned_screen_mapping(factor):
+    """PV attributes for a binned image of a screen"""
+    return {
+        f"Image:Bin{factor}:ArrayData": FieldAccessor(
+            lambda e, energy: screen_frame(e, factor)
+        ),
+        f"Image:Bin{factor}:ArraySize1_RBV": FieldAccessor(
+            lambda e, energy: e.resolution[0] // factor
+        ),
+        f"Image:Bin{factor}:ArraySize0_RBV": FieldAccessor(
+            lambda e, energy: e.resolution[1] // factor
+        ),
+    }
+
+
+def roi_screen_mapping():
+    """areaDetector-like ROI PV attributes of a screen"""
+    mapping = {
+        "ROI:ArrayData": FieldAccessor(
+            lambda e, energy: crop_image(screen_frame(e), *screen_roi(e))
+        ),
+    }
+    for index, field in enumerate(("MinX", "MinY", "SizeX", "SizeY")):
+        mapping[f"ROI:{field}"] = FieldAccessor(
+            lambda e, energy, i=index: getattr(
+                e, "roi_request", (0, 0, e.resolution[0], e.resolution[1])
+            )[i],
+            lambda e, energy, value, i=index: set_screen_roi(e, i, value),
+        )
+        mapping[f"ROI:{field}_RBV"] = FieldAccessor(
+            lambda e, energy, i=index: screen_roi(e)[i]
+        )
+    return mapping
+
+
 SCREEN_MAPPING = {
-    "Image:ArrayData": FieldAccessor(lambda e, energy: e.reading.T * 65535),
+    "Image:ArrayData": FieldAccessor(lambda e, energy: screen_frame(e)),
     "PNEUMATIC": "is_active",
     "Image:ArraySize1_RBV": FieldAccessor(lambda e, energy: e.resolution[0]),
     "Image:ArraySize0_RBV": FieldAccessor(lambda e, energy: e.resolution[1]),
     "RESOLUTION": FieldAccessor(lambda e, energy: e.pixel_size[0] * 1e6),
-    "IMAGE":  FieldAccessor(lambda e, energy: e.reading.T * 65535),
+    "IMAGE":  FieldAccessor(lambda e, energy: screen_frame(e)),
+    "N_OF_BITS": FieldAccessor(lambda e, energy: getattr(e, "bit_depth", 16)),
     "N_OF_ROW": FieldAccessor(lambda e, energy: e.resolution[0]),
     "N_OF_COL": FieldAccessor(lambda e, energy: e.resolution[1]),
     "XRMS": FieldAccessor(lambda e, energy: e.get_read_beam().sigma_x*1e6),
     "YRMS": FieldAccessor(lambda e, energy: e.get_read_beam().sigma_y*1e6),
     "X": FieldAccessor(lambda e, energy: e.get_read_beam().mu_x*1e6),
     "Y": FieldAccessor(lambda e, energy: e.get_read_beam().mu_y*1e6),
+    **roi_screen_mapping(),
+}
+for _factor in SCREEN_BINNING:
+    SCREEN_MAPPING.update(binned_screen_mapping(_factor))
+
+
+# Attributes whose value comes from tracking the beam, per element type
+TRACKED_ATTRIBUTES = {
+    "BPM": {"X", "Y", "XSCDT1H", "YSCDT1H"},
+    "Screen": {"X", "Y", "XRMS", "YRMS", "Image:ArrayData", "IMAGE", "ROI:ArrayData"}
+    | {f"Image:Bin{factor}:ArrayData" for factor in SCREEN_BINNING},
+}
+
+
+# Setpoint attributes that only change how a reading is served, not the beam, per element
+# type, with the readback attributes of the same element they change
+VIEW_ATTRIBUTES = {
+    "Screen": {f"ROI:{field}": ("ROI:ArrayData",) for field in ("MinX", "MinY", "SizeX", "SizeY")},
 }
 
 
@@ -168,9 +284,10 @@ def access_cheetah_attribute(element, pv_attribute, energy, set_value=None):
 
     accessor = mapping[pv_attribute]
 
-    # convert to tensor if the value is a float or int
+    # convert to tensor if the value is a float or int, in the precision of the lattice
     if isinstance(set_value, (float, int)):
-        set_value = torch.tensor(set_value)
+        numeric = not isinstance(set_value, bool) and isinstance(energy, torch.Tensor)
+        set_value = torch.tensor(set_value, dtype=energy.dtype if numeric else None)
 
     if isinstance(accessor, str):
         if set_value is None:
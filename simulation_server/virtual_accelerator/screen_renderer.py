@@ -0,0 +1,234 @@
+from abc import ABC, abstractmethod
+
+import torch
+import torch.nn.functional as F
+from cheetah.particles import ParticleBeam
+
+# Screen renderers selectable with a screen's "renderer" entry in `utils.default_params`,
+# options are passed with "renderer_options". "cheetah" keeps Cheetah's own histogram.
+RENDERERS = {}
+
+
+def _renderer(name):
+    def register(cls):
+        RENDERERS[name] = cls
+        return cls
+
+    return register
+
+
+def make_renderer(params):
+    """
+    Renderer of a screen from its parameters (see `utils.default_params`).
+
+    Returns:
+    --------
+    output : ScreenRenderer | None
+        The renderer, None to read the screen out with Cheetah's histogram.
+    """
+    name = params.get("renderer", "bincount")
+    if name == "cheetah":
+        return None
+    if name not in RENDERERS:
+        raise ValueError(
+            f"Unknown screen renderer {name}, expected one of {['cheetah', *RENDERERS]}"
+        )
+    return RENDERERS[name](**params.get("renderer_options", {}))
+
+
+def render_screen(e):
+    """
+    Reading of a screen, rendered with its `renderer` (see `VirtualAccelerator`) the
+    first time it is read after tracking. Cheetah caches it until the next tracking.
+    """
+    if e.cached_reading is None and getattr(e, "renderer", None) is not None:
+        image = e.renderer(e)
+        if image is not None:
+            e.cached_reading = image
+    return e.reading
+
+
+class ScreenRenderer(ABC):
+    """
+    Renders the particles a screen read into an image with the shape, orientation and
+    intensity (absolute charge times survival probability per pixel) of Cheetah's
+    histogram. Images are written into two buffers of each shape used in turns, so a
+    reading stays valid until the screen is rendered twice more and consecutive
+    readings are different tensors.
+    """
+
+    def __init__(self):
+        self._buffers = {}
+
+    def __call__(self, screen) -> torch.Tensor | None:
+        """The image of a screen, None where Cheetah has to read it out itself"""
+        beam = screen.get_read_beam()
+        if (
+            not isinstance(beam, ParticleBeam)
+            or beam.particles.dim() > 2
+            or beam.energy.dim() > 0
+            or beam.particle_charges.dim() > 1
+        ):
+            return None
+        return self.render(screen, beam)
+
+    @abstractmethod
+    def render(self, screen, beam) -> torch.Tensor:
+        """Image of the particles of `beam` on `screen`"""
+
+    def buffer(self, shape, like) -> torch.Tensor:
+        """Next of the two buffers of a shape, zeroed"""
+        buffers = self._buffers.get(shape)
+        if buffers is None or buffers[0].dtype != like.dtype or buffers[0].device != like.device:
+            buffers = self._buffers[shape] = [like.new_zeros(shape), like.new_zeros(shape)]
+        buffers.reverse()
+        return buffers[0].zero_()
+
+    @staticmethod
+    def on_sensor(beam, left, bottom, right, top):
+        """Transverse positions and weights of the particles that hit the sensor"""
+        x, y = beam.x, beam.y
+        weights = beam.particle_charges.abs() * beam.survival_probabilities
+        hit = (x >= left) & (x <= right) & (y >= bottom) & (y <= top) & (weights > 0)
+        if hit.all():
+            return x, y, weights
+        hit = hit.nonzero().squeeze(1)
+        return x.index_select(0, hit), y.index_select(0, hit), weights.index_select(0, hit)
+
+    def histogram(self, x, y, weights, edges_x, edges_y):
+        """
+        Weighted 2D histogram of particles on the sensor as a bincount of their flat
+        pixel indices, accumulated into a buffer of shape (height, width)
+        """
+        width, height = len(edges_x) - 1, len(edges_y) - 1
+        index = pixel_index(y, edges_y) * width + pixel_index(x, edges_x)
+        image = self.buffer((height, width), weights)
+        image.view(-1).index_add_(0, index, weights)
+        return image
+
+
+def pixel_index(position, edges):
+    """
+    Bins of equally spaced `edges` that contain positions between the first and last
+    edge, the last bin including its right edge. Positions next to an edge are assigned
+    like `torch.histogramdd` does, by comparing them with the edge itself.
+    """
+    n = len(edges) - 1
+    index = ((position - edges[0]) * (n / (edges[-1] - edges[0]))).long().clamp_(0, n - 1)
+    below = position < edges.index_select(0, index)
+    above = (position >= edges[1:].index_select(0, index)) & (index < n - 1)
+    index -= below.long()
+    index += above.long()
+    return index
+
+
+@_renderer("bincount")
+class BincountRenderer(ScreenRenderer):
+    """Cheetah's histogram, skipping the particles outside of the sensor first"""
+
+    def render(self, screen, beam):
+        edges_x, edges_y = screen.pixel_bin_edges
+        x, y, weights = self.on_sensor(beam, edges_x[0], edges_y[0], edges_x[-1], edges_y[-1])
+        return self.histogram(x, y, weights, edges_x, edges_y)
+
+
+@_renderer("binned")
+class BinnedRenderer(ScreenRenderer):
+    """
+    Histogram at a resolution reduced by `factor` along both axes, interpolated back to
+    the resolution of the screen: repeating each coarse pixel with `mode` "nearest", or
+    any other mode of `torch.nn.functional.interpolate`. Trades detail for speed and
+    less shot noise.
+    """
+
+    def __init__(self, factor=4, mode="nearest"):
+        super().__init__()
+        if factor < 1:
+            raise ValueError(f"Rendering factor must be at least 1, got {factor}")
+        self.factor = int(factor)
+        self.mode = mode
+
+    def render(self, screen, beam):
+        width, height = (int(n) for n in screen.effective_resolution)
+        left, right, bottom, top = screen.extent
+        step_x, step_y = (right - left) / width, (top - bottom) / height
+        x, y, weights = self.on_sensor(beam, left, bottom, right, top)
+
+        # coarse pixels covering the sensor, the last ones may stick out
+        coarse_width, coarse_height = -(-width // self.factor), -(-height // self.factor)
+        edges_x = left + step_x * self.factor * torch.arange(coarse_width + 1).to(x)
+        edges_y = bottom + step_y * self.factor * torch.arange(coarse_height + 1).to(y)
+        coarse = self.histogram(x, y, weights, edges_x, edges_y)
+        coarse /= self.factor**2
+        if self.mode == "nearest":
+            image = self.buffer((coarse_height * self.factor, coarse_width * self.factor), coarse)
+            image.view(coarse_height, self.factor, coarse_width, self.factor).copy_(
+                coarse[:, None, :, None]
+            )
+        else:
+            image = F.interpolate(coarse[None, None], scale_factor=self.factor, mode=self.mode)[0, 0]
+        return image[:height, :width]
+
+
+@_renderer("splat")
+class SplatRenderer(ScreenRenderer):
+    """
+    Kernel density estimate of the image: a random subsample of `num_samples` particles,
+    each spread as a gaussian of `sigma` pixels over the pixels within `truncate` sigma.
+    The subsample keeps the total intensity and is drawn the same for every rendering.
+    """
+
+    def __init__(self, num_samples=10000, sigma=1.0, truncate=3.0, seed=0):
+        super().__init__()
+        if sigma <= 0:
+            raise ValueError(f"Splat sigma must be positive, got {sigma}")
+        self.num_samples = int(num_samples)
+        self.sigma = float(sigma)
+        self.radius = max(1, int(truncate * sigma + 0.5))
+        self.seed = seed
+        self._sample = None
+
+    def subsample(self, beam):
+        num_particles = beam.particles.shape[0]
+        if num_particles <= self.num_samples:
+            return beam.x, beam.y, beam.particle_charges.abs() * beam.survival_probabilities
+        if self._sample is None or self._sample[0] != num_particles:
+            generator = torch.Generator().manual_seed(self.seed)
+            sample = torch.randperm(num_particles, generator=generator)[: self.num_samples]
+            self._sample = num_particles, sample.to(beam.particles.device)
+        sample = self._sample[1]
+        weights = beam.particle_charges.abs() * beam.survival_probabilities
+        scale = weights.sum() / weights[sample].sum().clamp_min(torch.finfo(weights.dtype).tiny)
+        return beam.x[sample], beam.y[sample], weights[sample] * scale
+
+    def kernel(self, position, left, step, n):
+        """Pixel indices and normalized gaussian weights of each particle along one axis"""
+        offsets = torch.arange(-self.radius, self.radius + 1, device=position.device)
+        index = ((position - left) / step).floor().long()[:, None] + offsets
+        distance = (left + (index + 0.5) * step - position[:, None]) / (step * self.sigma)
+        kernel = torch.exp(-0.5 * distance**2)
+        kernel /= kernel.sum(dim=1, keepdim=True)
+        inside = (index >= 0) & (index < n)
+        return index.clamp(0, n - 1), kernel * inside
+
+    def render(self, screen, beam):
+        width, height = (int(n) for n in screen.effective_resolution)
+        left, right, bottom, top = screen.extent
+        step_x, step_y = (right - left) / width, (top - bottom) / height
+        x, y, weights = self.subsample(beam)
+
+        # particles further than the kernel off the sensor contribute nothing
+        margin_x, margin_y = self.radius * step_x, self.radius * step_y
+        hit = (
+            (x >= left - margin_x) & (x <= right + margin_x)
+            & (y >= bottom - margin_y) & (y <= top + margin_y) & (weights > 0)
+        )
+        x, y, weights = x[hit], y[hit], weights[hit]
+
+        ix, kx = self.kernel(x, left, step_x, width)
+        iy, ky = self.kernel(y, bottom, step_y, height)
+        index = iy[:, :, None] * width + ix[:, None, :]
+        values = weights[:, None, None] * ky[:, :, None] * kx[:, None, :]
+        image = self.buffer((height, width), weights)
+        image.view(-1).index_add_(0, index.reshape(-1), values.reshape(-1))
+        return image
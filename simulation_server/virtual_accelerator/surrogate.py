@@ -0,0 +1,560 @@
+"""
+Learned surrogate of a `VirtualAccelerator`, for high-rate optimizer runs where exact particle
+tracking does not matter.
+
+A small neural network is trained offline on samples generated by Cheetah tracking and predicts
+readbacks from setpoints in well under a millisecond. Inputs outside of the training domain fall
+back to tracking. Train a surrogate with
+
+    python -m simulation_server.virtual_accelerator.surrogate --name diag0 --out diag0_surrogate.pt
+
+and serve it with `run.py --surrogate diag0_surrogate.pt`.
+"""
+import argparse
+import contextlib
+import os
+
+import numpy as np
+import torch
+from cheetah.accelerator import BPM, Screen
+
+from simulation_server.virtual_accelerator.pv_mapping import (
+    BCTRL_LIMIT,
+    SCREEN_BINNING,
+    screen_frame,
+)
+from simulation_server.virtual_accelerator.utils import add_noise, crop_image
+
+# Readback attributes predicted by default, per element type
+BPM_OUTPUTS = ("X", "Y", "TMIT")
+SCREEN_OUTPUTS = ("X", "Y", "XRMS", "YRMS")
+# Setpoint attributes used as inputs by default, per element type
+DEFAULT_INPUTS = {
+    "Quadrupole": "BCTRL",
+    "HorizontalCorrector": "BCTRL",
+    "VerticalCorrector": "BCTRL",
+}
+# Binned image predicted with --images, the other images of the screen are upsampled from it
+IMAGE_BINNING = max(SCREEN_BINNING)
+
+
+class SurrogateModel(torch.nn.Module):
+    """
+    Fully connected network from input PVs to output PVs, on inputs and outputs normalized
+    with the statistics of the training samples. Array outputs such as images are flattened.
+    """
+
+    def __init__(
+        self,
+        inputs: list[str],
+        outputs: list[str],
+        output_shapes: list[tuple],
+        output_dtypes: list[str],
+        hidden: int = 64,
+        layers: int = 2,
+    ):
+        super().__init__()
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.output_shapes = [tuple(shape) for shape in output_shapes]
+        self.output_dtypes = list(output_dtypes)
+        self.hidden = hidden
+        self.layers = layers
+
+        n_in = len(inputs)
+        n_out = int(sum(np.prod(shape, dtype=int) for shape in self.output_shapes))
+        modules = []
+        for _ in range(layers):
+            modules += [torch.nn.Linear(n_in, hidden), torch.nn.ELU()]
+            n_in = hidden
+        modules.append(torch.nn.Linear(n_in, n_out))
+        self.net = torch.nn.Sequential(*modules)
+
+        for name, size in (("x", len(inputs)), ("y", n_out)):
+            self.register_buffer(f"{name}_mean", torch.zeros(size))
+            self.register_buffer(f"{name}_std", torch.ones(size))
+        # Training domain
+        self.register_buffer("x_min", torch.zeros(len(inputs)))
+        self.register_buffer("x_max", torch.zeros(len(inputs)))
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        """Normalized outputs for normalized inputs"""
+        return self.net(x)
+
+    def fit_normalization(self, X: torch.Tensor, Y: torch.Tensor):
+        """Set the normalization and the training domain from the training samples"""
+        self.x_mean, self.x_std = X.mean(0), _std(X)
+        self.y_mean, self.y_std = Y.mean(0), _std(Y)
+        self.x_min, self.x_max = X.min(0).values, X.max(0).values
+
+    def in_domain(self, x: np.ndarray, margin: float = 0.0) -> bool:
+        """
+        Whether inputs lie in the box spanned by the training samples, widened by
+        `margin` times its size on each side
+        """
+        x_min, x_max = self.x_min.numpy(), self.x_max.numpy()
+        span = (x_max - x_min) * margin
+        return bool(np.all((x >= x_min - span) & (x <= x_max + span)))
+
+    @torch.inference_mode()
+    def predict(self, x: np.ndarray) -> dict:
+        """
+        Predict the outputs for one set of inputs.
+
+        Parameters
+        ----------
+        x : np.ndarray
+            Values of `inputs`, in order
+
+        Returns
+        -------
+        dict
+            Output PV name to value, floats for scalars and arrays of the training dtype otherwise
+        """
+        x = torch.as_tensor(x, dtype=self.x_mean.dtype)
+        y = self.net((x - self.x_mean) / self.x_std) * self.y_std + self.y_mean
+        y = y.numpy()
+
+        values = {}
+        start = 0
+        for name, shape, dtype in zip(self.outputs, self.output_shapes, self.output_dtypes):
+            size = int(np.prod(shape, dtype=int))
+            value = y[start : start + size]
+            start += size
+            if not shape:
+                values[name] = float(value[0])
+                continue
+            value = value.reshape(shape)
+            if np.issubdtype(np.dtype(dtype), np.integer):
+                info = np.iinfo(dtype)
+                value = np.clip(np.rint(value), info.min, info.max)
+            values[name] = value.astype(dtype)
+        return values
+
+    def save(self, path: str):
+        torch.save(
+            {
+                "inputs": self.inputs,
+                "outputs": self.outputs,
+                "output_shapes": [list(shape) for shape in self.output_shapes],
+                "output_dtypes": self.output_dtypes,
+                "hidden": self.hidden,
+                "layers": self.layers,
+                "state_dict": self.state_dict(),
+            },
+            path,
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "SurrogateModel":
+        data = torch.load(path)
+        model = cls(
+            data["inputs"],
+            data["outputs"],
+            data["output_shapes"],
+            data["output_dtypes"],
+            hidden=data["hidden"],
+            layers=data["layers"],
+        )
+        model.load_state_dict(data["state_dict"])
+        model.eval()
+        return model
+
+
+def _std(values: torch.Tensor) -> torch.Tensor:
+    # Constant columns are left unscaled
+    std = values.std(0) if len(values) > 1 else torch.zeros(values.shape[1])
+    return torch.where(std > 0, std, torch.ones_like(std))
+
+
+class SurrogateAccelerator:
+    """
+    Serves a `VirtualAccelerator` through a `SurrogateModel`.
+
+    Writes to model inputs that stay in the training domain only change the lattice, and
+    the model's outputs are predicted instead of tracked. Everything else (other PVs, inputs
+    outside of the domain, a closed shutter, readbacks the model does not predict) goes
+    through the accelerator, which then tracks. Takes the same `track` and `preempt`
+    arguments as the accelerator, so a `SimDriver` or `HeadlessSimulator` can drive it.
+    Any other attribute is the accelerator's.
+    """
+
+    def __init__(self, virtual_accelerator, model: SurrogateModel, margin: float = 0.0):
+        """
+        Parameters
+        ----------
+        virtual_accelerator : VirtualAccelerator
+            Accelerator the model was trained on
+        model : SurrogateModel
+            Trained surrogate
+        margin : float
+            Fraction of the training domain by which inputs may leave it
+        """
+        self.virtual_accelerator = virtual_accelerator
+        self.model = model
+        self.margin = margin
+        self.fallbacks = 0
+        self._input_index = {name: i for i, name in enumerate(model.inputs)}
+        self._outputs = set(model.outputs)
+        # Screens with a predicted image, base PV name -> (PV of the image, its binning)
+        self._predicted_images = {}
+        for name in model.outputs:
+            base, attribute = _split(name)
+            if attribute.startswith("Image:Bin") and attribute.endswith(":ArrayData"):
+                self._predicted_images[base] = (name, int(attribute.split(":")[1][3:]))
+        self._sync()
+
+    def __getattr__(self, name):
+        if name == "virtual_accelerator":
+            raise AttributeError(name)
+        return getattr(self.virtual_accelerator, name)
+
+    @property
+    def stale(self) -> bool:
+        """True while the lattice has changed since the last tracking"""
+        return self._stale
+
+    def _sync(self):
+        """Re-read the inputs after the accelerator tracked"""
+        values = self.virtual_accelerator.get_pvs(self.model.inputs)
+        self._x = np.array([float(values[name]) for name in self.model.inputs])
+        self._stale = False
+        self._prediction = None
+
+    def _beam_off(self) -> bool:
+        return bool(torch.all(self.virtual_accelerator.initial_beam_distribution.particle_charges == 0.0))
+
+    def _track(self, preempt=None):
+        self.fallbacks += 1
+        self.virtual_accelerator.track(preempt)
+        self._stale = False
+
+    def _needs_tracking(self, pv_names) -> bool:
+        """Whether reading PVs while stale needs tracking, because the model does not predict them"""
+        return any(
+            self.virtual_accelerator.is_tracked_readback(name)
+            for name in pv_names
+            if name not in self._outputs and not self._upsampled(name)
+        )
+
+    def set_pvs(self, values: dict, track: bool = True):
+        """
+        Set PVs, see `VirtualAccelerator.set_pvs`. Writes the model does not cover are
+        tracked right away, or with `track=False` once readings need it.
+        """
+        x = self._x.copy()
+        for name, value in values.items():
+            if name not in self._input_index:
+                break
+            x[self._input_index[name]] = float(value)
+        else:
+            if self.model.in_domain(x, self.margin) and not self._beam_off():
+                self.virtual_accelerator.set_pvs(values, track=False)
+                self._x = x
+                self._stale = True
+                self._prediction = None
+                return
+
+        self.fallbacks += 1
+        self.virtual_accelerator.set_pvs(values, track=track)
+        # Reading the inputs does not track, the accelerator tracks when readings need it
+        self._sync()
+
+    def update_readings(self, preempt=None, readbacks=()):
+        """
+        Track if the lattice changed and one of `readbacks` (PVs about to be read) is not
+        predicted, see `VirtualAccelerator.update_readings`
+        """
+        if not self._stale:
+            self.virtual_accelerator.update_readings(preempt, readbacks)
+        elif self._needs_tracking(readbacks):
+            self._track(preempt)
+
+    def get_pvs(self, pv_names: list, preempt=None) -> dict:
+        if not self._stale:
+            return self.virtual_accelerator.get_pvs(pv_names, preempt)
+
+        predicted = [name for name in pv_names if name in self._outputs or self._upsampled(name)]
+        others = [name for name in pv_names if name not in predicted]
+        if self._needs_tracking(others):
+            self._track(preempt)
+            return self.virtual_accelerator.get_pvs(pv_names, preempt)
+
+        values = self.virtual_accelerator.get_pvs(others) if others else {}
+        if predicted:
+            if self._prediction is None:
+                self._prediction = self.model.predict(self._x)
+            for name in predicted:
+                values[name] = self._predicted_value(name)
+        return values
+
+    def _predicted_value(self, name: str):
+        if name in self._outputs:
+            value = self._prediction[name]
+        else:
+            value = self._upsample(name)
+
+        # Match the noise of the accelerator, which only applies to arrays
+        noise_level = self.virtual_accelerator.measurement_noise_level
+        if noise_level is not None and isinstance(value, np.ndarray):
+            noisy = add_noise(value, noise_level=noise_level)
+            if np.issubdtype(value.dtype, np.integer):
+                info = np.iinfo(value.dtype)
+                noisy = np.clip(np.rint(noisy), info.min, info.max)
+            value = noisy.astype(value.dtype)
+        return value.ravel() if isinstance(value, np.ndarray) else value
+
+    def _upsampled(self, pv_name: str) -> bool:
+        """Whether an image PV is served from the predicted image of its screen"""
+        base, attribute = _split(pv_name)
+        if base not in self._predicted_images:
+            return False
+        binning = self._predicted_images[base][1]
+        return attribute in ("Image:ArrayData", "IMAGE", "ROI:ArrayData") or any(
+            attribute == f"Image:Bin{factor}:ArrayData" and binning % factor == 0
+            for factor in SCREEN_BINNING
+        )
+
+    def _upsample(self, pv_name: str) -> np.ndarray:
+        """Image of a screen at a finer binning, repeated from its predicted image"""
+        base, attribute = _split(pv_name)
+        name, binning = self._predicted_images[base]
+        screen = self._screen(base)
+        factor = int(attribute.split(":")[1][3:]) if attribute.startswith("Image:Bin") else 1
+
+        image = self._prediction[name]
+        repeat = binning // factor
+        image = np.repeat(np.repeat(image, repeat, axis=0), repeat, axis=1)
+        # Pad the rows and columns binning dropped
+        shape = (screen.resolution[0] // factor, screen.resolution[1] // factor)
+        image = np.pad(image, [(0, shape[0] - image.shape[0]), (0, shape[1] - image.shape[1])])
+        if attribute == "ROI:ArrayData":
+            roi = getattr(screen, "roi_request", (0, 0, shape[0], shape[1]))
+            image = crop_image(image, *roi)
+        return image
+
+    def _screen(self, base: str) -> Screen:
+        element = getattr(self.virtual_accelerator.lattice, self.virtual_accelerator.mapping[base].lower())
+        return element[0] if isinstance(element, list) else element
+
+    def reset(self):
+        self.virtual_accelerator.reset()
+        self._sync()
+
+    def set_shutter(self, value: bool):
+        self.virtual_accelerator.set_shutter(value)
+        self._sync()
+
+    def track(self, preempt=None):
+        self.virtual_accelerator.track(preempt)
+        self._sync()
+
+    def clone(self) -> "SurrogateAccelerator":
+        """Independent copy on a clone of the accelerator, sharing the model"""
+        return SurrogateAccelerator(self.virtual_accelerator.clone(), self.model, self.margin)
+
+
+def _split(pv_name: str) -> tuple[str, str]:
+    """Base name and attribute of a PV"""
+    parts = pv_name.split(":")
+    return ":".join(parts[:3]), ":".join(parts[3:])
+
+
+def default_io(virtual_accelerator, images: bool = False) -> tuple[list[str], list[str]]:
+    """
+    Inputs and outputs of a surrogate covering the whole lattice: magnet and corrector
+    setpoints as inputs, BPM and screen positions and sizes as outputs, and the binned
+    screen images if `images` is set.
+
+    Returns
+    -------
+    tuple[list[str], list[str]]
+        Input PVs and output PVs in lattice order
+    """
+    elements = {}
+    for base, element_name in virtual_accelerator.mapping.items():
+        element = getattr(virtual_accelerator.lattice, element_name.lower(), None)
+        if element is None:
+            continue
+        element = element[0] if isinstance(element, list) else element
+        elements[base] = element
+
+    inputs, outputs = [], []
+    for base in sorted(elements, key=lambda b: virtual_accelerator.element_index[elements[b].name]):
+        element_type = type(elements[base]).__name__
+        if element_type in DEFAULT_INPUTS:
+            inputs.append(f"{base}:{DEFAULT_INPUTS[element_type]}")
+        elif isinstance(elements[base], BPM):
+            outputs += [f"{base}:{attribute}" for attribute in BPM_OUTPUTS]
+        elif isinstance(elements[base], Screen):
+            outputs += [f"{base}:{attribute}" for attribute in SCREEN_OUTPUTS]
+            if images:
+                outputs.append(f"{base}:Image:Bin{IMAGE_BINNING}:ArrayData")
+    return inputs, outputs
+
+
+def output_shape(virtual_accelerator, pv_name: str) -> tuple:
+    """Shape of the value of an output PV before the accelerator flattens it, () for scalars"""
+    base, attribute = _split(pv_name)
+    if not attribute.endswith("ArrayData"):
+        return ()
+    element = getattr(virtual_accelerator.lattice, virtual_accelerator.mapping[base].lower())
+    element = element[0] if isinstance(element, list) else element
+    factor = int(attribute.split(":")[1][3:]) if attribute.startswith("Image:Bin") else 1
+    return screen_frame(element, factor).shape
+
+
+def generate_samples(
+    virtual_accelerator,
+    inputs: list[str],
+    outputs: list[str],
+    bounds: np.ndarray,
+    n_samples: int,
+    seed: int | None = None,
+) -> tuple[np.ndarray, list[np.ndarray]]:
+    """
+    Track uniformly sampled inputs and read the outputs.
+
+    Parameters
+    ----------
+    virtual_accelerator : VirtualAccelerator
+        Accelerator to sample, its lattice is left at the last sample
+    inputs, outputs : list[str]
+        Input and output PVs
+    bounds : np.ndarray
+        (n_inputs, 2) lower and upper bound of each input
+    n_samples : int
+        Number of samples
+    seed : int | None
+        Seed of the input sampling
+
+    Returns
+    -------
+    tuple[np.ndarray, list[np.ndarray]]
+        (n_samples, n_inputs) inputs and, per output, its n_samples values
+    """
+    rng = np.random.default_rng(seed)
+    X = rng.uniform(bounds[:, 0], bounds[:, 1], size=(n_samples, len(inputs)))
+    Y = {name: [] for name in outputs}
+    # The accelerator prints every write
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for x in X:
+            virtual_accelerator.set_pvs(dict(zip(inputs, x.tolist())))
+            values = virtual_accelerator.get_pvs(outputs)
+            for name in outputs:
+                Y[name].append(values[name])
+    return X, [np.array(Y[name]) for name in outputs]
+
+
+def train_surrogate(
+    X: np.ndarray,
+    Y: list[np.ndarray],
+    inputs: list[str],
+    outputs: list[str],
+    output_shapes: list[tuple] | None = None,
+    hidden: int = 64,
+    layers: int = 2,
+    epochs: int = 2000,
+    lr: float = 1e-3,
+    seed: int | None = None,
+) -> SurrogateModel:
+    """
+    Fit a surrogate to samples from `generate_samples`.
+
+    Parameters
+    ----------
+    X : np.ndarray
+        (n_samples, n_inputs) inputs
+    Y : list[np.ndarray]
+        Per output, its n_samples values
+    inputs, outputs : list[str]
+        Input and output PVs
+    output_shapes : list[tuple] | None
+        Shape of each output, e.g. of an image before the accelerator flattened it.
+        Defaults to the shape of the samples.
+    hidden, layers : int
+        Width and number of hidden layers
+    epochs : int
+        Number of full-batch training steps
+    lr : float
+        Learning rate
+    seed : int | None
+        Seed of the weight initialization
+
+    Returns
+    -------
+    SurrogateModel
+        Trained model in evaluation mode
+    """
+    if seed is not None:
+        torch.manual_seed(seed)
+    if output_shapes is None:
+        output_shapes = [y.shape[1:] for y in Y]
+    dtypes = [str(y.dtype) if np.issubdtype(y.dtype, np.integer) else "float64" for y in Y]
+
+    model = SurrogateModel(inputs, outputs, output_shapes, dtypes, hidden=hidden, layers=layers)
+    X = torch.as_tensor(X, dtype=torch.float32)
+    Y = torch.as_tensor(
+        np.concatenate([y.reshape(len(y), -1) for y in Y], axis=1), dtype=torch.float32
+    )
+    model.fit_normalization(X, Y)
+    X = (X - model.x_mean) / model.x_std
+    Y = (Y - model.y_mean) / model.y_std
+
+    optimizer = torch.optim.Adam(model.net.parameters(), lr=lr)
+    for _ in range(epochs):
+        optimizer.zero_grad()
+        loss = torch.nn.functional.mse_loss(model(X), Y)
+        loss.backward()
+        optimizer.step()
+
+    model.eval()
+    return model
+
+
+if __name__ == "__main__":
+    from simulation_server.factory import get_virtual_accelerator
+
+    parser = argparse.ArgumentParser(description="Train a surrogate of the virtual accelerator.")
+    parser.add_argument("--name", type=str, choices=["diag0", "nc_injector"], required=True)
+    parser.add_argument("--lattice_file", type=str, default=None, help="Lattice JSON to use instead of the default one.")
+    parser.add_argument("--out", type=str, required=True, help="File to save the trained model to.")
+    parser.add_argument("--samples", type=int, default=2000, help="Number of tracked training samples.")
+    parser.add_argument(
+        "--span",
+        type=float,
+        default=1.0,
+        help="Inputs are sampled within this distance (kG or kG-m) of their lattice values.",
+    )
+    parser.add_argument("--images", action="store_true", help=f"Also predict Bin{IMAGE_BINNING} screen images.")
+    parser.add_argument("--hidden", type=int, default=64, help="Width of the hidden layers.")
+    parser.add_argument("--layers", type=int, default=2, help="Number of hidden layers.")
+    parser.add_argument("--epochs", type=int, default=2000, help="Number of training steps.")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    va = get_virtual_accelerator(args.name, lattice_file=args.lattice_file)
+    inputs, outputs = default_io(va, images=args.images)
+    current = va.get_pvs(inputs)
+    bounds = np.array([[current[name] - args.span, current[name] + args.span] for name in inputs])
+    bounds = np.clip(bounds, -BCTRL_LIMIT, BCTRL_LIMIT)
+
+    print(f"Sampling {len(inputs)} inputs and {len(outputs)} outputs {args.samples} times")
+    # Keep a fifth of the samples out of the training to report the error
+    n_train = args.samples - args.samples // 5
+    X, Y = generate_samples(va, inputs, outputs, bounds, args.samples, seed=args.seed)
+    model = train_surrogate(
+        X[:n_train], [y[:n_train] for y in Y], inputs, outputs,
+        output_shapes=[output_shape(va, name) for name in outputs],
+        hidden=args.hidden, layers=args.layers, epochs=args.epochs, seed=args.seed,
+    )
+    model.save(args.out)
+    print(f"Saved the surrogate to {args.out}")
+
+    if n_train < args.samples:
+        print("Validation error, relative to the spread of each output:")
+        predictions = [model.predict(x) for x in X[n_train:]]
+        for name, y in zip(outputs, Y):
+            error = np.array([np.ravel(p[name]) for p in predictions], dtype=float) - y[n_train:]
+            spread = np.std(y[:n_train]) or 1.0
+            print(f"  {name}: {np.sqrt(np.mean(error**2)) / spread:.3f}")
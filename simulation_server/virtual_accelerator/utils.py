@@ -1,4 +1,5 @@
 import numpy as np
+import torch
 
 
 def add_noise(data, noise_level=0.1):
@@ -34,3 +35,158 @@ def add_noise(data, noise_level=0.1):
             noisy_data[x, y] += np.random.uniform(1.1 * max_signal, max_signal)
 
     return noisy_data
+
+
+def bin_image(image, factor):
+    """
+    Bins an image by summing factor x factor pixel blocks, like a camera's
+    hardware binning. Rows/columns that don't fill a whole block are dropped.
+
+    Parameters:
+    -----------
+    image : np.ndarray or torch.Tensor
+        2D image.
+    factor : int
+        Binning factor along both axes.
+
+    Returns:
+    --------
+    output : np.ndarray or torch.Tensor
+        Binned image of shape (image.shape[0] // factor, image.shape[1] // factor).
+    """
+    if factor == 1:
+        return image
+    nx, ny = image.shape[0] // factor, image.shape[1] // factor
+    blocks = image[: nx * factor, : ny * factor].reshape(nx, factor, ny, factor)
+    return blocks.sum(axis=(1, 3))
+
+
+def clamp_roi(shape, min_x, min_y, size_x, size_y):
+    """
+    Clamps a region of interest so it lies within an image of the given shape.
+    Axis 0 of the image is X, axis 1 is Y.
+
+    Returns:
+    --------
+    output : tuple[int, int, int, int]
+        Effective (min_x, min_y, size_x, size_y).
+    """
+    min_x = min(max(int(min_x), 0), shape[0] - 1)
+    min_y = min(max(int(min_y), 0), shape[1] - 1)
+    size_x = min(max(int(size_x), 1), shape[0] - min_x)
+    size_y = min(max(int(size_y), 1), shape[1] - min_y)
+    return min_x, min_y, size_x, size_y
+
+
+def crop_image(image, min_x, min_y, size_x, size_y):
+    """
+    Crops an image to a region of interest, clamped to the image bounds.
+    """
+    min_x, min_y, size_x, size_y = clamp_roi(image.shape, min_x, min_y, size_x, size_y)
+    return image[min_x : min_x + size_x, min_y : min_y + size_y]
+
+
+# Camera output formats: numpy dtype and default bit depth
+CAMERA_DTYPES = {
+    "uint8": ("uint8", 8),
+    "uint12": ("uint16", 12),
+    "uint16": ("uint16", 16),
+}
+
+# Counts per unit of a screen reading, the 16 bit range float frames are scaled to
+DEFAULT_CAMERA_GAIN = 65535.0
+
+
+def camera_format(params):
+    """
+    Output format of a screen's camera from its parameters (see `utils.default_params`).
+
+    Returns:
+    --------
+    output : tuple[np.dtype | None, int]
+        Integer dtype of the frames, None for unquantized float frames, and the bit depth.
+    """
+    if "dtype" not in params or params["dtype"] == "float":
+        return None, 16
+    if params["dtype"] not in CAMERA_DTYPES:
+        raise ValueError(
+            f"Unknown camera dtype {params['dtype']}, expected one of {list(CAMERA_DTYPES)} or float"
+        )
+    dtype, bit_depth = CAMERA_DTYPES[params["dtype"]]
+    bit_depth = params.get("bit_depth", bit_depth)
+    if not 0 < bit_depth <= np.dtype(dtype).itemsize * 8:
+        raise ValueError(f"Bit depth {bit_depth} does not fit in {dtype}")
+    gain = params.get("gain", DEFAULT_CAMERA_GAIN)
+    if gain != "auto" and gain <= 0:
+        raise ValueError(f"Camera gain must be positive or 'auto', got {gain}")
+    return np.dtype(dtype), bit_depth
+
+
+def camera_gain(image, bit_depth, gain=DEFAULT_CAMERA_GAIN):
+    """
+    Camera counts per unit of a screen reading (charge per pixel, in C). The default gain
+    scales readings like the float frames. With `gain="auto"` the camera is auto-exposed:
+    the brightest pixel of the frame reaches the full scale of the bit depth.
+
+    Parameters:
+    -----------
+    image : np.ndarray
+        Full frame of the screen reading.
+    bit_depth : int
+        Bit depth of the camera.
+    gain : float or "auto", optional
+        Counts per unit of reading, e.g. from a screen's "gain" in `default_params`.
+
+    Returns:
+    --------
+    output : float
+        Counts per unit of reading, 0 for an auto-exposed dark frame.
+    """
+    if gain != "auto":
+        return float(gain)
+    peak = float(image.max()) if image.size else 0.0
+    if peak <= 0:
+        return 0.0
+    return (2**bit_depth - 1) / peak
+
+
+def quantize_image(data, dtype, bit_depth):
+    """
+    Quantizes an image to camera counts, saturating at the bit depth.
+
+    Parameters:
+    -----------
+    data : np.ndarray
+        Image in (fractional) counts.
+    dtype : np.dtype
+        Integer output dtype.
+    bit_depth : int
+        Bit depth of the camera, counts are clipped to [0, 2**bit_depth - 1].
+
+    Returns:
+    --------
+    output : np.ndarray
+        Quantized image.
+    """
+    out = np.rint(data)
+    np.clip(out, 0, 2**bit_depth - 1, out=out)
+    return out.astype(dtype)
+
+
+def configure_threads(num_threads=None, num_interop_threads=None):
+    """
+    Limits the threads PyTorch uses for tracking, so it does not oversubscribe
+    the cores shared with the CA/PVA server threads. Must be called before the
+    first tracking, PyTorch fixes its inter-op thread pool on first use.
+
+    Parameters:
+    -----------
+    num_threads : int, optional
+        Threads used within an operation, unchanged if None.
+    num_interop_threads : int, optional
+        Threads used to run independent operations in parallel, unchanged if None.
+    """
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if num_interop_threads:
+        torch.set_num_interop_threads(num_interop_threads)
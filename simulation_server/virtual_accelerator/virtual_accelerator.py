@@ -1,16 +1,74 @@
 import numpy as np
-from copy import deepcopy
+from copy import copy, deepcopy
 
 import torch
 from cheetah.accelerator import Segment, Screen
 from cheetah.particles import ParticleBeam
 from matplotlib import pyplot as plt
 
+from simulation_server.virtual_accelerator.artifact_cache import load_lattice
+from simulation_server.virtual_accelerator.linear_optics import (
+    READBACK_CLASSES,
+    LinearOptics,
+)
 from simulation_server.virtual_accelerator.pv_mapping import (
+    TRACKED_ATTRIBUTES,
+    VIEW_ATTRIBUTES,
     access_cheetah_attribute,
     get_pv_mad_mapping,
 )
-from simulation_server.virtual_accelerator.utils import add_noise
+from simulation_server.virtual_accelerator.screen_renderer import make_renderer
+from simulation_server.virtual_accelerator.utils import (
+    DEFAULT_CAMERA_GAIN,
+    add_noise,
+    camera_format,
+)
+
+# How the lattice is tracked
+#   eager     - plain PyTorch, with autograd bookkeeping the server never uses
+#   inference - under torch.inference_mode
+#   compiled  - under torch.inference_mode, compiled with torch.compile on first use
+EXECUTION_MODES = ("eager", "inference", "compiled")
+
+# Floating point precision of the lattice, beam and readbacks
+PRECISIONS = {"float32": torch.float32, "float64": torch.float64}
+
+
+def _track(lattice, incoming):
+    return lattice.track(incoming=incoming)
+
+
+class SimulationPreempted(Exception):
+    """Tracking was abandoned because newer writes make its results obsolete"""
+
+
+def _preemptible_chunks(lattice) -> list:
+    """
+    Split a lattice after each element that can not be skipped. Tracking the chunks in turn
+    does exactly what tracking the lattice does, as the runs of skippable elements Cheetah
+    merges never span a chunk boundary.
+    """
+    chunks, chunk = [], []
+    for element in lattice.elements:
+        chunk.append(element)
+        if not element.is_skippable:
+            chunks.append(Segment(elements=chunk))
+            chunk = []
+    if chunk:
+        chunks.append(Segment(elements=chunk))
+    return chunks
+
+
+# Shared by all accelerators of the process, so new lattices (resets, sessions) reuse
+# the compiled code where torch.compile's guards allow it
+_compiled_track = None
+
+
+def _get_compiled_track():
+    global _compiled_track
+    if _compiled_track is None:
+        _compiled_track = torch.compile(_track)
+    return _compiled_track
 
 
 class VirtualAccelerator:
@@ -22,7 +80,13 @@ class VirtualAccelerator:
         beam_shutter_pv=None,
         monitor_overview=False,
         measurement_noise_level=None,
-        subcell_dest= None
+        subcell_dest= None,
+        screen_params=None,
+        pristine_copy=True,
+        linear_readbacks=(),
+        execution_mode="eager",
+        precision="float32",
+        cache_dir=None,
     ):
         """
         Virtual accelerator class based on cheetah beam dynamics simulations.
@@ -45,39 +109,87 @@ class VirtualAccelerator:
         measurement_noise_level : float, optional
             If provided, adds realistic noise to measurements.
             See `simulation_server.virtual_accelerator.utils.add_noise` for details.
+        subcell_dest : str, optional
+            If provided, only simulate the lattice up to this element.
+        screen_params : dict, optional
+            Per-screen parameters keyed by upper-case screen name, see
+            `simulation_server.utils.default_params`. Used for the camera output
+            dtype and bit depth.
+        pristine_copy : bool, optional
+            Keep an untouched copy of the lattice in memory, so `reset` does not
+            have to parse the lattice file again.
+        linear_readbacks : tuple[str], optional
+            Readback classes (keys of `linear_optics.READBACK_CLASSES`) computed from
+            cached first-order transfer maps instead of tracking. While only those are
+            read, setting PVs does not track.
+        execution_mode : str, optional
+            How the lattice is tracked, one of `EXECUTION_MODES`. "compiled" compiles the
+            tracking during the first simulation, which takes a while.
+        precision : str, optional
+            Floating point precision of the simulation, one of `PRECISIONS`. The lattice
+            and (a copy of) the initial beam are cast to it.
+        cache_dir : str, optional
+            Directory of the binary lattice cache, see `artifact_cache`. If not provided,
+            the lattice file is parsed every time.
 
         """
         self.lattice_file = lattice_file
         self.mapping_file = mapping_file
         self.measurement_noise_level = measurement_noise_level
+        self.subcell_dest = subcell_dest
+        self.cache_dir = cache_dir
+        self.screen_params = screen_params or {}
+        if execution_mode not in EXECUTION_MODES:
+            raise ValueError(
+                f"Unknown execution mode {execution_mode}, expected one of {EXECUTION_MODES}"
+            )
+        self.execution_mode = execution_mode
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision {precision}, expected one of {list(PRECISIONS)}")
+        self.dtype = PRECISIONS[precision]
+        for name in linear_readbacks:
+            if name not in READBACK_CLASSES:
+                raise ValueError(
+                    f"Unknown readback class {name}, expected one of {list(READBACK_CLASSES)}"
+                )
+        self._linear_attributes = {
+            (READBACK_CLASSES[name][0], attribute)
+            for name in linear_readbacks
+            for attribute in READBACK_CLASSES[name][1]
+        }
 
-        lattice = Segment.from_lattice_json(lattice_file)
-
-        # change screen reading method to histogram
-        for ele in lattice.elements:
-            if isinstance(ele, Screen):
-                ele.method = "histogram"
-
-        self.lattice = lattice
-        if subcell_dest:
-            self.lattice = lattice.subcell(end=subcell_dest)
+        self.lattice = load_lattice(lattice_file, self.dtype, subcell_dest, cache_dir)
+        self._configure_screens()
+        self.element_index = self._index_elements()
+        self._pristine_lattice = deepcopy(self.lattice) if pristine_copy else None
 
         self.mapping = get_pv_mad_mapping(mapping_file)
 
+        # Cheetah may leave some of the beam's tensors in its default precision
+        beam = initial_beam_distribution
+        if any(t.dtype != self.dtype for t in (beam.particles, beam.energy, beam.particle_charges)):
+            initial_beam_distribution = beam.clone().to(self.dtype)
         self.initial_beam_distribution = initial_beam_distribution
         self.initial_beam_distribution_charge = (
             initial_beam_distribution.particle_charges
         )
+        # Set while the initial beam is shared with clones, see clone()
+        self._beam_shared = False
         self.monitor_overview = monitor_overview
 
         # store the beam shutter PV name
         self.beam_shutter_pv = beam_shutter_pv
 
-        # do a first run to populate readings
-        self.lattice.track(incoming=self.initial_beam_distribution)
+        # do a first run to populate readings, this also warms up compiled tracking
+        if execution_mode == "compiled":
+            print("Compiling the tracking")
+        self._track_lattice()
 
         # compute the energy
         self.beam_energy_along_lattice = self.get_energy()
+        # False while readings are behind the lattice settings, see get_pvs
+        self._tracked = True
+        self.linear_optics = self._linear_optics()
 
         if self.monitor_overview:
             self._monitor_index = 0
@@ -85,13 +197,128 @@ class VirtualAccelerator:
             self.lattice.plot_overview(incoming=self.initial_beam_distribution, fig=fig)
             fig.savefig(f"simulation_overview_{self._monitor_index:04d}.png")
 
+    def _configure_screens(self, lattice=None):
+        """
+        Read screens out with their renderer (histograms by default), quantized to their
+        camera's output format
+        """
+        lattice = self.lattice if lattice is None else lattice
+        for ele in lattice.elements:
+            if isinstance(ele, Screen):
+                params = self.screen_params.get(ele.name.upper(), {})
+                ele.method = "histogram"
+                ele.camera_dtype, ele.bit_depth = camera_format(params)
+                ele.camera_gain = params.get("gain", DEFAULT_CAMERA_GAIN)
+                ele.renderer = make_renderer(params)
+
+    def _index_elements(self) -> dict:
+        """Position of every element along the lattice, the first one for duplicate names"""
+        element_index = {}
+        for i, ele in enumerate(self.lattice.elements):
+            element_index.setdefault(ele.name, i)
+        return element_index
+
+    def _track_lattice(self, preempt=None):
+        """
+        Track the initial beam through the lattice in the execution mode. If `preempt` is
+        given, it is called before every element that can not be skipped (only before
+        tracking starts in compiled mode), and tracking raises `SimulationPreempted` as
+        soon as it returns True. The readings are then incomplete until the next track.
+        """
+        if preempt is not None and self.execution_mode != "compiled":
+            with torch.inference_mode(self.execution_mode == "inference"):
+                beam = self.initial_beam_distribution
+                for chunk in _preemptible_chunks(self.lattice):
+                    if preempt():
+                        raise SimulationPreempted()
+                    beam = chunk.track(beam)
+            return
+        if preempt is not None and preempt():
+            raise SimulationPreempted()
+
+        if self.execution_mode == "eager":
+            self.lattice.track(incoming=self.initial_beam_distribution)
+            return
+        track = _get_compiled_track() if self.execution_mode == "compiled" else _track
+        with torch.inference_mode():
+            track(self.lattice, self.initial_beam_distribution)
+
+    def _linear_optics(self) -> LinearOptics | None:
+        if not self._linear_attributes:
+            return None
+        return LinearOptics(
+            self.lattice, self.initial_beam_distribution, self.beam_energy_along_lattice
+        )
+
+    def _pv_element(self, pv_name: str):
+        """Element (the first one for duplicate names) and attribute a PV refers to, None if unmapped"""
+        base_pv_name = ":".join(pv_name.split(":")[:3])
+        if base_pv_name not in self.mapping:
+            return None
+        element = getattr(self.lattice, self.mapping[base_pv_name].lower(), None)
+        if isinstance(element, list):
+            element = element[0]
+        if element is None:
+            return None
+        return element, ":".join(pv_name.split(":")[3:])
+
+    def is_tracked_readback(self, pv_name: str) -> bool:
+        """Whether the value of a PV comes from tracking the beam, such as BPM and screen readings"""
+        found = self._pv_element(pv_name)
+        if found is None:
+            return False
+        element, attribute = found
+        return attribute in TRACKED_ATTRIBUTES.get(type(element).__name__, ())
+
+    def view_readbacks(self, pv_name: str) -> list | None:
+        """
+        Readbacks a setpoint changes if it only changes how readings are served, such as the
+        region of interest of a screen, None if it changes the beam
+        """
+        found = self._pv_element(pv_name)
+        if found is None:
+            return None
+        element, attribute = found
+        readbacks = VIEW_ATTRIBUTES.get(type(element).__name__, {}).get(attribute)
+        if readbacks is None:
+            return None
+        base_pv_name = ":".join(pv_name.split(":")[:3])
+        return [f"{base_pv_name}:{readback}" for readback in readbacks]
+
+    def _linear_readback(self, pv_name: str):
+        """Value of a PV from the linear optics, None if it is not served by them"""
+        found = self._pv_element(pv_name)
+        if found is None:
+            return None
+        element, attribute = found
+        if (type(element).__name__, attribute) not in self._linear_attributes:
+            return None
+        return self.linear_optics.readback(self.element_index[element.name], attribute)
+
+    def get_pv_position(self, pv_name: str) -> int | None:
+        """
+        Get the position along the lattice of the element a PV belongs to.
+        Returns None for PVs that are not tied to an element, such as the beam shutter,
+        simulation reset and unmapped PVs.
+        """
+        if pv_name == self.beam_shutter_pv:
+            return None
+        base_pv_name = ":".join(pv_name.split(":")[:3])
+        if base_pv_name not in self.mapping:
+            return None
+        return self.element_index.get(self.mapping[base_pv_name].lower())
+
     def reset(self):
         """reset the simulation"""
         print("resetting the simulation")
 
-        self.lattice = Segment.from_lattice_json(self.lattice_file)
-        self.mapping = get_pv_mad_mapping(self.mapping_file)
-        self.lattice.track(incoming=self.initial_beam_distribution)
+        self.lattice = self._fresh_lattice()
+        if self._pristine_lattice is None:
+            self.mapping = get_pv_mad_mapping(self.mapping_file)
+        self.element_index = self._index_elements()
+        self._track_lattice()
+        self._tracked = True
+        self.linear_optics = self._linear_optics()
 
         if self.monitor_overview:
             self._monitor_index = 0
@@ -99,6 +326,33 @@ class VirtualAccelerator:
             self.lattice.plot_overview(incoming=self.initial_beam_distribution, fig=fig)
             fig.savefig(f"simulation_overview_{self._monitor_index:04d}.png")
 
+    def _fresh_lattice(self) -> Segment:
+        """Lattice in its initial state, copied from memory if a pristine copy is kept"""
+        if self._pristine_lattice is not None:
+            return deepcopy(self._pristine_lattice)
+        lattice = load_lattice(self.lattice_file, self.dtype, self.subcell_dest, self.cache_dir)
+        self._configure_screens(lattice)
+        return lattice
+
+    def clone(self):
+        """
+        Create an independent accelerator in the initial state of this one, for example
+        for another user session. The parsed lattice, mapping, beam energies and initial
+        beam are shared; the initial beam is only copied once either of them changes it.
+
+        Returns
+        -------
+        VirtualAccelerator
+            New accelerator with its own lattice
+        """
+        va = copy(self)
+        va.lattice = self._fresh_lattice()
+        self._beam_shared = va._beam_shared = True
+        va._track_lattice()
+        va._tracked = True
+        va.linear_optics = va._linear_optics()
+        return va
+
     def get_energy(self):
         """
         Get the energy of the beam in the virtual accelerator simulator at
@@ -107,7 +361,7 @@ class VirtualAccelerator:
         Note: need to track on a copy of the lattice to not influence readings!
         """
         test_beam = ParticleBeam(
-            torch.zeros(1, 7), energy=self.initial_beam_distribution.energy
+            torch.zeros(1, 7, dtype=self.dtype), energy=self.initial_beam_distribution.energy
         )
         test_lattice = deepcopy(self.lattice)
         element_names = [e.name for e in test_lattice.elements]
@@ -123,20 +377,32 @@ class VirtualAccelerator:
         Set the beam shutter state in the virtual accelerator simulator.
         If `value` is True, the shutter is closed (no beam), otherwise it is open (beam present).
         """
+        if self._beam_shared:
+            self.initial_beam_distribution = deepcopy(self.initial_beam_distribution)
+            self._beam_shared = False
+
         if value:
-            self.initial_beam_distribution.particle_charges = torch.tensor(0.0)
+            self.initial_beam_distribution.particle_charges = torch.zeros_like(
+                self.initial_beam_distribution_charge
+            )
         else:
             self.initial_beam_distribution.particle_charges = (
                 self.initial_beam_distribution_charge
             )
 
         # run the simulation to update readings
-        self.lattice.track(incoming=self.initial_beam_distribution)
+        self._track_lattice()
+        self._tracked = True
 
-    def set_pvs(self, values: dict):
+    def set_pvs(self, values: dict, track: bool = True):
         """
         Set the corresponding process variable (PV) to the given value on the virtual accelerator simulator.
+        With `track=False` only the lattice is changed, readings stay those of the last `track`
+        (see `update_readings`). With linear readbacks, tracking waits until a readback needs it
+        (see `get_pvs`). Setpoints that do not change the beam (see `view_readbacks`) never
+        need tracking.
         """
+        changed = False
         for pv_name, value in values.items():
             # handle the beam shutter separately
             if pv_name == self.beam_shutter_pv:
@@ -178,13 +444,45 @@ class VirtualAccelerator:
                     access_cheetah_attribute(element, attribute_name, energy, value)
                 except ValueError as e:
                     raise ValueError(f"Failed to set PV {pv_name}: {str(e)}") from e
+                if attribute_name in VIEW_ATTRIBUTES.get(type(element).__name__, ()):
+                    continue
+                changed = True
+                if self.linear_optics is not None:
+                    self.linear_optics.invalidate(element.name)
 
             else:
                 raise ValueError(f"Invalid PV base name: {base_pv_name}")
 
         # at the end of setting all PVs, run the simulation with the initial beam distribution
         # this will update all readings (screens, BPMs, etc.) in the lattice
-        self.lattice.track(incoming=self.initial_beam_distribution)
+        if changed:
+            self._tracked = False
+        if track and not self._tracked and (self.linear_optics is None or self.monitor_overview):
+            self.track()
+
+    def update_readings(self, preempt=None, readbacks=()):
+        """
+        Track after `set_pvs(..., track=False)` if the lattice changed, unless linear
+        readbacks defer tracking until a readback needs it: then only if one of `readbacks`
+        (PVs about to be read) is not served by the linear optics, so that all of them come
+        from the same kind of simulation. See `_track_lattice` for `preempt`.
+        """
+        if self._tracked:
+            return
+        if (
+            self.linear_optics is None
+            or self.monitor_overview
+            or any(self.is_tracked_readback(k) and self._linear_readback(k) is None for k in readbacks)
+        ):
+            self.track(preempt)
+
+    def track(self, preempt=None):
+        """
+        Track the initial beam through the lattice to update all readings. See
+        `_track_lattice` for `preempt`.
+        """
+        self._track_lattice(preempt)
+        self._tracked = True
 
         if self.monitor_overview:
             self._monitor_index += 1
@@ -192,13 +490,29 @@ class VirtualAccelerator:
             self.lattice.plot_overview(incoming=self.initial_beam_distribution, fig=fig)
             fig.savefig(f"simulation_overview_{self._monitor_index:04d}.png")
 
-    def get_pvs(self, pv_names: list):
+    def get_pvs(self, pv_names: list, preempt=None):
         """
         Get the current value of the specified process variable (PV) from the virtual accelerator simulator.
+        Readings behind the lattice settings are served by the linear optics where selected,
+        otherwise the lattice is tracked first (see `_track_lattice` for `preempt`).
         """
 
+        linear = {}
+        if not self._tracked:
+            for pv_name in pv_names:
+                value = self._linear_readback(pv_name)
+                if value is not None:
+                    linear[pv_name] = value
+            if any(self.is_tracked_readback(k) for k in pv_names if k not in linear):
+                self.track(preempt)
+                linear = {}
+
         values = {}
         for pv_name in pv_names:
+            if pv_name in linear:
+                values[pv_name] = linear[pv_name]
+                continue
+
             # handle the beam shutter separately
             if pv_name == self.beam_shutter_pv:
                 values[pv_name] = torch.all(
@@ -243,13 +557,15 @@ class VirtualAccelerator:
             else:
                 raise ValueError(f"Invalid PV base name: {base_pv_name}")
 
-        # sanitize outputs
+        # sanitize outputs, images stay numpy arrays of their camera dtype
         for name, ele in values.items():
             if isinstance(ele, torch.Tensor):
                 if ele.shape == torch.Size([]):
                     values[name] = ele.item()
                 elif len(ele.shape) > 0:
                     values[name] = ele.flatten().tolist()
+            elif isinstance(ele, np.ndarray):
+                values[name] = ele.ravel()
 
         # add noise to signals if requested
         if self.measurement_noise_level is not None:
@@ -259,5 +575,11 @@ class VirtualAccelerator:
                         np.array(ele), noise_level=self.measurement_noise_level
                     )
                     values[name] = noisy_signal.tolist()
+                elif isinstance(ele, np.ndarray):
+                    noisy_signal = add_noise(ele, noise_level=self.measurement_noise_level)
+                    if np.issubdtype(ele.dtype, np.integer):
+                        info = np.iinfo(ele.dtype)
+                        noisy_signal = np.clip(np.rint(noisy_signal), info.min, info.max)
+                    values[name] = noisy_signal.astype(ele.dtype)
 
         return values